@@ -1,77 +1,79 @@
 import xml.etree.ElementTree as ET
 import logging
 import os
-from datetime import datetime
-from xml.dom import minidom
-from ISO20022_Pacs002_Generator import generate_pacs002_message
-from ISO20022_Camt054_Generator import generate_camt054_message
+from ISO20022_Serializer import write_message
+from ISO20022_Pacs002_Generator import generate_pacs002_message, render_pacs002_message
+from ISO20022_Camt054_Generator import render_camt054_message
+from RTR_Message_Transport import MessageArchiver, load_message, describe_message
+from RTR_Message_Archive import PACS002_RECEIVER_RESPONSE, CAMT054
+from RTR_Message_Ids import next_id
+from ISO20022_Extractors import PACS008_EXTRACTOR
 
 class ReceiverBankSimulator:
+    def __init__(self, archiver=None):
+        self.archiver = archiver or MessageArchiver()
+
     def save_receiver_pacs002(self, tree, debtor_bic):
-        if not os.path.exists("messages/pacs002/receiver_response"):
-            os.makedirs("messages/pacs002/receiver_response")
+        os.makedirs("messages/pacs002/receiver_response", exist_ok=True)
             
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"messages/pacs002/receiver_response/response_to_{debtor_bic}_{timestamp}.xml"
+        filename = f"messages/pacs002/receiver_response/response_to_{debtor_bic}_{next_id()}.xml"
         
         # Save with pretty printing
-        rough_string = ET.tostring(tree.getroot(), 'utf-8')
-        reparsed = minidom.parseString(rough_string)
-        pretty_xml = reparsed.toprettyxml(indent="  ")
-        
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(pretty_xml)
+        write_message(tree, filename)
             
-        logging.info(f"Receiver PACS.002 response saved to {filename}")
+        logging.info("Receiver PACS.002 response saved to %s", filename)
         return filename
 
     def process_incoming_pacs008(self, pacs008_filename):
-        logging.info(f"Receiver Bank processing incoming PACS.008: {pacs008_filename}")
+        """Accept a forwarded PACS.008 given as a file path or an ElementTree.
+
+        Returns (True, response) where response is the saved PACS.002 filename,
+        or the PACS.002 tree itself when the PACS.008 was passed in memory.
+        """
+        logging.info("Receiver Bank processing incoming PACS.008: %s", describe_message(pacs008_filename))
         try:
-            tree = ET.parse(pacs008_filename)
-            root = tree.getroot()
+            fields, problem = PACS008_EXTRACTOR.extract(load_message(pacs008_filename))
+            if problem:
+                raise ValueError(f"PACS.008 field {problem[1]} is {problem[0]}")
+            msg_id, debtor = fields["msg_id"], fields["debtor"]
             
-            msg_id = root.find(".//MsgId").text
-            debtor = root.find(".//Debtor").text
-            
-            # Generate acceptance PACS.002
-            pacs002_tree = generate_pacs002_message(msg_id, "ACCP", "Payment accepted by receiver")
-            pacs002_filename = self.save_receiver_pacs002(pacs002_tree, debtor)
+            # Generate acceptance PACS.002; a tree is only needed when handing it back in memory
+            if not isinstance(pacs008_filename, str):
+                pacs002_tree = generate_pacs002_message(msg_id, "ACCP", "Payment accepted by receiver")
+                self.archiver.archive_message(PACS002_RECEIVER_RESPONSE, self.save_receiver_pacs002, pacs002_tree, debtor)
+                logging.info("Receiver Bank sent PACS.002 acceptance for message %s", msg_id)
+                return True, pacs002_tree
+
+            pacs002_xml = render_pacs002_message(msg_id, "ACCP", "Payment accepted by receiver")
+            pacs002_filename = self.archiver.archive_message(PACS002_RECEIVER_RESPONSE, self.save_receiver_pacs002, pacs002_xml, debtor)
             
-            logging.info(f"Receiver Bank sent PACS.002 acceptance for message {msg_id}")
+            logging.info("Receiver Bank sent PACS.002 acceptance for message %s", msg_id)
             return True, pacs002_filename
             
         except Exception as e:
-            logging.error(f"Receiver Bank processing error: {str(e)}")
+            logging.error("Receiver Bank processing error: %s", e)
             return False, str(e)
 
     def handle_settlement_completion(self, msg_id, creditor, amount):
         """Handle settlement completion and generate CAMT.054"""
-        logging.info(f"Receiver Bank handling settlement completion for {creditor}")
+        logging.info("Receiver Bank handling settlement completion for %s", creditor)
         try:
             # Generate and send CAMT.054 credit notification
-            camt054_tree = generate_camt054_message(creditor, amount, msg_id)
-            camt054_filename = self.save_camt054(camt054_tree, creditor)
-            logging.info(f"Generated and sent CAMT.054 to {creditor}")
+            camt054_xml = render_camt054_message(creditor, amount, msg_id)
+            camt054_filename = self.archiver.archive_message(CAMT054, self.save_camt054, camt054_xml, creditor)
+            logging.info("Generated and sent CAMT.054 to %s", creditor)
             return True, camt054_filename
         except Exception as e:
-            logging.error(f"Error generating CAMT.054: {str(e)}")
+            logging.error("Error generating CAMT.054: %s", e)
             return False, str(e)
 
     def save_camt054(self, tree, creditor_bic):
         """Save CAMT.054 message to file"""
-        if not os.path.exists("messages/camt054"):
-            os.makedirs("messages/camt054")
+        os.makedirs("messages/camt054", exist_ok=True)
             
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"messages/camt054/camt054_{creditor_bic}_{timestamp}.xml"
-        
-        rough_string = ET.tostring(tree.getroot(), 'utf-8')
-        reparsed = minidom.parseString(rough_string)
-        pretty_xml = reparsed.toprettyxml(indent="  ")
+        filename = f"messages/camt054/camt054_{creditor_bic}_{next_id()}.xml"
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(pretty_xml)
+        write_message(tree, filename)
             
-        logging.info(f"CAMT.054 saved to {filename}")
+        logging.info("CAMT.054 saved to %s", filename)
         return filename
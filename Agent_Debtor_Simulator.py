@@ -1,29 +1,101 @@
+import logging
 import xml.etree.ElementTree as ET
-from ISO20022_Pacs008_Generator import generate_iso20022_message, save_message
+from ISO20022_Pacs008_Generator import (
+    generate_iso20022_message,
+    render_iso20022_message,
+    save_message,
+    generate_bulk_pacs008_message,
+    save_bulk_message
+)
+from RTR_Message_Transport import FILE_TRANSPORT, MEMORY_TRANSPORT, MessageArchiver, load_message, describe_message
+from RTR_Message_Archive import PACS008
+from RTR_Message_Ids import next_id
+from ISO20022_Extractors import PAIN001_EXTRACTOR, parse_amount
 
 class FISimulator:
+    def __init__(self, transport=FILE_TRANSPORT, archiver=None, batch_size=1000):
+        # With MEMORY_TRANSPORT the PACS.008 is returned as a tree and only archived to messages/
+        self.transport = transport
+        self.archiver = archiver or MessageArchiver()
+        # Most transactions per bulk PACS.008 built by process_pain001_batch
+        self.batch_size = batch_size
+
     def process_pain001(self, pain001_filename):
+        """Turn a PAIN.001 (file path or ElementTree) into a PACS.008 filename, or tree with the memory transport."""
         try:
-            # Parse the PAIN.001 message
-            tree = ET.parse(pain001_filename)
-            root = tree.getroot()
-            
-            # Extract payment information
-            debtor = root.find(".//Dbtr/Nm").text
-            debtor_agt = root.find(".//DbtrAgt/FinInstnId").text
-            creditor = root.find(".//Cdtr/Nm").text
-            creditor_agt = root.find(".//CdtrAgt/FinInstnId").text
-            amount = float(root.find(".//Amt").text)
+            # Parse the PAIN.001 message and extract payment information in one pass
+            fields, problem = PAIN001_EXTRACTOR.extract(load_message(pain001_filename))
+            if problem:
+                raise ValueError(f"PAIN.001 field {problem[1]} is {problem[0]}")
+            debtor, debtor_agt = fields["debtor"], fields["debtor_agent"]
+            creditor, creditor_agt = fields["creditor"], fields["creditor_agent"]
+            amount = fields["amount"]
             
             # Create payment info dictionary
             payer = {"name": debtor, "bic_code": debtor_agt}
             payee = {"name": creditor, "bic_code": creditor_agt}
             
             # Generate and save PACS.008 message
-            pacs008_tree = generate_iso20022_message(payer, payee, amount)
-            pacs008_filename = save_message(pacs008_tree, debtor, creditor)
+            if self.transport == MEMORY_TRANSPORT:
+                pacs008_tree = generate_iso20022_message(payer, payee, amount)
+                self.archiver.archive_message(PACS008, save_message, pacs008_tree, debtor, creditor)
+                return True, pacs008_tree
+            # The exchange re-parses the file, so render the text straight from the template
+            pacs008_filename = save_message(render_iso20022_message(payer, payee, amount), debtor, creditor)
             
             return True, pacs008_filename
             
         except Exception as e:
             return False, f"FI Processing Error: {str(e)}"
+
+    def process_pain001_batch(self, pain001_filename):
+        """Turn a multi-transaction PAIN.001 into bulk PACS.008 messages for the exchange.
+
+        Transactions are grouped by debtor and creditor agent pair, in their
+        original order, and each group is split into bulk PACS.008 messages of
+        at most batch_size transactions. A transaction with an invalid amount
+        is logged and left out. Returns (True, list of PACS.008 filenames, or
+        trees with the memory transport) for RTRExchangeProcessor.process_bulk_message.
+        """
+        try:
+            root = load_message(pain001_filename).getroot()
+
+            # Step 1: Collect the credit transfers per debtor and creditor agent pair
+            groups = {}
+            for pmt_inf in root.iter("PmtInf"):
+                debtor = pmt_inf.findtext("Dbtr/Nm")
+                debtor_agt = pmt_inf.findtext("DbtrAgt/FinInstnId")
+                for cdt_trf_tx_inf in pmt_inf.iter("CdtTrfTxInf"):
+                    creditor_agt = cdt_trf_tx_inf.findtext("CdtrAgt/FinInstnId")
+                    end_to_end_id = cdt_trf_tx_inf.findtext("PmtId/EndToEndId") or next_id("E2E-")
+                    try:
+                        amount = parse_amount(cdt_trf_tx_inf.findtext("Amt") or "")
+                    except ValueError as e:
+                        logging.error("FI Processing Error: invalid amount in transaction %s of %s: %s", end_to_end_id, describe_message(pain001_filename), e)
+                        continue
+                    groups.setdefault((debtor_agt, creditor_agt), []).append({
+                        "end_to_end_id": end_to_end_id,
+                        "amount": amount,
+                        "debtor": debtor,
+                        "debtor_bic": debtor_agt,
+                        "creditor": cdt_trf_tx_inf.findtext("Cdtr/Nm"),
+                        "creditor_bic": creditor_agt,
+                    })
+
+            # Step 2: Build one bulk PACS.008 per batch
+            messages = []
+            for (debtor_agt, creditor_agt), transactions in groups.items():
+                for start in range(0, len(transactions), self.batch_size):
+                    pacs008_tree = generate_bulk_pacs008_message(transactions[start:start + self.batch_size])
+                    if self.transport == MEMORY_TRANSPORT:
+                        self.archiver.archive_message(PACS008, save_bulk_message, pacs008_tree, debtor_agt, creditor_agt)
+                        messages.append(pacs008_tree)
+                    else:
+                        messages.append(save_bulk_message(pacs008_tree, debtor_agt, creditor_agt))
+
+            logging.info("Debtor agent split %s credit transfers into %s bulk PACS.008 messages",
+                         sum(len(transactions) for transactions in groups.values()), len(messages))
+            return True, messages
+
+        except Exception as e:
+            return False, f"FI Processing Error: {str(e)}"
@@ -1,13 +1,51 @@
 import re
+import io
+import csv
 import json
+import shutil
+import argparse
+import textwrap
 from datetime import datetime
 import os
-import pandas as pd
 import logging
+from RTR_Logging import flush_logging
+from RTR_Message_Ids import next_id
+from RTR_Event_Stream import (EVENT_STREAM_FILE, flush_events, read_events, PACS008_CREATED, PACS008_REJECTED,
+                              FORWARDED, RECEIVER_RESPONSE, ROUTING_FAILED, SETTLEMENT)
+from RTR_Net_Settlement import ACCEPTED
+from RTR_Liquidity_Queue import QUEUED
+
+try:
+    import pandas as pd
+except ImportError:     # Without pandas the ETL writes the Tableau CSV with the csv module
+    pd = None
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:     # Parquet output needs pyarrow; without it the ETL writes the CSV only
+    pq = None
 
 # File paths
+LOG_FILE = 'settlement_log.txt'
 INPUT_FILE = 'output/parsed_transactions.json'
 OUTPUT_FILE = 'output/transaction data.csv'
+STATE_FILE = 'output/etl_state.json'
+DATASET_DIR = 'output/transactions'                 # date=YYYY-MM-DD/part-<id>.parquet
+MANIFEST_FILE = 'output/transactions/manifest.jsonl'
+PARQUET_COMPRESSION = 'zstd'
+
+# Output formats
+PARQUET = 'parquet'     # date-partitioned Parquet dataset plus the Tableau CSV
+CSV = 'csv'             # Tableau CSV only
+DEFAULT_FORMAT = PARQUET if pq is not None and pd is not None else CSV
+
+CSV_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Statuses of payments that settle later; their row is written once they do
+DEFERRED_STATUSES = {ACCEPTED, QUEUED}
+
+CSV_COLUMNS = ['timestamp', 'transaction_id', 'sender', 'receiver', 'amount', 'status',
+               'sender_bic', 'receiver_bic', 'status_clean']
 
 FAKE_BIC_MAP = {
     'ABC Corporation': 'BOFCUS3NXXX',
@@ -15,58 +53,193 @@ FAKE_BIC_MAP = {
     'Wallet LLC': 'TDOMCATTTOR'
 }
 
-def parse_log_file(log_file_path):
+BIC_PATTERN = re.compile(r"^[A-Z]{6}[A-Z0-9]{2}(?:[A-Z0-9]{3})?$")
+
+def party_bic(party):
+    """BIC of a GUI user, or the party itself when the exchange logged it by BIC."""
+    if party in FAKE_BIC_MAP:
+        return FAKE_BIC_MAP[party]
+    if isinstance(party, str) and BIC_PATTERN.match(party):
+        return party
+    return 'UNKNOWN'
+
+def new_parse_state():
+    """Fields of the transaction currently being assembled from the log, and transactions settling out of line."""
+    return {"transaction_id": None, "sender": None, "receiver": None, "amount": None, "notifying": False,
+            "deferred": {}, "settled_early": {}}
+
+def parse_log_lines(lines, state):
+    """Parse log lines into transactions, carrying a partial transaction in state."""
     parsed_data = []
-    transaction_id = None
-    sender = receiver = amount = status = None
+    deferred = state.setdefault("deferred", {})
+    # Held payments can be released before their own status line is written
+    settled_early = state.setdefault("settled_early", {})
+
+    for line in lines:
+        match = re.match(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - (.+)$", line)
+        if match:
+            timestamp_str, message = match.groups()
+            timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S,%f")
+
+            if "Initiating payment from" in message:
+                parts = re.findall(r"from (.+?) to (.+?) for amount (\d+\.\d+)", message)
+                if parts:
+                    state["sender"], state["receiver"], state["amount"] = parts[0]
+
+            elif "Initiating settlement for payment of" in message:
+                # The exchange names the parties by BIC; payments from the GUI already have user names
+                parts = re.findall(r"payment of (\S+) from (\S+) to (\S+)$", message)
+                if parts:
+                    state["amount"] = parts[0][0]
+                    if state.get("sender") is None:
+                        state["sender"], state["receiver"] = parts[0][1:]
+
+            elif "Sending settlement completion notifications" in message:
+                state["notifying"] = True
+            elif "Settlement notifications sent" in message:
+                state["notifying"] = False
+
+            elif "Generating PACS.002 acknowledgment for message" in message:
+                # Notifications for other payments must not replace the id of the one in flight
+                tx_id_match = re.search(r"message (\S+)", message)
+                if tx_id_match and not state.get("notifying"):
+                    state["transaction_id"] = tx_id_match.group(1)
 
+            elif message.startswith("Settlement status"):
+                # "Settlement status for message <MsgId>: <status>"; older logs omit the MsgId
+                status_match = re.search(r"^Settlement status(?: for message (\S+))?: (.+)$", message)
+                if status_match:
+                    transaction_id = status_match.group(1) or state["transaction_id"]
+                    status = status_match.group(2)
+
+                    # Save the complete transaction, or keep it until its deferred settlement line
+                    transaction = {
+                        "transaction_id": transaction_id,
+                        "sender": state["sender"],
+                        "receiver": state["receiver"],
+                        "amount": float(state["amount"]) if state["amount"] is not None else None
+                    }
+                    if status in DEFERRED_STATUSES:
+                        if transaction_id in settled_early:
+                            settled_str, status = settled_early.pop(transaction_id)
+                            settled_at = datetime.strptime(settled_str, "%Y-%m-%d %H:%M:%S,%f")
+                            parsed_data.append({"timestamp": settled_at, **transaction, "status": status})
+                        else:
+                            deferred[transaction_id] = transaction
+                    else:
+                        parsed_data.append({"timestamp": timestamp, **transaction, "status": status})
+
+                    # Reset for next transaction
+                    state.update(transaction_id=None, sender=None, receiver=None, amount=None)
+
+            elif "Deferred settlement of message" in message:
+                settled_match = re.search(r"Deferred settlement of message (\S+): (.+)$", message)
+                if settled_match:
+                    transaction_id, status = settled_match.groups()
+                    transaction = deferred.pop(transaction_id, None)
+                    if transaction is not None:
+                        parsed_data.append({"timestamp": timestamp, **transaction, "status": status})
+                    else:
+                        settled_early[transaction_id] = (timestamp_str, status)
+
+    return parsed_data
+
+def parse_log_file(log_file_path):
     with open(log_file_path, 'r') as file:
-        for line in file:
-            match = re.match(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - (.+)$", line)
-            if match:
-                timestamp_str, message = match.groups()
-                timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S,%f")
-
-                if "Initiating payment from" in message:
-                    parts = re.findall(r"from (.+?) to (.+?) for amount (\d+\.\d+)", message)
-                    if parts:
-                        sender, receiver, amount = parts[0]
-
-                elif "Generating PACS.002 acknowledgment for message" in message:
-                    tx_id_match = re.search(r"message (\S+)", message)
-                    if tx_id_match:
-                        transaction_id = tx_id_match.group(1)
-
-                elif "Settlement status:" in message:
-                    status_match = re.search(r"Settlement status: (.+)$", message)
-                    if status_match:
-                        status = status_match.group(1)
-
-                        # Save the complete transaction
-                        parsed_data.append({
-                            "timestamp": timestamp,
-                            "transaction_id": transaction_id,
-                            "sender": sender,
-                            "receiver": receiver,
-                            "amount": float(amount),
-                            "status": status
-                        })
-
-                        # Reset for next transaction
-                        transaction_id = sender = receiver = amount = status = None
+        return parse_log_lines(file, new_parse_state())
+
+def new_event_parse_state():
+    """Payments seen in the event stream that have not reached settlement yet."""
+    return {"pending": {}}
+
+def parse_event_lines(lines, state):
+    """Assemble transactions from structured events, joined on their correlation id."""
+    parsed_data = []
+    pending = state["pending"]
+
+    for event in read_events(lines):
+        stage = event["stage"]
+        correlation_id = event["cid"]
+
+        if stage == PACS008_CREATED:
+            pending[correlation_id] = {"sender": event["debtor"], "receiver": event["creditor"]}
+
+        elif stage == FORWARDED:
+            pending.setdefault(correlation_id, {})["transaction_id"] = event["msg_id"]
+
+        elif stage == SETTLEMENT:
+            if event["status"] in DEFERRED_STATUSES:
+                # The row is written from the SETTLEMENT event that follows once it settles
+                continue
+            tx = pending.pop(correlation_id, {})
+            parsed_data.append({
+                "timestamp": datetime.fromtimestamp(event["ts"]),
+                "transaction_id": tx.get("transaction_id"),
+                "sender": tx.get("sender"),
+                "receiver": tx.get("receiver"),
+                "amount": float(event["amount"]),
+                "status": event["status"]
+            })
+
+        elif stage in (PACS008_REJECTED, ROUTING_FAILED) or (stage == RECEIVER_RESPONSE and not event["accepted"]):
+            # The payment never reaches settlement
+            pending.pop(correlation_id, None)
 
     return parsed_data
 
+def parse_event_file(event_file_path):
+    with open(event_file_path, 'r', encoding='utf-8') as file:
+        return parse_event_lines(file, new_event_parse_state())
 
-def enrich_transaction(tx):
-    tx['sender_bic'] = FAKE_BIC_MAP.get(tx['sender'], 'UNKNOWN')
-    tx['receiver_bic'] = FAKE_BIC_MAP.get(tx['receiver'], 'UNKNOWN')
-    try:
-        tx['timestamp'] = pd.to_datetime(tx['timestamp'])
-    except Exception as e:
-        tx['timestamp'] = pd.NaT
-    tx['status_clean'] = 'Success' if 'Success' in tx['status'] else 'Failure'
-    return tx
+# Input file, fresh parser state and line parser for each ETL source
+ETL_SOURCES = {
+    'log': (LOG_FILE, new_parse_state, parse_log_lines),
+    'events': (EVENT_STREAM_FILE, new_event_parse_state, parse_event_lines)
+}
+
+
+def build_frame(transactions):
+    """Typed frame of parsed transactions, enriched and sorted by time."""
+    df = pd.DataFrame(transactions, columns=['timestamp', 'transaction_id', 'sender', 'receiver', 'amount', 'status'])
+    df['sender_bic'] = df['sender'].map(party_bic)
+    df['receiver_bic'] = df['receiver'].map(party_bic)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='mixed', errors='coerce')
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+    df['status_clean'] = df['status'].astype(str).str.contains('Success', regex=False).map({True: 'Success', False: 'Failure'})
+
+    # Optional: sort by time (stable, so equal timestamps keep log order)
+    return df[CSV_COLUMNS].sort_values(by='timestamp', kind='stable')
+
+def format_csv(df):
+    # Fixed millisecond format so appended rows are written like a full rebuild
+    df = df.copy()
+    df['timestamp'] = df['timestamp'].dt.strftime(CSV_TIMESTAMP_FORMAT).str[:-3]
+    return df
+
+def csv_rows(transactions):
+    """The rows format_csv(build_frame(transactions)) writes, built without pandas."""
+    rows = []
+    for tx in transactions:
+        timestamp, amount, status = tx["timestamp"], tx["amount"], tx["status"]
+        rows.append([timestamp, tx["transaction_id"], tx["sender"], tx["receiver"], amount, status,
+                     party_bic(tx["sender"]), party_bic(tx["receiver"]),
+                     'Success' if 'Success' in str(status) else 'Failure'])
+    # Stable, so equal timestamps keep log order; rows without a time go last like pandas' NaT
+    rows.sort(key=lambda row: (row[0] is None, row[0] or datetime.min))
+    for row in rows:
+        if row[0] is not None:
+            row[0] = row[0].strftime(CSV_TIMESTAMP_FORMAT)[:-3]
+    return rows
+
+def write_csv_rows(transactions, rebuild=False):
+    with open(OUTPUT_FILE, 'w' if rebuild else 'a', newline='') as f:
+        writer = csv.writer(f)
+        if rebuild:
+            writer.writerow(CSV_COLUMNS)
+        writer.writerows(csv_rows(transactions))
+
+def transform_transactions(transactions):
+    return format_csv(build_frame(transactions))
 
 def etl_pipeline():
     # Extract
@@ -74,47 +247,231 @@ def etl_pipeline():
         transactions = json.load(f)
 
     # Transform
-    enriched_transactions = [enrich_transaction(tx) for tx in transactions]
-    df = pd.DataFrame(enriched_transactions)
-
-    # Optional: sort by time
-    df = df.sort_values(by='timestamp')
+    df = transform_transactions(transactions)
 
     # Load
     df.to_csv(OUTPUT_FILE, index=False)
     print(f"ETL complete. CSV written to: {OUTPUT_FILE}")
 
-def run_etl():
-    os.makedirs("output", exist_ok=True)
-    logs_path = "settlement_log.txt"
-    parsed_output = parse_log_file(logs_path)
+# === Date-partitioned Parquet dataset ===
+def write_partitions(df, dataset_dir=DATASET_DIR):
+    """Append df to the dataset as one new file per date, then record the files in the manifest.
 
-    with open("output/parsed_transactions.json", "w") as out_file:
-        json.dump(parsed_output, out_file, indent=4, default=str)
+    Files are only listed in the append-only manifest once they are complete,
+    so readers never see a partly written partition.
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    entries = []
+    dates = df['timestamp'].dt.strftime('%Y-%m-%d').fillna('unknown')
+    for date, part in df.groupby(dates, sort=True):
+        relative_path = os.path.join(f"date={date}", f"part-{next_id()}.parquet")
+        path = os.path.join(dataset_dir, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part.to_parquet(f"{path}.tmp", engine='pyarrow', compression=PARQUET_COMPRESSION, index=False)
+        os.replace(f"{path}.tmp", path)
+        entries.append({
+            "file": relative_path,
+            "date": date,
+            "rows": len(part),
+            "min_timestamp": str(part['timestamp'].min()),
+            "max_timestamp": str(part['timestamp'].max())
+        })
 
-    print(f"Parsed {len(parsed_output)} transactions.")
+    lines = ''.join(json.dumps(entry) + '\n' for entry in entries)
+    with open(os.path.join(dataset_dir, 'manifest.jsonl'), 'a', encoding='utf-8') as manifest:
+        manifest.write(lines)
+    return entries
 
-    etl_pipeline()
-    print("ETL pipeline executed successfully.")
-    
-    if run_etl():
-        print("Analytics ETL process executed successfully.")
+def read_manifest(dataset_dir=DATASET_DIR):
+    path = os.path.join(dataset_dir, 'manifest.jsonl')
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as manifest:
+        return [json.loads(line) for line in manifest if line.strip()]
+
+def read_transactions(columns=None, start_date=None, end_date=None, dataset_dir=DATASET_DIR):
+    """Read the given columns of the partitions between start_date and end_date (YYYY-MM-DD, inclusive)."""
+    if pq is None:
+        raise RuntimeError("Reading the transaction dataset requires pyarrow")
+    files = [os.path.join(dataset_dir, entry["file"]) for entry in sorted(read_manifest(dataset_dir), key=lambda entry: entry["date"])
+             if (start_date is None or entry["date"] >= start_date) and (end_date is None or entry["date"] <= end_date)]
+    if not files:
+        return build_frame([])[columns or CSV_COLUMNS]
+    return pq.ParquetDataset(files).read(columns=columns).to_pandas()
+
+def export_tableau_csv(csv_file=OUTPUT_FILE, columns=None, start_date=None, end_date=None, dataset_dir=DATASET_DIR):
+    """Rewrite the Tableau CSV from the dataset, limited to the given columns and dates."""
+    df = read_transactions(columns, start_date, end_date, dataset_dir)
+    if 'timestamp' in df.columns:
+        df = format_csv(df)
+    df.to_csv(csv_file, index=False)
+    print(f"Exported {len(df)} rows to: {csv_file}")
+
+def write_outputs(transactions, output_format, rebuild=False):
+    """Write parsed transactions to the dataset (Parquet format) and the Tableau CSV."""
+    if pd is None:
+        write_csv_rows(transactions, rebuild)
+        return
+    df = build_frame(transactions)
+    if output_format == PARQUET:
+        if rebuild:
+            shutil.rmtree(DATASET_DIR, ignore_errors=True)
+        write_partitions(df)
+    if rebuild:
+        format_csv(df).to_csv(OUTPUT_FILE, index=False)
     else:
-        print("Analytics ETL process failed.")
+        format_csv(df).to_csv(OUTPUT_FILE, mode='a', header=False, index=False)
 
-def run_etl():
+# === Incremental ETL ===
+def load_etl_state():
+    if not os.path.exists(STATE_FILE):
+        return None
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_etl_state(state):
+    tmp_file = f"{STATE_FILE}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, STATE_FILE)
+
+def read_log_head(log_file_path, size=64):
+    with open(log_file_path, 'rb') as f:
+        return f.read(size).decode('utf-8', errors='replace')
+
+def state_matches_log(state, log_file_path):
+    """Check that the saved offset still belongs to the same, un-rotated log file and the outputs it wrote exist."""
+    outputs = [OUTPUT_FILE]
+    if state.get("format") == PARQUET:
+        outputs.append(MANIFEST_FILE)
+    if state.get("write_json"):
+        outputs.append(INPUT_FILE)
+    if not all(os.path.exists(path) for path in outputs):
+        return False
+    if state.get("log_file") != log_file_path or os.path.getsize(log_file_path) < state["offset"]:
+        return False
+    return read_log_head(log_file_path, len(state["head"].encode('utf-8'))) == state["head"]
+
+def read_new_lines(log_file_path, offset):
+    """Return the complete lines appended after offset and the offset they end at."""
+    with open(log_file_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    # Leave a partially written last line for the next run
+    end = data.rfind(b'\n') + 1
+    text = data[:end].decode('utf-8', errors='replace')
+    return io.StringIO(text, newline=None), offset + end
+
+def append_parsed_transactions(transactions):
+    """Append to the JSON array exactly as json.dump(..., indent=4) would have written it."""
+    with open(INPUT_FILE, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < 2:
+            return False
+        f.seek(size - 2)
+        tail = f.read(2)
+        if tail == b'[]':
+            f.seek(size - 2)
+            prefix = "[\n"
+        elif tail == b'\n]':
+            f.seek(size - 2)
+            prefix = ",\n"
+        else:
+            return False
+
+        chunk = ",\n".join(textwrap.indent(json.dumps(tx, indent=4, default=str), "    ") for tx in transactions)
+        f.write(f"{prefix}{chunk}\n]".encode('utf-8'))
+        f.truncate()
+    return True
+
+def run_etl(full_rebuild=False, source='log', output_format=DEFAULT_FORMAT, write_json=False):
+    """Parse the settlement log, or the event stream, into the transaction outputs.
+
+    Transactions go to the date-partitioned Parquet dataset (when pyarrow is
+    installed) and the Tableau CSV; the parsed_transactions.json intermediate
+    is only kept with write_json=True. Only the lines appended since the
+    previous run are parsed, and their transactions are appended to the
+    outputs. A full rebuild happens on the first run, when the source or
+    output options changed, the source was rotated or truncated, or when new
+    transactions would not sort after the ones already written.
+    """
+    if output_format == PARQUET and (pq is None or pd is None):
+        logging.warning("pandas or pyarrow is not installed; the ETL writes the CSV output only")
+        output_format = CSV
     os.makedirs("output", exist_ok=True)
-    logs_path = "settlement_log.txt"
-    parsed_output = parse_log_file(logs_path)
+    logs_path, new_state, parse_lines = ETL_SOURCES[source]
+    # Log records and events are written by background threads; make sure this process's are on disk
+    flush_logging()
+    flush_events()
+
+    state = None if full_rebuild else load_etl_state()
+    if state is not None and (state.get("format") != output_format or state.get("write_json") != write_json
+                              or not state_matches_log(state, logs_path)):
+        state = None
 
-    with open("output/parsed_transactions.json", "w") as out_file:
-        json.dump(parsed_output, out_file, indent=4, default=str)
+    if state is None:
+        parse_state = new_state()
+        lines, offset = read_new_lines(logs_path, 0)
+        parsed_output = parse_lines(lines, parse_state)
+        print(f"Parsed {len(parsed_output)} transactions.")
+
+        if write_json:
+            with open(INPUT_FILE, "w") as out_file:
+                json.dump(parsed_output, out_file, indent=4, default=str)
+        write_outputs(parsed_output, output_format, rebuild=True)
+        print(f"ETL complete. {len(parsed_output)} rows written to: {OUTPUT_FILE}" + (f" and {DATASET_DIR}" if output_format == PARQUET else ""))
+    else:
+        parse_state = state["parse_state"]
+        lines, offset = read_new_lines(logs_path, state["offset"])
+        parsed_output = parse_lines(lines, parse_state)
+        print(f"Parsed {len(parsed_output)} new transactions.")
 
-    print(f"Parsed {len(parsed_output)} transactions.")
+        if parsed_output:
+            first_timestamp = min(str(tx["timestamp"]) for tx in parsed_output)
+            in_order = state["last_timestamp"] is None or first_timestamp >= state["last_timestamp"]
+            if not in_order or (write_json and not append_parsed_transactions(parsed_output)):
+                return run_etl(full_rebuild=True, source=source, output_format=output_format, write_json=write_json)
+            write_outputs(parsed_output, output_format)
+            print(f"ETL complete. {len(parsed_output)} rows appended to: {OUTPUT_FILE}" + (f" and {DATASET_DIR}" if output_format == PARQUET else ""))
 
-    etl_pipeline()
+    timestamps = [str(tx["timestamp"]) for tx in parsed_output]
+    if state is not None and state["last_timestamp"] is not None:
+        timestamps.append(state["last_timestamp"])
+    last_timestamp = max(timestamps, default=None)
+
+    save_etl_state({
+        "log_file": logs_path,
+        "offset": offset,
+        "head": read_log_head(logs_path),
+        "parse_state": parse_state,
+        "last_timestamp": last_timestamp,
+        "format": output_format,
+        "write_json": write_json
+    })
     print("ETL pipeline executed successfully.")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Parse the settlement log or event stream into transaction outputs.")
+    parser.add_argument("source", nargs="?", choices=sorted(ETL_SOURCES), default='log')
+    parser.add_argument("--format", choices=[PARQUET, CSV], default=DEFAULT_FORMAT)
+    parser.add_argument("--json", action="store_true", help=f"also keep {INPUT_FILE}")
+    parser.add_argument("--full-rebuild", action="store_true")
+    parser.add_argument("--export-csv", action="store_true",
+                        help="only rewrite the Tableau CSV from the Parquet dataset")
+    parser.add_argument("--columns", help="comma separated columns for --export-csv")
+    parser.add_argument("--start-date", help="first date (YYYY-MM-DD) for --export-csv")
+    parser.add_argument("--end-date", help="last date (YYYY-MM-DD) for --export-csv")
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
-    run_etl()
+    args = parse_args()
+    if args.export_csv:
+        export_tableau_csv(columns=args.columns.split(',') if args.columns else None,
+                           start_date=args.start_date, end_date=args.end_date)
+    else:
+        run_etl(full_rebuild=args.full_rebuild, source=args.source, output_format=args.format, write_json=args.json)
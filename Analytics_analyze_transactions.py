@@ -1,138 +1,244 @@
+import os
+import argparse
+from functools import cached_property
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime
-
-# Load data
-df = pd.read_csv("output/transaction data.csv", parse_dates=["timestamp"])
-
-# Extract date and hour
-df['date'] = df['timestamp'].dt.date
-df['hour'] = df['timestamp'].dt.hour
-
-# 1. Volume & Trend Analysis
-# --------------------------
-
-# Daily transaction volume
-daily_volume = df.groupby('date').size()
-print("\nDaily Transaction Volume:\n", daily_volume)
-
-# Total and average amount per day
-daily_amount = df.groupby('date')['amount'].agg(['sum', 'mean'])
-print("\nTotal and Average Amount Per Day:\n", daily_amount)
-
-# Hourly trends
-hourly_trend = df.groupby('hour').size()
-print("\n⏱Hourly Transaction Trends:\n", hourly_trend)
-
-# 2. Status-Based Analysis
-# ------------------------
-
-# Success vs Failure count and ratio
-status_counts = df['status_clean'].value_counts()
-print("\nStatus Count:\n", status_counts)
-
-status_ratio = status_counts / status_counts.sum()
-print("\nStatus Ratio:\n", status_ratio)
-
-# Failure rate over time
-failure_rate = df.groupby('date')['status_clean'].apply(
-    lambda x: (x == 'Failure').sum() / len(x))
-print("\nFailure Rate by Day:\n", failure_rate)
-
-# Frequent failure messages
-failure_messages = df[df['status_clean'] == 'Failure']['status'].value_counts()
-print("\nFrequent Failure Messages:\n", failure_messages)
-
-# 3. Top Participants
-# -------------------
-
-# Top senders
-top_senders = df.groupby('sender')['amount'].sum().sort_values(ascending=False)
-print("\nTop Senders by Amount:\n", top_senders)
-
-# Top receivers
-top_receivers = df.groupby('receiver')['amount'].sum().sort_values(ascending=False)
-print("\nTop Receivers by Amount:\n", top_receivers)
-
-# FI performance (sender BIC)
-fi_performance = df.groupby('sender_bic')['amount'].sum().sort_values(ascending=False)
-print("\nFI Performance (Sender BIC):\n", fi_performance)
-
-# 4. Net Flow Analysis
-# ---------------------
-
-sent = df.groupby('sender')['amount'].sum()
-received = df.groupby('receiver')['amount'].sum()
-net_flow = (received - sent).fillna(0).sort_values()
-print("\nNet Flow Per Entity:\n", net_flow)
-
-# Balance trend per day
-sent_daily = df.groupby(['date', 'sender'])['amount'].sum().unstack().fillna(0)
-received_daily = df.groupby(['date', 'receiver'])['amount'].sum().unstack().fillna(0)
-net_balance_daily = received_daily - sent_daily
-print("\nDaily Net Balance (Partial):\n", net_balance_daily.head())
-
-# 5. Correlation & Patterns
-# --------------------------
-
-# Avg amount by status
-avg_by_status = df.groupby('status_clean')['amount'].mean()
-print("\nAvg Amount by Status:\n", avg_by_status)
-
-# Avg amount by sender
-avg_by_sender = df.groupby('sender')['amount'].mean()
-print("\nAvg Amount by Sender:\n", avg_by_sender)
-
-# Time between transactions
-df_sorted = df.sort_values('timestamp')
-df_sorted['time_diff'] = df_sorted['timestamp'].diff().dt.total_seconds()
-print("\nTime Between Transactions (seconds):\n", df_sorted[['timestamp', 'time_diff']].head())
-
-# Recurring pairs
-pair_counts = df.groupby(['sender', 'receiver']).size().sort_values(ascending=False)
-print("\nRecurring Sender/Receiver Pairs:\n", pair_counts.head())
-
-# 6. Anomaly Detection (Simple)
-# -----------------------------
-
-# Very large or small transactions
-threshold_high = df['amount'].quantile(0.95)
-threshold_low = df['amount'].quantile(0.05)
-anomalies = df[(df['amount'] > threshold_high) | (df['amount'] < threshold_low)]
-print("\nLarge/Small Transaction Anomalies:\n", anomalies[['timestamp', 'sender', 'receiver', 'amount']])
-
-# Unusual hours
-odd_hours = df[(df['hour'] < 6) | (df['hour'] > 22)]
-print("\nTransactions at Odd Hours:\n", odd_hours[['timestamp', 'sender', 'receiver', 'amount']])
-
-# Sudden spike in failure rate
-failure_spike = failure_rate[failure_rate > 0.3]
-print("\nDays with High Failure Rate:\n", failure_spike)
-
-# Questions
-# -------------------
-
-# Which FI sends the most?
-most_sent_fi = df.groupby('sender_bic')['amount'].sum().idxmax()
-print(f"\nFI sending most money: {most_sent_fi}")
-
-# Average transaction size by sender
-avg_size_sender = df.groupby('sender')['amount'].mean().sort_values(ascending=False)
-print("\nAvg Transaction Size by Sender:\n", avg_size_sender)
-
-# Day with most transactions
-busiest_day = daily_volume.idxmax()
-print(f"\nBusiest Transaction Day: {busiest_day}")
-
-# Failed transactions
-failed_txns = df[df['status_clean'] == 'Failure'][['timestamp', 'transaction_id', 'status']]
-print("\nFailed Transactions:\n", failed_txns)
-
-
-sns.countplot(data=df, x='hour')
-plt.title("Hourly Transaction Volume")
-plt.show()
-
-daily_volume.plot(kind='bar', title="Transactions Per Day")
-plt.show()
+import Analytics_ETL
+
+CSV_FILE = "output/transaction data.csv"
+PLOT_DIR = "output"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"   # as written by Analytics_ETL
+CATEGORY_COLUMNS = ["sender", "receiver", "sender_bic", "status", "status_clean"]
+# Columns the reports use; receiver_bic is never read
+ANALYTICS_COLUMNS = ["timestamp", "transaction_id", "sender", "receiver", "amount", "status", "sender_bic", "status_clean"]
+
+def load_transactions(csv_file=None, start_date=None, end_date=None):
+    """Load the columns the reports need, with the derived date, hour and failed columns.
+
+    Reads only the Parquet partitions between start_date and end_date
+    (YYYY-MM-DD) when the ETL has written the dataset, otherwise the CSV.
+    """
+    if csv_file is None and Analytics_ETL.pq is not None and os.path.exists(Analytics_ETL.MANIFEST_FILE):
+        df = Analytics_ETL.read_transactions(ANALYTICS_COLUMNS, start_date, end_date)
+    else:
+        df = pd.read_csv(csv_file or CSV_FILE, usecols=ANALYTICS_COLUMNS)
+        if start_date or end_date:
+            dates = df["timestamp"].str[:10]
+            df = df[(dates >= (start_date or "")) & (dates <= (end_date or "9999"))]
+    return prepare_transactions(df)
+
+def prepare_transactions(df):
+    for column in CATEGORY_COLUMNS:
+        df[column] = df[column].astype("category")
+    timestamps = df["timestamp"]
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = pd.to_datetime(df["timestamp"], format=TIMESTAMP_FORMAT, errors="coerce")
+        # Rows written before the fixed millisecond format fall back to inference
+        if timestamps.isna().any():
+            timestamps = timestamps.fillna(pd.to_datetime(df["timestamp"], format="mixed", errors="coerce"))
+    df["timestamp"] = timestamps
+    df["date"] = timestamps.dt.normalize()
+    df["hour"] = timestamps.dt.hour
+    df["failed"] = (df["status_clean"] == "Failure").to_numpy()
+    return df
+
+class TransactionAnalytics:
+    """Aggregates over a transaction frame, each computed once and cached.
+
+    The per-day, per-sender, per-receiver, per-BIC and per-status results
+    come from one grouped aggregation each, and every report below is derived
+    from those instead of grouping the frame again.
+    """
+
+    def __init__(self, df):
+        self.df = df
+
+    # === Shared group passes ===
+    @cached_property
+    def by_date(self):
+        return self.df.groupby("date").agg(count=("amount", "size"), sum=("amount", "sum"),
+                                           mean=("amount", "mean"), failures=("failed", "sum"))
+
+    @cached_property
+    def by_sender(self):
+        return self.df.groupby("sender", observed=True)["amount"].agg(["sum", "mean", "size"])
+
+    @cached_property
+    def by_receiver(self):
+        return self.df.groupby("receiver", observed=True)["amount"].agg(["sum", "size"])
+
+    @cached_property
+    def by_sender_bic(self):
+        return self.df.groupby("sender_bic", observed=True)["amount"].sum()
+
+    @cached_property
+    def by_status(self):
+        return self.df.groupby("status_clean", observed=True)["amount"].agg(["size", "mean"])
+
+    @cached_property
+    def amount_thresholds(self):
+        low, high = self.df["amount"].quantile([0.05, 0.95])
+        return low, high
+
+    # === Volume and trends ===
+    def daily_volume(self):
+        return self.by_date["count"].rename(None)
+
+    def daily_amount(self):
+        return self.by_date[["sum", "mean"]]
+
+    def hourly_trend(self):
+        return self.df["hour"].value_counts().sort_index()
+
+    # === Status ===
+    def status_counts(self):
+        return self.by_status["size"].rename("count").sort_values(ascending=False)
+
+    def status_ratio(self):
+        counts = self.status_counts()
+        return counts / counts.sum()
+
+    def failure_rate(self):
+        return (self.by_date["failures"] / self.by_date["count"]).rename("status_clean")
+
+    def failure_messages(self):
+        counts = self.df.loc[self.df["failed"], "status"].value_counts()
+        # Categorical counts include every status; keep the ones that occurred
+        return counts[counts > 0]
+
+    def avg_by_status(self):
+        return self.by_status["mean"].rename("amount")
+
+    # === Participants ===
+    def top_senders(self):
+        return self.by_sender["sum"].rename("amount").sort_values(ascending=False)
+
+    def top_receivers(self):
+        return self.by_receiver["sum"].rename("amount").sort_values(ascending=False)
+
+    def fi_performance(self):
+        return self.by_sender_bic.sort_values(ascending=False)
+
+    def avg_by_sender(self):
+        return self.by_sender["mean"].rename("amount")
+
+    def net_flow(self):
+        """Received minus sent per entity; an entity missing on one side counts as 0 there."""
+        sent = self.by_sender["sum"]
+        received = self.by_receiver["sum"]
+        return received.sub(sent, fill_value=0).rename("amount").sort_values()
+
+    def daily_net_balance(self):
+        # Grouping the categorical codes is cheap; the day x entity tables are small to align
+        df = self.df
+        received = df.groupby(["date", "receiver"], observed=True)["amount"].sum().unstack(fill_value=0)
+        sent = df.groupby(["date", "sender"], observed=True)["amount"].sum().unstack(fill_value=0)
+        received.columns = received.columns.astype(str)
+        sent.columns = sent.columns.astype(str)
+        return received.sub(sent, fill_value=0).rename_axis(columns="entity")
+
+    def pair_counts(self):
+        return self.df.groupby(["sender", "receiver"], observed=True).size().sort_values(ascending=False)
+
+    def time_between_transactions(self):
+        ordered = self.df[["timestamp"]].sort_values("timestamp")
+        ordered["time_diff"] = ordered["timestamp"].diff().dt.total_seconds()
+        return ordered
+
+    # === Anomalies ===
+    def anomalies(self):
+        low, high = self.amount_thresholds
+        amount = self.df["amount"]
+        return self.df.loc[(amount > high) | (amount < low), ["timestamp", "sender", "receiver", "amount"]]
+
+    def odd_hours(self):
+        hour = self.df["hour"]
+        return self.df.loc[(hour < 6) | (hour > 22), ["timestamp", "sender", "receiver", "amount"]]
+
+    def failure_spike(self, threshold=0.3):
+        rate = self.failure_rate()
+        return rate[rate > threshold]
+
+    def failed_transactions(self):
+        return self.df.loc[self.df["failed"], ["timestamp", "transaction_id", "status"]]
+
+    # === Questions ===
+    def most_sent_fi(self):
+        return self.by_sender_bic.idxmax()
+
+    def busiest_day(self):
+        return self.daily_volume().idxmax().date()
+
+def print_report(analytics):
+    print("\nDaily Transaction Volume:\n", analytics.daily_volume())
+    print("\nTotal and Average Amount Per Day:\n", analytics.daily_amount())
+    print("\n⏱Hourly Transaction Trends:\n", analytics.hourly_trend())
+
+    print("\nStatus Count:\n", analytics.status_counts())
+    print("\nStatus Ratio:\n", analytics.status_ratio())
+    print("\nFailure Rate by Day:\n", analytics.failure_rate())
+    print("\nFrequent Failure Messages:\n", analytics.failure_messages())
+
+    print("\nTop Senders by Amount:\n", analytics.top_senders())
+    print("\nTop Receivers by Amount:\n", analytics.top_receivers())
+    print("\nFI Performance (Sender BIC):\n", analytics.fi_performance())
+
+    print("\nNet Flow Per Entity:\n", analytics.net_flow())
+    print("\nDaily Net Balance (Partial):\n", analytics.daily_net_balance().head())
+
+    print("\nAvg Amount by Status:\n", analytics.avg_by_status())
+    print("\nAvg Amount by Sender:\n", analytics.avg_by_sender())
+    print("\nTime Between Transactions (seconds):\n", analytics.time_between_transactions().head())
+    print("\nRecurring Sender/Receiver Pairs:\n", analytics.pair_counts().head())
+
+    print("\nLarge/Small Transaction Anomalies:\n", analytics.anomalies())
+    print("\nTransactions at Odd Hours:\n", analytics.odd_hours())
+    print("\nDays with High Failure Rate:\n", analytics.failure_spike())
+
+    print(f"\nFI sending most money: {analytics.most_sent_fi()}")
+    print("\nAvg Transaction Size by Sender:\n", analytics.avg_by_sender().sort_values(ascending=False))
+    print(f"\nBusiest Transaction Day: {analytics.busiest_day()}")
+    print("\nFailed Transactions:\n", analytics.failed_transactions())
+
+def plot_report(analytics, output_dir=PLOT_DIR, show=False):
+    """Save the hourly and daily volume charts as PNGs; only opens windows when show=True."""
+    import matplotlib
+    if not show:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for series, title, xlabel, name in [
+        (analytics.hourly_trend(), "Hourly Transaction Volume", "hour", "hourly_volume.png"),
+        (analytics.daily_volume(), "Transactions Per Day", "date", "daily_volume.png"),
+    ]:
+        fig, ax = plt.subplots()
+        series.plot(kind="bar", title=title, xlabel=xlabel, ax=ax)
+        fig.tight_layout()
+        path = os.path.join(output_dir, name)
+        fig.savefig(path)
+        paths.append(path)
+        if not show:
+            plt.close(fig)
+    if show:
+        plt.show()
+    return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transaction analytics over the ETL's CSV output.")
+    parser.add_argument("--csv", help="read this CSV instead of the ETL's Parquet dataset")
+    parser.add_argument("--start-date", help="first date (YYYY-MM-DD) to analyse")
+    parser.add_argument("--end-date", help="last date (YYYY-MM-DD) to analyse")
+    parser.add_argument("--plots", default=PLOT_DIR, help="directory for the chart PNGs")
+    parser.add_argument("--no-plots", action="store_true")
+    parser.add_argument("--show", action="store_true", help="also open the charts in a window")
+    args = parser.parse_args(argv)
+
+    analytics = TransactionAnalytics(load_transactions(args.csv, args.start_date, args.end_date))
+    print_report(analytics)
+    if not args.no_plots:
+        for path in plot_report(analytics, args.plots, args.show):
+            print(f"Chart saved to {path}")
+
+if __name__ == "__main__":
+    main()
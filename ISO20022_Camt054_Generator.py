@@ -1,45 +1,72 @@
 import xml.etree.ElementTree as ET
-from datetime import datetime, timezone
 import os
 import logging
-from xml.dom import minidom
+from ISO20022_Serializer import write_message
+from ISO20022_Templates import MessageTemplate, creation_timestamp
+from RTR_Message_Ids import next_id
+from RTR_Event_Stream import emit_event, CAMT054_CREATED
+
+# Compiled once; render_camt054_message fills this in without building a tree
+CAMT054_TEMPLATE = MessageTemplate(
+    ("Document", [
+        ("BkToCstmrDbtCdtNtfctn", [
+            ("GrpHdr", [("MsgId", "msg_id"), ("CreDtTm", "created")]),
+            ("Ntfctn", [
+                ("Id", "notification_id"),
+                ("CreDtTm", "created"),
+                ("Acct", "creditor_bic"),
+                ("TxsSummry", "summary"),
+                ("RltdRef", "related_msg_id"),
+            ]),
+        ]),
+    ]))
+
+def camt054_fields(creditor_bic, amount, msg_id):
+    logging.info("Generating CAMT.054 credit notification for %s", creditor_bic)
+    notification_id = next_id()
+    created = creation_timestamp()
+    fields = {
+        "msg_id": f"CAMT054-{notification_id}",
+        "created": created,
+        "notification_id": f"CRED-{notification_id}",
+        "creditor_bic": creditor_bic,
+        "summary": f"Credit: {amount:.2f}",
+        "related_msg_id": msg_id,
+    }
+    emit_event(CAMT054_CREATED, msg_id, msg_id=fields["msg_id"], creditor_bic=creditor_bic, amount=amount)
+    return fields
 
 def generate_camt054_message(creditor_bic, amount, msg_id):
-    logging.info(f"Generating CAMT.054 credit notification for {creditor_bic}")
-    now = datetime.now(timezone.utc)
-    timestamp = now.strftime("%Y-%m-%d-%H%M%S")
+    fields = camt054_fields(creditor_bic, amount, msg_id)
     
     document = ET.Element("Document")
     bank_to_cust_debt_credit_notif = ET.SubElement(document, "BkToCstmrDbtCdtNtfctn")
     
     # Group Header
     grp_hdr = ET.SubElement(bank_to_cust_debt_credit_notif, "GrpHdr")
-    ET.SubElement(grp_hdr, "MsgId").text = f"CAMT054-{timestamp}"
-    ET.SubElement(grp_hdr, "CreDtTm").text = now.strftime("%Y-%m-%dT%H:%M:%S")
+    ET.SubElement(grp_hdr, "MsgId").text = fields["msg_id"]
+    ET.SubElement(grp_hdr, "CreDtTm").text = fields["created"]
     
     # Notification
     ntfctn = ET.SubElement(bank_to_cust_debt_credit_notif, "Ntfctn")
-    ET.SubElement(ntfctn, "Id").text = f"CRED-{timestamp}"
-    ET.SubElement(ntfctn, "CreDtTm").text = now.strftime("%Y-%m-%dT%H:%M:%S")
+    ET.SubElement(ntfctn, "Id").text = fields["notification_id"]
+    ET.SubElement(ntfctn, "CreDtTm").text = fields["created"]
     ET.SubElement(ntfctn, "Acct").text = creditor_bic
-    ET.SubElement(ntfctn, "TxsSummry").text = f"Credit: {amount:.2f}"
+    ET.SubElement(ntfctn, "TxsSummry").text = fields["summary"]
     ET.SubElement(ntfctn, "RltdRef").text = msg_id
     
     return ET.ElementTree(document)
 
+def render_camt054_message(creditor_bic, amount, msg_id, pretty=None):
+    """Same message as generate_camt054_message, rendered straight to XML text."""
+    return CAMT054_TEMPLATE.render(camt054_fields(creditor_bic, amount, msg_id), pretty)
+
 def save_camt054_message(tree, creditor_bic):
-    if not os.path.exists("messages/camt054"):
-        os.makedirs("messages/camt054")
+    os.makedirs("messages/camt054", exist_ok=True)
         
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = f"messages/camt054/camt054_{creditor_bic}_{timestamp}.xml"
-    
-    rough_string = ET.tostring(tree.getroot(), 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    pretty_xml = reparsed.toprettyxml(indent="  ")
+    filename = f"messages/camt054/camt054_{creditor_bic}_{next_id()}.xml"
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(pretty_xml)
+    write_message(tree, filename)
     
-    logging.info(f"CAMT.054 notification saved to {filename}")
+    logging.info("CAMT.054 notification saved to %s", filename)
     return filename
@@ -0,0 +1,91 @@
+import math
+
+# Extraction problems reported by MessageExtractor.extract
+MISSING = "missing"
+INVALID = "invalid"
+
+def parse_amount(text):
+    amount = float(text)
+    if not math.isfinite(amount):
+        raise ValueError(f"amount is not a number: {text}")
+    if amount <= 0:
+        raise ValueError(f"amount is not positive: {text}")
+    return amount
+
+class MessageExtractor:
+    """Collects the fields of one message type in a single pass over the tree.
+
+    Each field is (name, path, required, convert) where path is "Tag" or
+    "Parent/Tag". The paths are compiled into a lookup by tag, so extract()
+    visits every element once instead of running one descendant search per
+    field. Fields are expected once per message; the first match is used.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.by_tag = {}
+        for name, path, required, convert in fields:
+            parent_tag, _, tag = path.rpartition("/")
+            self.by_tag.setdefault(tag, []).append((parent_tag or None, name))
+        self.wanted = len(fields)
+
+    def extract(self, root):
+        """Return (record, problem); problem is None or (MISSING or INVALID, field name) for the first bad field.
+
+        Missing fields are None in the record and fields that fail to convert
+        keep their text, so callers can still log what was received.
+        """
+        if hasattr(root, "getroot"):
+            root = root.getroot()
+        by_tag = self.by_tag
+        found = {}
+        for parent in root.iter():
+            for child in parent:
+                candidates = by_tag.get(child.tag)
+                if candidates is None:
+                    continue
+                for parent_tag, name in candidates:
+                    if name not in found and (parent_tag is None or parent_tag == parent.tag):
+                        found[name] = child.text
+                if len(found) == self.wanted:
+                    break
+            else:
+                continue
+            break
+
+        record = {}
+        problem = None
+        for name, path, required, convert in self.fields:
+            text = found.get(name)
+            text = text.strip() if text else ""
+            if not text:
+                record[name] = None
+                if required and problem is None:
+                    problem = (MISSING, name)
+                continue
+            if convert is not None:
+                try:
+                    text = convert(text)
+                except ValueError:
+                    problem = problem or (INVALID, name)
+            record[name] = text
+        return record, problem
+
+# Single-transaction PACS.008, as received by the exchange and the creditor agent
+PACS008_EXTRACTOR = MessageExtractor([
+    ("msg_id", "GrpHdr/MsgId", True, None),
+    ("end_to_end_id", "PmtId/EndToEndId", False, None),
+    ("amount", "Amt", True, parse_amount),
+    ("debtor", "Debtor", True, None),
+    ("creditor", "Creditor", True, None),
+])
+
+# Single-transaction PAIN.001, as received by the debtor agent
+PAIN001_EXTRACTOR = MessageExtractor([
+    ("msg_id", "GrpHdr/MsgId", True, None),
+    ("debtor", "Dbtr/Nm", True, None),
+    ("debtor_agent", "DbtrAgt/FinInstnId", True, None),
+    ("creditor", "Cdtr/Nm", True, None),
+    ("creditor_agent", "CdtrAgt/FinInstnId", True, None),
+    ("amount", "Amt", True, parse_amount),
+])
@@ -1,21 +1,60 @@
 import xml.etree.ElementTree as ET
-from datetime import datetime, timezone
 import os
-from xml.dom import minidom
+from ISO20022_Serializer import write_message
+from ISO20022_Templates import MessageTemplate, Const, creation_timestamp
+from RTR_Message_Ids import next_id
 import logging
+from RTR_Event_Stream import emit_event, PACS002_CREATED
+
+# Compiled once; render_pacs002_message fills these in without building a tree
+PACS002_TEMPLATE = MessageTemplate(
+    ("Document", [
+        ("FIToFIPmtStsRpt", [
+            ("GrpHdr", [("MsgId", "msg_id"), ("CreDtTm", "created")]),
+            ("OrgnlGrpInfAndSts", [
+                ("OrgnlMsgId", "original_message_id"),
+                ("OrgnlMsgNmId", Const("pacs.008.001.01")),
+                ("GrpSts", "status"),
+            ]),
+        ]),
+    ]))
+
+PACS002_REASON_TEMPLATE = MessageTemplate(
+    ("Document", [
+        ("FIToFIPmtStsRpt", [
+            ("GrpHdr", [("MsgId", "msg_id"), ("CreDtTm", "created")]),
+            ("OrgnlGrpInfAndSts", [
+                ("OrgnlMsgId", "original_message_id"),
+                ("OrgnlMsgNmId", Const("pacs.008.001.01")),
+                ("GrpSts", "status"),
+                ("StsRsn", [("Rsn", "reason")]),
+            ]),
+        ]),
+    ]))
+
+def pacs002_fields(original_message_id, status, reason=None):
+    logging.info("Generating PACS.002 acknowledgment for message %s", original_message_id)
+    created = creation_timestamp()
+    fields = {
+        "msg_id": next_id("PACS002-"),
+        "created": created,
+        "original_message_id": original_message_id,
+        "status": status,
+        "reason": reason,
+    }
+    emit_event(PACS002_CREATED, original_message_id, msg_id=fields["msg_id"], status=status, reason=reason)
+    return fields
 
 def generate_pacs002_message(original_message_id, status, reason=None):
-    logging.info(f"Generating PACS.002 acknowledgment for message {original_message_id}")
-    now = datetime.now(timezone.utc)
-    timestamp = now.strftime("%Y-%m-%d-%H%M%S")
+    fields = pacs002_fields(original_message_id, status, reason)
     
     document = ET.Element("Document")
     fi_to_fi_pmt_sts_rpt = ET.SubElement(document, "FIToFIPmtStsRpt")
     
     # Group Header
     grp_hdr = ET.SubElement(fi_to_fi_pmt_sts_rpt, "GrpHdr")
-    ET.SubElement(grp_hdr, "MsgId").text = f"PACS002-{timestamp}"
-    ET.SubElement(grp_hdr, "CreDtTm").text = now.strftime("%Y-%m-%dT%H:%M:%S")
+    ET.SubElement(grp_hdr, "MsgId").text = fields["msg_id"]
+    ET.SubElement(grp_hdr, "CreDtTm").text = fields["created"]
     
     # Original Group Information
     org_grp_inf = ET.SubElement(fi_to_fi_pmt_sts_rpt, "OrgnlGrpInfAndSts")
@@ -29,19 +68,18 @@ def generate_pacs002_message(original_message_id, status, reason=None):
     
     return ET.ElementTree(document)
 
+def render_pacs002_message(original_message_id, status, reason=None, pretty=None):
+    """Same message as generate_pacs002_message, rendered straight to XML text."""
+    fields = pacs002_fields(original_message_id, status, reason)
+    template = PACS002_REASON_TEMPLATE if reason else PACS002_TEMPLATE
+    return template.render(fields, pretty)
+
 def save_pacs002_message(tree, bank_bic, message_type="response"):
-    if not os.path.exists(f"messages/pacs002/{message_type}"):
-        os.makedirs(f"messages/pacs002/{message_type}")
+    os.makedirs(f"messages/pacs002/{message_type}", exist_ok=True)
         
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = f"messages/pacs002/{message_type}/pacs002_{bank_bic}_{timestamp}.xml"
-    
-    rough_string = ET.tostring(tree.getroot(), 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    pretty_xml = reparsed.toprettyxml(indent="  ")
+    filename = f"messages/pacs002/{message_type}/pacs002_{bank_bic}_{next_id()}.xml"
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(pretty_xml)
+    write_message(tree, filename)
     
-    logging.info(f"PACS.002 {message_type} message saved to {filename}")
+    logging.info("PACS.002 %s message saved to %s", message_type, filename)
     return filename
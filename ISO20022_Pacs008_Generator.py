@@ -1,64 +1,94 @@
 import os
-import sqlite3
-from datetime import datetime, timezone
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
+from ISO20022_Serializer import write_message
+from db_manager import get_connection, from_minor_units
+from ISO20022_Templates import MessageTemplate, creation_timestamp
+from RTR_Message_Ids import next_id
 from RTR_Exchange_Processor import RTRExchangeProcessor
+from RTR_Event_Stream import emit_event, PACS008_CREATED
 import logging
+from RTR_Logging import configure_logging
 
 # Configure logging
-logging.basicConfig(filename='settlement_log.txt', level=logging.INFO, format='%(asctime)s - %(message)s')
+configure_logging()
 
 # === Database Connection Management ===
 def get_db_connection():
-    conn = sqlite3.connect('payment_system.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Pooled per-thread connection; do not close it
+    return get_connection()
+
+def user_record(row):
+    # Balances are stored in cents; callers work in dollars
+    user = dict(row)
+    user['balance'] = from_minor_units(user['balance'])
+    return user
 
 def get_all_users():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT users.*, bic_codes.bic_code FROM users JOIN bic_codes ON users.fi_code = bic_codes.fi_code")
-    users = cursor.fetchall()
-    conn.close()
-    return users
+    rows = conn.execute("SELECT users.*, bic_codes.bic_code FROM users JOIN bic_codes ON users.fi_code = bic_codes.fi_code").fetchall()
+    return [user_record(row) for row in rows]
 
 def get_user_by_name(name):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
+    user = conn.execute("""
         SELECT users.*, bic_codes.bic_code 
         FROM users 
         JOIN bic_codes ON users.fi_code = bic_codes.fi_code 
         WHERE users.name = ?
-    """, (name,))
-    user = cursor.fetchone()
-    conn.close()
-    return dict(user) if user else None
+    """, (name,)).fetchone()
+    return user_record(user) if user else None
 
 # === ISO 20022 Message Generator ===
+# Compiled once; render_iso20022_message fills this in without building a tree
+PACS008_TEMPLATE = MessageTemplate(
+    ("Document", [
+        ("FIToFICstmrCdtTrf", [
+            ("GrpHdr", [("MsgId", "msg_id"), ("CreDtTm", "created")]),
+            ("CdtTrfTxInf", [
+                ("PmtId", [("EndToEndId", "end_to_end_id")]),
+                ("Amt", "amount"),
+                ("Debtor", "debtor_bic"),
+                ("Creditor", "creditor_bic"),
+            ]),
+        ]),
+    ]))
+
+def pacs008_fields(payer, payee, amount):
+    logging.info("Generating PACS.008 message for payment from %s to %s for amount %s", payer['name'], payee['name'], amount)
+    msg_id = next_id()
+    created = creation_timestamp()
+    fields = {
+        "msg_id": msg_id,
+        "created": created,
+        "end_to_end_id": msg_id,
+        "amount": f"{amount:.2f}",
+        "debtor_bic": payer["bic_code"],
+        "creditor_bic": payee["bic_code"],
+    }
+    emit_event(PACS008_CREATED, msg_id, msg_id=msg_id, debtor=payer["name"], creditor=payee["name"],
+               debtor_bic=payer["bic_code"], creditor_bic=payee["bic_code"], amount=amount)
+    return fields
+
 def generate_iso20022_message(payer, payee, amount):
-    logging.info(f"Generating PACS.008 message for payment from {payer['name']} to {payee['name']} for amount {amount}")
-    now = datetime.now(timezone.utc)
-    timestamp = now.strftime("%Y-%m-%d-%H%M%S")
+    fields = pacs008_fields(payer, payee, amount)
     
     document = ET.Element("Document")
     fct = ET.SubElement(document, "FIToFICstmrCdtTrf")
     
     # Group Header - simplified
     grp_hdr = ET.SubElement(fct, "GrpHdr")
-    ET.SubElement(grp_hdr, "MsgId").text = timestamp
-    ET.SubElement(grp_hdr, "CreDtTm").text = now.strftime("%Y-%m-%dT%H:%M:%S")
+    ET.SubElement(grp_hdr, "MsgId").text = fields["msg_id"]
+    ET.SubElement(grp_hdr, "CreDtTm").text = fields["created"]
     
     # Credit Transfer Transaction Information - simplified
     cdt_trf_tx_inf = ET.SubElement(fct, "CdtTrfTxInf")
     
     # Payment ID
     pmt_id = ET.SubElement(cdt_trf_tx_inf, "PmtId")
-    ET.SubElement(pmt_id, "EndToEndId").text = f"{timestamp}"
+    ET.SubElement(pmt_id, "EndToEndId").text = fields["end_to_end_id"]
     
     # Amount
-    ET.SubElement(cdt_trf_tx_inf, "Amt").text = f"{amount:.2f}"
+    ET.SubElement(cdt_trf_tx_inf, "Amt").text = fields["amount"]
     
     # Use BIC codes for Debtor and Creditor
     ET.SubElement(cdt_trf_tx_inf, "Debtor").text = payer["bic_code"]
@@ -66,26 +96,64 @@ def generate_iso20022_message(payer, payee, amount):
 
     return ET.ElementTree(document)
 
+def render_iso20022_message(payer, payee, amount, pretty=None):
+    """Same message as generate_iso20022_message, rendered straight to XML text."""
+    return PACS008_TEMPLATE.render(pacs008_fields(payer, payee, amount), pretty)
+
+def generate_bulk_pacs008_message(transactions):
+    """One PACS.008 carrying a CdtTrfTxInf per transaction.
+
+    transactions are dicts with end_to_end_id, amount, debtor_bic,
+    creditor_bic and the debtor and creditor names.
+    """
+    msg_id = next_id("BULK-")
+    created = creation_timestamp()
+    logging.info("Generating bulk PACS.008 %s with %s transactions", msg_id, len(transactions))
+
+    document = ET.Element("Document")
+    fct = ET.SubElement(document, "FIToFICstmrCdtTrf")
+
+    grp_hdr = ET.SubElement(fct, "GrpHdr")
+    ET.SubElement(grp_hdr, "MsgId").text = msg_id
+    ET.SubElement(grp_hdr, "CreDtTm").text = created
+    ET.SubElement(grp_hdr, "NbOfTxs").text = str(len(transactions))
+    ET.SubElement(grp_hdr, "CtrlSum").text = f"{sum(tx['amount'] for tx in transactions):.2f}"
+
+    for tx in transactions:
+        cdt_trf_tx_inf = ET.SubElement(fct, "CdtTrfTxInf")
+        pmt_id = ET.SubElement(cdt_trf_tx_inf, "PmtId")
+        ET.SubElement(pmt_id, "EndToEndId").text = tx["end_to_end_id"]
+        ET.SubElement(cdt_trf_tx_inf, "Amt").text = f"{tx['amount']:.2f}"
+        ET.SubElement(cdt_trf_tx_inf, "Debtor").text = tx["debtor_bic"]
+        ET.SubElement(cdt_trf_tx_inf, "Creditor").text = tx["creditor_bic"]
+        emit_event(PACS008_CREATED, tx["end_to_end_id"], msg_id=msg_id, debtor=tx["debtor"], creditor=tx["creditor"],
+                   debtor_bic=tx["debtor_bic"], creditor_bic=tx["creditor_bic"], amount=tx["amount"])
+
+    return ET.ElementTree(document)
+
+def save_bulk_message(tree, debtor_bic, creditor_bic):
+    os.makedirs("messages/pacs008/bulk", exist_ok=True)
+    filename = f"messages/pacs008/bulk/{debtor_bic}_to_{creditor_bic}_{next_id()}.xml"
+    write_message(tree, filename)
+    logging.info("Bulk PACS.008 message saved to %s", filename)
+    return filename
+
 def save_message(tree, payer_name, payee_name):
-    logging.info(f"Saving PACS.008 message for payment from {payer_name} to {payee_name}")
-    if not os.path.exists("messages"):
-        os.makedirs("messages")
-    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
-    filename = f"messages/pacs008/{payer_name.replace(' ', '_')}_to_{payee_name.replace(' ', '_')}_{timestamp}.xml"
-    
-    # Convert ElementTree to string
-    rough_string = ET.tostring(tree.getroot(), 'utf-8')
-    # Create pretty-printed XML string
-    reparsed = minidom.parseString(rough_string)
-    pretty_xml = reparsed.toprettyxml(indent="  ")
+    logging.info("Saving PACS.008 message for payment from %s to %s", payer_name, payee_name)
+    os.makedirs("messages/pacs008", exist_ok=True)
+    filename = f"messages/pacs008/{payer_name.replace(' ', '_')}_to_{payee_name.replace(' ', '_')}_{next_id()}.xml"
     
     # Write to file with proper formatting
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(pretty_xml)
+    write_message(tree, filename)
     
-    logging.info(f"PACS.008 message saved to {filename}")
+    logging.info("PACS.008 message saved to %s", filename)
     return filename
 
+# Long-lived exchange processor reused by process_through_rtr
+_rtr_processor = None
+
 def process_through_rtr(filename):
-    processor = RTRExchangeProcessor()
-    return processor.process_message(filename)
+    global _rtr_processor
+    if _rtr_processor is None:
+        _rtr_processor = RTRExchangeProcessor()
+    return _rtr_processor.process_message(filename)
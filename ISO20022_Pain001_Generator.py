@@ -1,28 +1,52 @@
 import xml.etree.ElementTree as ET
-from datetime import datetime, timezone
 import os
-from xml.dom import minidom
+from ISO20022_Serializer import write_message
+from ISO20022_Templates import MessageTemplate, creation_timestamp
 import logging
+from RTR_Logging import configure_logging
+from RTR_Event_Stream import emit_event, PAIN001_CREATED
+from RTR_Message_Ids import next_id
 
 
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 
-def generate_pain001_message(payer, payee, amount):
-    logging.info(f"Creating PAIN.001 message structure for {payer['name']} to {payee['name']}")
-    now = datetime.now(timezone.utc)
-    timestamp = now.strftime("%Y-%m-%d-%H%M%S")
+# Compiled once; render_pain001_message fills this in without building a tree
+PAIN001_TEMPLATE = MessageTemplate(
+    ("Document", [
+        ("CstmrCdtTrfInitn", [
+            ("GrpHdr", [("MsgId", "msg_id"), ("CreDtTm", "created"), ("NbOfTxs", "number_of_transactions")]),
+            ("PmtInf", [
+                ("PmtInfId", "pmt_inf_id"),
+                ("PmtMtd", "payment_method"),
+                ("Dbtr", [("Nm", "debtor_name")]),
+                ("DbtrAcct", [("Id", "debtor_account")]),
+                ("DbtrAgt", [("FinInstnId", "debtor_bic")]),
+                ("CdtTrfTxInf", [
+                    ("Amt", "amount"),
+                    ("Cdtr", [("Nm", "creditor_name")]),
+                    ("CdtrAcct", [("Id", "creditor_account")]),
+                    ("CdtrAgt", [("FinInstnId", "creditor_bic")]),
+                ]),
+            ]),
+        ]),
+    ]))
+
+def _pain001_document(payer, message_id, number_of_transactions, control_sum=None):
+    """Document, group header and debtor PmtInf of a PAIN.001; returns (document, pmt_inf)."""
     document = ET.Element("Document")
     cstmr_cdt_trf_initn = ET.SubElement(document, "CstmrCdtTrfInitn")
     
     # Group Header
     grp_hdr = ET.SubElement(cstmr_cdt_trf_initn, "GrpHdr")
-    ET.SubElement(grp_hdr, "MsgId").text = f"PAIN001-{timestamp}"
-    ET.SubElement(grp_hdr, "CreDtTm").text = now.strftime("%Y-%m-%dT%H:%M:%S")
-    ET.SubElement(grp_hdr, "NbOfTxs").text = "1"
+    ET.SubElement(grp_hdr, "MsgId").text = f"PAIN001-{message_id}"
+    ET.SubElement(grp_hdr, "CreDtTm").text = creation_timestamp()
+    ET.SubElement(grp_hdr, "NbOfTxs").text = str(number_of_transactions)
+    if control_sum is not None:
+        ET.SubElement(grp_hdr, "CtrlSum").text = f"{control_sum:.2f}"
     
     # Payment Information
     pmt_inf = ET.SubElement(cstmr_cdt_trf_initn, "PmtInf")
-    ET.SubElement(pmt_inf, "PmtInfId").text = f"PMT-{timestamp}"
+    ET.SubElement(pmt_inf, "PmtInfId").text = f"PMT-{message_id}"
     ET.SubElement(pmt_inf, "PmtMtd").text = "TRF"
     
     # Debtor Information
@@ -32,9 +56,14 @@ def generate_pain001_message(payer, payee, amount):
     ET.SubElement(dbtr_acct, "Id").text = str(payer["id"])
     dbtr_agt = ET.SubElement(pmt_inf, "DbtrAgt")
     ET.SubElement(dbtr_agt, "FinInstnId").text = payer["bic_code"]
-    
+    return document, pmt_inf
+
+def _add_credit_transfer(pmt_inf, payee, amount, end_to_end_id=None):
     # Credit Transfer Details
     cdt_trf_tx_inf = ET.SubElement(pmt_inf, "CdtTrfTxInf")
+    if end_to_end_id:
+        pmt_id = ET.SubElement(cdt_trf_tx_inf, "PmtId")
+        ET.SubElement(pmt_id, "EndToEndId").text = end_to_end_id
     ET.SubElement(cdt_trf_tx_inf, "Amt").text = f"{amount:.2f}"
     
     # Creditor Information
@@ -44,23 +73,88 @@ def generate_pain001_message(payer, payee, amount):
     ET.SubElement(cdtr_acct, "Id").text = str(payee["id"])
     cdtr_agt = ET.SubElement(cdt_trf_tx_inf, "CdtrAgt")
     ET.SubElement(cdtr_agt, "FinInstnId").text = payee["bic_code"]
-    
-    logging.info(f"PAIN.001 message structure created with ID: PAIN001-{timestamp}")
+
+def pain001_fields(payer, payee, amount):
+    logging.info("Creating PAIN.001 message structure for %s to %s", payer['name'], payee['name'])
+    message_id = next_id()
+    fields = {
+        "msg_id": f"PAIN001-{message_id}",
+        "created": creation_timestamp(),
+        "number_of_transactions": "1",
+        "pmt_inf_id": f"PMT-{message_id}",
+        "payment_method": "TRF",
+        "debtor_name": payer["name"],
+        "debtor_account": str(payer["id"]),
+        "debtor_bic": payer["bic_code"],
+        "amount": f"{amount:.2f}",
+        "creditor_name": payee["name"],
+        "creditor_account": str(payee["id"]),
+        "creditor_bic": payee["bic_code"],
+    }
+    logging.info("PAIN.001 message structure created with ID: %s", fields["msg_id"])
+    emit_event(PAIN001_CREATED, fields["msg_id"], debtor=payer["name"], creditor=payee["name"],
+               debtor_bic=payer["bic_code"], creditor_bic=payee["bic_code"], amount=amount)
+    return fields
+
+def generate_pain001_message(payer, payee, amount):
+    fields = pain001_fields(payer, payee, amount)
+
+    document = ET.Element("Document")
+    cstmr_cdt_trf_initn = ET.SubElement(document, "CstmrCdtTrfInitn")
+
+    # Group Header
+    grp_hdr = ET.SubElement(cstmr_cdt_trf_initn, "GrpHdr")
+    for tag, name in (("MsgId", "msg_id"), ("CreDtTm", "created"), ("NbOfTxs", "number_of_transactions")):
+        ET.SubElement(grp_hdr, tag).text = fields[name]
+
+    # Payment Information
+    pmt_inf = ET.SubElement(cstmr_cdt_trf_initn, "PmtInf")
+    ET.SubElement(pmt_inf, "PmtInfId").text = fields["pmt_inf_id"]
+    ET.SubElement(pmt_inf, "PmtMtd").text = fields["payment_method"]
+
+    # Debtor Information
+    ET.SubElement(ET.SubElement(pmt_inf, "Dbtr"), "Nm").text = fields["debtor_name"]
+    ET.SubElement(ET.SubElement(pmt_inf, "DbtrAcct"), "Id").text = fields["debtor_account"]
+    ET.SubElement(ET.SubElement(pmt_inf, "DbtrAgt"), "FinInstnId").text = fields["debtor_bic"]
+
+    # Credit Transfer Details
+    cdt_trf_tx_inf = ET.SubElement(pmt_inf, "CdtTrfTxInf")
+    ET.SubElement(cdt_trf_tx_inf, "Amt").text = fields["amount"]
+    ET.SubElement(ET.SubElement(cdt_trf_tx_inf, "Cdtr"), "Nm").text = fields["creditor_name"]
+    ET.SubElement(ET.SubElement(cdt_trf_tx_inf, "CdtrAcct"), "Id").text = fields["creditor_account"]
+    ET.SubElement(ET.SubElement(cdt_trf_tx_inf, "CdtrAgt"), "FinInstnId").text = fields["creditor_bic"]
+
+    return ET.ElementTree(document)
+
+def render_pain001_message(payer, payee, amount, pretty=None):
+    """Same message as generate_pain001_message, rendered straight to XML text."""
+    return PAIN001_TEMPLATE.render(pain001_fields(payer, payee, amount), pretty)
+
+def generate_pain001_batch(payer, transfers):
+    """PAIN.001 with one CdtTrfTxInf per (payee, amount) in transfers, e.g. a payroll run.
+
+    Each transfer gets its own EndToEndId, which the debtor agent carries into
+    the PACS.008 so every payment can be traced on its own.
+    """
+    transfers = list(transfers)
+    logging.info("Creating PAIN.001 batch of %s credit transfers for %s", len(transfers), payer['name'])
+    message_id = next_id()
+    total = sum(amount for _, amount in transfers)
+    document, pmt_inf = _pain001_document(payer, message_id, len(transfers), total)
+    for payee, amount in transfers:
+        _add_credit_transfer(pmt_inf, payee, amount, next_id("E2E-"))
+
+    logging.info("PAIN.001 message structure created with ID: PAIN001-%s", message_id)
+    emit_event(PAIN001_CREATED, f"PAIN001-{message_id}", debtor=payer["name"], debtor_bic=payer["bic_code"],
+               transactions=len(transfers), amount=total)
     return ET.ElementTree(document)
 
 def save_pain001_message(tree, payer_name):
-    logging.info(f"Saving PAIN.001 message for {payer_name}")
-    if not os.path.exists("messages/pain001"):
-        os.makedirs("messages/pain001")
-    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
-    filename = f"messages/pain001/pain001_{payer_name.replace(' ', '_')}_{timestamp}.xml"
-    
-    rough_string = ET.tostring(tree.getroot(), 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    pretty_xml = reparsed.toprettyxml(indent="  ")
+    logging.info("Saving PAIN.001 message for %s", payer_name)
+    os.makedirs("messages/pain001", exist_ok=True)
+    filename = f"messages/pain001/pain001_{payer_name.replace(' ', '_')}_{next_id()}.xml"
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(pretty_xml)
+    write_message(tree, filename)
     
-    logging.info(f"PAIN.001 message successfully saved to {filename}")
+    logging.info("PAIN.001 message successfully saved to %s", filename)
     return filename
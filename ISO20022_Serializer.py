@@ -0,0 +1,103 @@
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+
+# Indented output by default; turn off with set_pretty_print(False) for high-volume runs
+PRETTY_PRINT = True
+
+XML_DECLARATION = '<?xml version="1.0" ?>'
+INDENT = "  "
+
+def set_pretty_print(enabled):
+    global PRETTY_PRINT
+    PRETTY_PRINT = enabled
+
+def escape_text(text):
+    """Escape character data the way minidom writes it (quotes included)."""
+    if '\r' in text:
+        # The XML parser behind minidom normalises line endings
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+class _UnsupportedMarkup(Exception):
+    """Namespaced names, comments and processing instructions use the minidom path."""
+
+def _start_tag(elem):
+    tag = elem.tag
+    if not isinstance(tag, str) or tag[:1] == "{":
+        raise _UnsupportedMarkup(tag)
+    if not elem.attrib:
+        return "<" + tag
+    attrs = []
+    for name, value in elem.attrib.items():
+        if name[:1] == "{":
+            raise _UnsupportedMarkup(name)
+        attrs.append(f' {name}="{escape_text(value)}"')
+    return "<" + tag + "".join(attrs)
+
+def _write_pretty(elem, indent, out):
+    tag = elem.tag
+    text = elem.text
+    if not len(elem):
+        if text:
+            out(f"{indent}{_start_tag(elem)}>{escape_text(text)}</{tag}>\n")
+        else:
+            out(f"{indent}{_start_tag(elem)}/>\n")
+        return
+
+    out(f"{indent}{_start_tag(elem)}>\n")
+    child_indent = indent + INDENT
+    if text:
+        out(f"{child_indent}{escape_text(text)}\n")
+    for child in elem:
+        _write_pretty(child, child_indent, out)
+        if child.tail:
+            out(f"{child_indent}{escape_text(child.tail)}\n")
+    out(f"{indent}</{tag}>\n")
+
+def _write_compact(elem, out):
+    tag = elem.tag
+    text = elem.text
+    if not len(elem) and not text:
+        out(f"{_start_tag(elem)}/>")
+        return
+
+    out(f"{_start_tag(elem)}>")
+    if text:
+        out(escape_text(text))
+    for child in elem:
+        _write_compact(child, out)
+        if child.tail:
+            out(escape_text(child.tail))
+    out(f"</{tag}>")
+
+def serialize_message_minidom(tree):
+    """The original serialization: ET.tostring, minidom.parseString, toprettyxml."""
+    rough_string = ET.tostring(tree.getroot(), 'utf-8')
+    reparsed = minidom.parseString(rough_string)
+    return reparsed.toprettyxml(indent=INDENT)
+
+def serialize_message(tree, pretty=None):
+    """Serialize a message in one pass over the tree.
+
+    Indented output is identical to serialize_message_minidom. Compact output
+    has no indentation or line breaks after the XML declaration.
+    """
+    pretty = PRETTY_PRINT if pretty is None else pretty
+    root = tree.getroot() if isinstance(tree, ET.ElementTree) else tree
+
+    parts = [XML_DECLARATION, "\n"]
+    try:
+        if pretty:
+            _write_pretty(root, "", parts.append)
+        else:
+            _write_compact(root, parts.append)
+            parts.append("\n")
+    except _UnsupportedMarkup:
+        return serialize_message_minidom(ET.ElementTree(root))
+    return "".join(parts)
+
+def write_message(tree, filename, pretty=None):
+    """Write a message tree, or XML text already rendered from a template, to filename."""
+    text = tree if isinstance(tree, str) else serialize_message(tree, pretty)
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(text)
@@ -0,0 +1,76 @@
+from datetime import datetime, timezone
+import ISO20022_Serializer
+from ISO20022_Serializer import XML_DECLARATION, INDENT, escape_text
+
+class Const:
+    """Fixed text inside a template skeleton."""
+    def __init__(self, text):
+        self.text = text
+
+class MessageTemplate:
+    """A fixed message shape compiled once into text fragments and field slots.
+
+    The skeleton is a nested (tag, content) tuple. Content is a list of child
+    skeletons, a field name filled in by render(), or a Const. render() returns
+    the same text serialize_message() produces for the equivalent ElementTree,
+    without building the tree.
+    """
+
+    def __init__(self, skeleton):
+        self.pretty_parts = self._compile(skeleton, pretty=True)
+        self.compact_parts = self._compile(skeleton, pretty=False)
+
+    def _compile(self, skeleton, pretty):
+        parts = [XML_DECLARATION + "\n"]
+        self._compile_node(skeleton, "", pretty, parts)
+        if not pretty:
+            parts.append("\n")
+
+        # Merge neighbouring text fragments so render() only joins what varies
+        merged = []
+        for part in parts:
+            if isinstance(part, str) and merged and isinstance(merged[-1], str):
+                merged[-1] += part
+            else:
+                merged.append(part)
+        return merged
+
+    def _compile_node(self, node, indent, pretty, parts):
+        tag, content = node
+        newline = "\n" if pretty else ""
+        prefix = indent if pretty else ""
+        if isinstance(content, list):
+            parts.append(f"{prefix}<{tag}>{newline}")
+            for child in content:
+                self._compile_node(child, indent + INDENT, pretty, parts)
+            parts.append(f"{prefix}</{tag}>{newline}")
+        elif isinstance(content, Const):
+            parts.append(f"{prefix}<{tag}>{escape_text(content.text)}</{tag}>{newline}" if content.text else f"{prefix}<{tag}/>{newline}")
+        else:
+            parts.append(prefix)
+            # (field name, opening tag, closing tag, empty element)
+            parts.append((content, f"<{tag}>", f"</{tag}>", f"<{tag}/>"))
+            parts.append(newline)
+
+    def render(self, fields, pretty=None):
+        pretty = ISO20022_Serializer.PRETTY_PRINT if pretty is None else pretty
+        out = []
+        append = out.append
+        for part in (self.pretty_parts if pretty else self.compact_parts):
+            if part.__class__ is str:
+                append(part)
+                continue
+            name, open_tag, close_tag, empty_tag = part
+            value = fields[name]
+            if value:
+                append(open_tag)
+                append(escape_text(value))
+                append(close_tag)
+            else:
+                append(empty_tag)
+        return "".join(out)
+
+def creation_timestamp(now=None):
+    """Return the CreDtTm (2025-05-02T00:42:07) for now."""
+    now = now or datetime.now(timezone.utc)
+    return now.replace(tzinfo=None, microsecond=0).isoformat()
@@ -0,0 +1,99 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from db_manager import DB_PATH, get_connection, add_reset_listener
+
+MSG_ID = "M"
+END_TO_END_ID = "E"
+
+class DuplicateIndex:
+    """Remembers the MsgIds and EndToEndIds the exchange has accepted.
+
+    The seen_messages table is the authority: a message's ids are claimed
+    with one INSERT OR IGNORE, and the message is a duplicate if any of them
+    was already there. Every process sharing the database therefore sees the
+    ids the others accepted, whichever process or worker a resubmission
+    reaches. A bounded LRU cache of the ids this process accepted recently
+    rejects repeats without touching the database.
+    """
+
+    def __init__(self, db_path=DB_PATH, cache_size=100_000):
+        self.db_path = os.path.abspath(db_path)
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.recent = OrderedDict()     # (kind, id) -> None, least recently seen first
+        self._create_table()
+
+    def _create_table(self):
+        conn = get_connection(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS seen_messages (
+                kind TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                PRIMARY KEY (kind, message_id)
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+
+    def reset(self):
+        """Forget every id; called when init_db has dropped seen_messages."""
+        with self.lock:
+            self.recent.clear()
+            self._create_table()
+
+    def check_and_add(self, msg_id=None, end_to_end_id=None):
+        """Return True if any given id was seen before; otherwise record them and return False."""
+        keys = []
+        if msg_id is not None:
+            keys.append((MSG_ID, msg_id))
+        if end_to_end_id is not None:
+            keys.append((END_TO_END_ID, end_to_end_id))
+        with self.lock:
+            for key in keys:
+                if key in self.recent:
+                    self.recent.move_to_end(key)
+                    return True
+            if not self._claim(keys):
+                return True
+
+            for key in keys:
+                self.recent[key] = None
+            while len(self.recent) > self.cache_size:
+                self.recent.popitem(last=False)
+        return False
+
+    def _claim(self, keys):
+        # All of the ids or none: a message whose MsgId is taken must not claim its EndToEndId
+        conn = get_connection(self.db_path)
+        try:
+            cursor = conn.executemany("INSERT OR IGNORE INTO seen_messages (kind, message_id) VALUES (?, ?)", keys)
+            if cursor.rowcount < len(keys):
+                conn.rollback()
+                return False
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error("Duplicate index write failed: %s", e)
+        return True
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_duplicate_index(db_path=DB_PATH):
+    """The process-wide duplicate index for db_path."""
+    db_path = os.path.abspath(db_path)
+    index = _indexes.get(db_path)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(db_path)
+            if index is None:
+                index = DuplicateIndex(db_path)
+                add_reset_listener(index.reset)
+                _indexes[db_path] = index
+    return index
+
+def close_duplicate_indexes():
+    """Forget the indexes, e.g. before the database is removed."""
+    with _indexes_lock:
+        _indexes.clear()
@@ -0,0 +1,103 @@
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+
+# Append-only JSON Lines stream of typed payment events
+EVENT_STREAM_FILE = 'settlement_events.jsonl'
+
+# Event stages
+PAIN001_CREATED = "pain001_created"
+PACS008_CREATED = "pacs008_created"
+PACS008_RECEIVED = "pacs008_received"
+PACS008_REJECTED = "pacs008_rejected"
+PACS002_CREATED = "pacs002_created"
+FORWARDED = "forwarded"
+RECEIVER_RESPONSE = "receiver_response"
+ROUTING_FAILED = "routing_failed"
+SETTLEMENT = "settlement"
+CAMT054_CREATED = "camt054_created"
+
+class EventStream:
+    """Writes one compact JSON object per line for every payment event.
+
+    Each event carries the stage, a correlation id (the EndToEndId of the
+    payment, or the id of the message a notification refers to), a Unix
+    timestamp and stage specific fields such as amounts and BICs.
+
+    emit() only queues the event; a background thread encodes whatever has
+    queued up and appends it to the file in one write, so event fields must
+    not be mutated after the call.
+    """
+
+    def __init__(self, path=EVENT_STREAM_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.writer = None
+
+    def emit(self, stage, correlation_id, **fields):
+        event = {"ts": time.time(), "stage": stage, "cid": correlation_id}
+        event.update(fields)
+        if self.writer is None:
+            self._start_writer()
+        self.queue.put(event)
+
+    def _start_writer(self):
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, name="event-stream-writer", daemon=True)
+                self.writer.start()
+
+    def _write_loop(self):
+        # Unbuffered, so each batch is a single append and lines stay whole when several processes write
+        with open(self.path, 'ab', buffering=0) as file:
+            while True:
+                events = [self.queue.get()]
+                while True:
+                    try:
+                        events.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in events
+                lines = [json.dumps(event, separators=(',', ':'), default=str) + '\n' for event in events if event is not None]
+                try:
+                    if lines:
+                        file.write("".join(lines).encode('utf-8'))
+                except OSError as e:
+                    logging.error("Event stream write failed: %s", e)
+                finally:
+                    for _ in events:
+                        self.queue.task_done()
+                if stop:
+                    return
+
+    def flush(self):
+        """Block until every queued event has been written to the file."""
+        self.queue.join()
+
+    def close(self):
+        """Write out queued events and stop the writer; a later emit() starts a new one."""
+        with self.lock:
+            if self.writer is not None:
+                self.queue.put(None)
+                self.writer.join()
+                self.writer = None
+
+_event_stream = EventStream()
+atexit.register(lambda: _event_stream.close())
+
+def emit_event(stage, correlation_id, **fields):
+    _event_stream.emit(stage, correlation_id, **fields)
+
+def flush_events():
+    """Block until this process's queued events are on disk."""
+    _event_stream.flush()
+
+def read_events(lines):
+    """Decode events from an iterable of JSON lines, skipping blank lines."""
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from RTR_Exchange_Processor import RTRExchangeProcessor
+
+class ExchangePipeline:
+    """Runs many PACS.008 messages through the exchange with overlapping stages.
+
+    Stages are connected by bounded queues:
+
+        validate + ack -> sequencer -> forward + receiver -> settle -> notify
+
+    Validation, forwarding and notification use several workers so file I/O and
+    the simulated receiver latency overlap across payments. The sequencer puts
+    validated payments back into submission order and numbers them per debtor,
+    and the single settlement worker holds back any payment whose earlier
+    payments from the same debtor have not finished, so each debtor account
+    still settles in submission order.
+    """
+
+    def __init__(self, processor=None, workers=8, queue_size=100, receiver_latency=0.0, max_in_flight=1000):
+        self.processor = processor or RTRExchangeProcessor()
+        self.workers = workers
+        self.queue_size = queue_size
+        self.receiver_latency = receiver_latency
+        self.max_in_flight = max_in_flight
+
+    def run_sync(self, xml_file_paths):
+        return asyncio.run(self.run(xml_file_paths))
+
+    async def run(self, xml_file_paths):
+        """Process every message and return the settlement statuses in input order."""
+        loop = asyncio.get_running_loop()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._validate_queue = asyncio.Queue(self.queue_size)
+        self._sequence_queue = asyncio.Queue(self.queue_size)
+        self._forward_queue = asyncio.Queue(self.queue_size)
+        self._settle_queue = asyncio.Queue(self.queue_size)
+        self._notify_queue = asyncio.Queue(self.queue_size)
+
+        tasks = [asyncio.create_task(self._sequencer()), asyncio.create_task(self._settler())]
+        for _ in range(self.workers):
+            tasks.append(asyncio.create_task(self._validate_worker()))
+            tasks.append(asyncio.create_task(self._forward_worker()))
+            tasks.append(asyncio.create_task(self._notify_worker()))
+
+        results = []
+        try:
+            for index, path in enumerate(xml_file_paths):
+                await self._in_flight.acquire()
+                item = {"index": index, "path": path, "payment": None, "status": None, "result": loop.create_future()}
+                results.append(item["result"])
+                await self._validate_queue.put(item)
+            return await asyncio.gather(*results)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _finish(self, item, status):
+        item["result"].set_result(status)
+        self._in_flight.release()
+
+    # === Stage workers ===
+    async def _validate_worker(self):
+        while True:
+            item = await self._validate_queue.get()
+            try:
+                item["payment"], item["status"] = await asyncio.to_thread(self.processor.validate_message, item["path"])
+                if item["payment"]:
+                    await asyncio.to_thread(self.processor.acknowledge_payment, item["payment"])
+            except Exception as e:
+                logging.error("Pipeline validation error for %s: %s", item['path'], e)
+                item["payment"], item["status"] = None, f"Settlement Failed: {str(e)}"
+            await self._sequence_queue.put(item)
+
+    async def _sequencer(self):
+        next_index = 0
+        waiting = {}
+        debtor_counts = {}
+        while True:
+            item = await self._sequence_queue.get()
+            waiting[item["index"]] = item
+            while next_index in waiting:
+                item = waiting.pop(next_index)
+                next_index += 1
+                if item["payment"] is None:
+                    self._finish(item, item["status"])
+                    continue
+                debtor = item["payment"]["debtor"]
+                item["debtor_seq"] = debtor_counts.get(debtor, 0)
+                debtor_counts[debtor] = item["debtor_seq"] + 1
+                await self._forward_queue.put(item)
+
+    async def _forward_worker(self):
+        while True:
+            item = await self._forward_queue.get()
+            try:
+                await asyncio.to_thread(self.processor.forward_payment, item["payment"])
+                if self.receiver_latency:
+                    await asyncio.sleep(self.receiver_latency)
+                item["status"] = await asyncio.to_thread(self.processor.confirm_with_receiver, item["payment"])
+            except Exception as e:
+                logging.error("Pipeline forwarding error for %s: %s", item['path'], e)
+                item["status"] = f"Settlement Failed: {str(e)}"
+            # Rejected payments still pass through the settler to release later ones
+            await self._settle_queue.put(item)
+
+    async def _settler(self):
+        next_seq = {}
+        held = {}
+        while True:
+            item = await self._settle_queue.get()
+            debtor = item["payment"]["debtor"]
+            held[(debtor, item["debtor_seq"])] = item
+            while (debtor, next_seq.get(debtor, 0)) in held:
+                item = held.pop((debtor, next_seq.get(debtor, 0)))
+                next_seq[debtor] = item["debtor_seq"] + 1
+                if item["status"] is not None:
+                    self._finish(item, item["status"])
+                    continue
+                try:
+                    item["status"] = self.processor.route_and_settle(item["payment"])
+                except Exception as e:
+                    logging.error("Pipeline settlement error for %s: %s", item['path'], e)
+                    item["status"] = f"Settlement Failed: {str(e)}"
+                if "Success" in item["status"]:
+                    await self._notify_queue.put(item)
+                else:
+                    self._finish(item, item["status"])
+
+    async def _notify_worker(self):
+        while True:
+            item = await self._notify_queue.get()
+            try:
+                await asyncio.to_thread(self.processor.notify_settlement, item["payment"])
+            except Exception as e:
+                logging.error("Pipeline notification error for %s: %s", item['path'], e)
+            self._finish(item, item["status"])
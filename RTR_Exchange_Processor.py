@@ -1,154 +1,451 @@
+import io
 import os
+import time
+import asyncio
 import xml.etree.ElementTree as ET
-from datetime import datetime
 import logging
+from RTR_Logging import configure_logging
 from RTR_Settlement_Processor import RTRSettlementProcessor
-from ISO20022_Pacs002_Generator import generate_pacs002_message, save_pacs002_message
+from ISO20022_Pacs002_Generator import render_pacs002_message, save_pacs002_message
 from Agent_Creditor_Simulator import ReceiverBankSimulator
+from RTR_Event_Stream import emit_event, PACS008_RECEIVED, PACS008_REJECTED, FORWARDED, RECEIVER_RESPONSE, ROUTING_FAILED
+from RTR_Message_Transport import FILE_TRANSPORT, MEMORY_TRANSPORT, MessageArchiver, load_message, describe_message
+from RTR_Routing_Directory import get_routing_directory
+from RTR_Message_Archive import PACS008_FORWARDED, PACS002_RESPONSE, PACS002_SETTLEMENT_COMPLETE
+from RTR_Message_Ids import next_id
+from RTR_Duplicate_Index import get_duplicate_index
+from ISO20022_Extractors import PACS008_EXTRACTOR, MISSING, parse_amount
+from RTR_Metrics import get_metrics
+from RTR_Net_Settlement import GROSS, ACCEPTED
+from RTR_Liquidity_Queue import QUEUED
 
 # Setup logging for settlement simulation
-logging.basicConfig(filename='settlement_log.txt', level=logging.INFO, format='%(asctime)s - %(message)s')
+configure_logging()
 
-# Update FIs list to use correct BIC codes
-FIs = ["BOFCUS3NXXX", "CHASUS33XXX", "CITIUS33XXX"]
+# How a payment that settles later is notified: (SINGLE, MsgId) or (BULK, EndToEndId)
+SINGLE = "single"
+BULK = "bulk"
 
 # Simulated Processor to Accept, Validate, Route, and Settle Payments
 class RTRExchangeProcessor:
-    def __init__(self):
-        self.settlement_processor = RTRSettlementProcessor()
-        self.receiver_bank = ReceiverBankSimulator()
+    def __init__(self, transport=FILE_TRANSPORT, archiver=None, stage_observer=None, duplicates=None, metrics=None, settlement_mode=GROSS,
+                 liquidity_queue=False, ledger=None):
+        # With MEMORY_TRANSPORT messages are passed on as trees and only archived to messages/
+        self.transport = transport
+        self.archiver = archiver or MessageArchiver()
+        # Optional callable(stage, seconds) told how long each process_message stage took
+        self.stage_observer = stage_observer
+        # Participants registered in bic_codes, indexed in memory
+        self.routing = get_routing_directory()
+        # MsgIds and EndToEndIds already accepted, so a resubmitted PACS.008 is not settled twice
+        self.duplicates = duplicates or get_duplicate_index()
+        # Live TPS, failure and net position windows; rejections are counted here, settlements by the settlement processor
+        self.metrics = metrics or get_metrics()
+        # With NET, payments are accepted into a clearing cycle and notified once it posts
+        # With liquidity_queue, a payment short of funds is held and notified once it settles
+        # An RTR_Ledger_Engine.LedgerEngine, shared by every processor, settles in memory instead of in SQLite
+        self.settlement_processor = RTRSettlementProcessor(ledger=ledger, routing=self.routing, metrics=self.metrics,
+                                                           settlement_mode=settlement_mode, liquidity_queue=liquidity_queue,
+                                                           on_settled=self.notify_settled_later)
+        self.receiver_bank = ReceiverBankSimulator(archiver=self.archiver)
 
     def forward_to_receiver(self, original_tree, creditor_bic):
-        logging.info(f"Forwarding PACS.008 message to receiving bank: {creditor_bic}")
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        logging.info("Forwarding PACS.008 message to receiving bank: %s", creditor_bic)
+        forward_id = next_id()
         
         # Create a copy of the original message
         forward_tree = ET.ElementTree(ET.fromstring(ET.tostring(original_tree.getroot())))
         
         # Update the message ID for forwarding
         msg_id = forward_tree.find(".//MsgId")
-        msg_id.text = f"FWD-{timestamp}"
-        
-        # Save forwarded message
-        if not os.path.exists("messages/pacs008/forwarded"):
-            os.makedirs("messages/pacs008/forwarded")
-            
-        filename = f"messages/pacs008/forwarded/to_{creditor_bic}_{timestamp}.xml"
-        forward_tree.write(filename, encoding='utf-8', xml_declaration=True)
-        logging.info(f"Forwarded PACS.008 saved to {filename}")
-        return filename
+        msg_id.text = f"FWD-{forward_id}"
+        end_to_end_id = forward_tree.find(".//EndToEndId")
+        emit_event(FORWARDED, end_to_end_id.text if end_to_end_id is not None else None, msg_id=msg_id.text, creditor_bic=creditor_bic)
+
+        if self.transport == MEMORY_TRANSPORT:
+            # The receiving bank gets the tree itself; the file is only an archive copy
+            self.archiver.archive_message(PACS008_FORWARDED, save_forwarded_message, forward_tree, creditor_bic, forward_id)
+            return forward_tree
+        return save_forwarded_message(forward_tree, creditor_bic, forward_id)
 
     def send_settlement_notifications(self, msg_id_value, debtor_value, creditor_value):
-        logging.info(f"Sending settlement completion notifications to {debtor_value} and {creditor_value}")
+        logging.info("Sending settlement completion notifications to %s and %s", debtor_value, creditor_value)
         
         # Generate and save PACS.002 for debtor
-        debtor_pacs002 = generate_pacs002_message(msg_id_value, "ACSC", "Settlement completed successfully")
-        debtor_notification = save_pacs002_message(debtor_pacs002, debtor_value, "settlement_complete")
+        debtor_pacs002 = render_pacs002_message(msg_id_value, "ACSC", "Settlement completed successfully")
+        debtor_notification = self.archiver.archive_message(PACS002_SETTLEMENT_COMPLETE, save_pacs002_message, debtor_pacs002, debtor_value, "settlement_complete")
         
         # Generate and save PACS.002 for creditor
-        creditor_pacs002 = generate_pacs002_message(msg_id_value, "ACSC", "Settlement completed successfully")
-        creditor_notification = save_pacs002_message(creditor_pacs002, creditor_value, "settlement_complete")
+        creditor_pacs002 = render_pacs002_message(msg_id_value, "ACSC", "Settlement completed successfully")
+        creditor_notification = self.archiver.archive_message(PACS002_SETTLEMENT_COMPLETE, save_pacs002_message, creditor_pacs002, creditor_value, "settlement_complete")
         
         logging.info("Settlement notifications sent to both parties")
         return debtor_notification, creditor_notification
 
     def process_message(self, xml_file_path):
-        logging.info(f"Processing payment message from file: {xml_file_path}")
-        # Step 1: Read the incoming XML file
-        if not os.path.exists(xml_file_path):
-            logging.error(f"Error: XML file not found at {xml_file_path}")
-            return "Settlement Failed: File not found."
+        """Process a PACS.008 given as a file path, or as an ElementTree with the memory transport."""
+        # Step 1-3: Read, extract and validate the incoming PACS.008
+        payment, failure = self.run_stage("validate", self.validate_message, xml_file_path)
+        if failure:
+            return failure
+
+        # After successful validation, send acknowledgment
+        self.run_stage("acknowledge", self.acknowledge_payment, payment)
+
+        # Forward PACS.008 to receiving bank and wait for receiver's PACS.002
+        self.run_stage("forward", self.forward_payment, payment)
+        failure = self.run_stage("receiver", self.confirm_with_receiver, payment)
+        if failure:
+            return failure
+
+        # Step 4-5: Route and settle only after receiver acceptance
+        settlement_status = self.run_stage("settle", self.route_and_settle, payment)
+        if "Success" in settlement_status:
+            self.run_stage("notify", self.notify_settlement, payment)
+        return settlement_status
 
+    def run_stage(self, stage, func, *args):
+        if self.stage_observer is None:
+            return func(*args)
+        start = time.perf_counter()
         try:
-            tree = ET.parse(xml_file_path)
-            root = tree.getroot()
-
-            # Step 2: Extract necessary fields (Debtor, Creditor, Amount)
-            debtor = root.find(".//Debtor")
-            creditor = root.find(".//Creditor")
-            amount = root.find(".//Amt")
-            msg_id = root.find(".//MsgId")
-
-            # Step 3: Validate mandatory fields
-            if debtor is None or creditor is None or amount is None or msg_id is None or not debtor.text.strip() or not creditor.text.strip() or not amount.text.strip() or not msg_id.text.strip():
-                logging.error(f"Validation Failed: Missing mandatory fields in {xml_file_path}")
-                return "Settlement Failed: Missing mandatory fields."
-
-            debtor_value = debtor.text.strip()
-            creditor_value = creditor.text.strip()
-            amount_value = amount.text.strip()
-            msg_id_value = msg_id.text.strip()
-
-            # Ensure Amount is a valid number
-            try:
-                amount_value = float(amount_value)
-            except ValueError:
-                logging.error(f"Settlement Failed: Invalid amount in {xml_file_path}.")
-                return "Settlement Failed: Invalid amount format."
-
-            logging.info(f"Message validation successful for payment of {amount_value} from {debtor_value} to {creditor_value}")
-
-            # After successful validation, send acknowledgment
-            pacs002_tree = generate_pacs002_message(msg_id_value, "ACCP")
-            pacs002_filename = save_pacs002_message(pacs002_tree, debtor_value)
-            logging.info(f"Generated PACS.002 acknowledgment for {debtor_value}")
-
-            # Forward PACS.008 to receiving bank
-            forwarded_filename = self.forward_to_receiver(tree, creditor_value)
-            logging.info(f"PACS.008 message forwarded to receiving bank {creditor_value}")
-
-            # Wait for receiver's PACS.002
-            success, receiver_response = self.receiver_bank.process_incoming_pacs008(forwarded_filename)
-            if not success:
-                logging.error(f"Receiver bank rejected payment: {receiver_response}")
-                return "Settlement Failed: Receiver bank rejected payment"
-            
-            logging.info("Received acceptance PACS.002 from receiver bank")
-
-            # Continue with routing and settlement only after receiver acceptance
-            routing_status = self.route_payment(debtor_value, creditor_value, amount_value)
-
-            # Step 5: Settle the payment and log the outcome
-            if routing_status == "Success":
-                settlement_status = self.settle_payment(debtor_value, creditor_value, amount_value)
-                if "Success" in settlement_status:
-                    # Send settlement completion notifications
-                    self.send_settlement_notifications(msg_id_value, debtor_value, creditor_value)
-                    
-                    # Notify receiver bank of settlement completion
-                    self.receiver_bank.handle_settlement_completion(msg_id_value, creditor_value, amount_value)
-                    
-                return settlement_status
+            return func(*args)
+        finally:
+            self.stage_observer(stage, time.perf_counter() - start)
+
+    async def process_message_async(self, xml_file_path, receiver_latency=0.0):
+        """Run process_message as a coroutine so many payments can overlap their I/O.
+
+        File I/O stages run in worker threads and receiver_latency simulates the
+        receiving bank's response time. Settlement runs on the event loop thread
+        with that thread's pooled connection, so one loop settles its payments
+        one at a time in the order they reach this step. Use RTR_Exchange_Pipeline
+        to keep per-debtor settlement order when many payments are in flight.
+        """
+        payment, failure = await asyncio.to_thread(self.validate_message, xml_file_path)
+        if failure:
+            return failure
+
+        await asyncio.to_thread(self.acknowledge_payment, payment)
+        await asyncio.to_thread(self.forward_payment, payment)
+        if receiver_latency:
+            await asyncio.sleep(receiver_latency)
+        failure = await asyncio.to_thread(self.confirm_with_receiver, payment)
+        if failure:
+            return failure
+
+        settlement_status = self.route_and_settle(payment)
+        if "Success" in settlement_status:
+            await asyncio.to_thread(self.notify_settlement, payment)
+        return settlement_status
+
+    def process_bulk_message(self, xml_file_path, chunk_size=1000, result_callback=None):
+        """Settle every CdtTrfTxInf of a bulk PACS.008 file without loading the whole file.
+
+        Also accepts a bulk PACS.008 tree from FISimulator.process_pain001_batch
+        with the memory transport.
+
+        The file is read with iterparse and each transaction element is cleared
+        and detached as soon as its fields are extracted, so memory stays flat
+        however many transactions the file holds. Valid transactions are
+        settled in chunks of chunk_size with settle_batch. The group MsgId is
+        checked for duplicates once and each EndToEndId per transaction.
+        Transactions are not forwarded to the receiving bank one by one; the
+        debtor agent gets one PACS.002 group status for the file and each
+        creditor a CAMT.054 per settled transaction.
+
+        result_callback(end_to_end_id, status) is called for every
+        transaction. Returns a summary dict with the group MsgId, the number of
+        transactions, settled payments, payments accepted for net settlement
+        and payments held in the liquidity queue, and a count per status.
+        """
+        summary = {"msg_id": None, "transactions": 0, "settled": 0, "accepted": 0, "queued": 0, "statuses": {}, "error": None}
+        logging.info("Processing bulk payment file: %s", describe_message(xml_file_path))
+        if isinstance(xml_file_path, str) and not os.path.exists(xml_file_path):
+            logging.error("Error: XML file not found at %s", xml_file_path)
+            summary["error"] = "Settlement Failed: File not found."
+            return summary
+        if isinstance(xml_file_path, ET.ElementTree):
+            # Memory transport: the tree is already built, so replay it through the same parser
+            xml_file_path = io.BytesIO(ET.tostring(xml_file_path.getroot()))
+
+        def record(end_to_end_id, status):
+            summary["transactions"] += 1
+            summary["statuses"][status] = summary["statuses"].get(status, 0) + 1
+            if result_callback is not None:
+                result_callback(end_to_end_id, status)
+
+        chunk = []
+        debtor = None
+        declared_count = None
+        parents = []
+        try:
+            for event, elem in ET.iterparse(xml_file_path, events=("start", "end")):
+                if event == "start":
+                    parents.append(elem)
+                    continue
+                parents.pop()
+
+                if elem.tag == "GrpHdr":
+                    summary["msg_id"] = (elem.findtext("MsgId") or "").strip() or None
+                    declared_count = elem.findtext("NbOfTxs")
+                    if summary["msg_id"] is None:
+                        logging.error("Validation Failed: Missing MsgId in %s", xml_file_path)
+                        summary["error"] = "Settlement Failed: Missing mandatory fields."
+                        return summary
+                    if self.duplicates.check_and_add(msg_id=summary["msg_id"]):
+                        logging.error("Settlement Failed: Duplicate bulk message %s", summary["msg_id"])
+                        emit_event(PACS008_REJECTED, None, msg_id=summary["msg_id"], reason="Duplicate message")
+                        summary["error"] = "Settlement Failed: Duplicate message"
+                        return summary
+                elif elem.tag == "CdtTrfTxInf":
+                    if summary["msg_id"] is None:
+                        logging.error("Validation Failed: CdtTrfTxInf before GrpHdr in %s", xml_file_path)
+                        summary["error"] = "Settlement Failed: Missing mandatory fields."
+                        return summary
+                    payment, failure = self.validate_transaction(elem, summary["msg_id"])
+                    if failure:
+                        self.metrics.record(failure, payment["debtor"], payment["creditor"])
+                        record(payment["end_to_end_id"], failure)
+                    else:
+                        debtor = debtor or payment["debtor"]
+                        chunk.append(payment)
+                        if len(chunk) >= chunk_size:
+                            self.settle_bulk_chunk(chunk, record, summary)
+                            chunk = []
+                else:
+                    continue
+
+                # Done with this element: free its subtree and detach it from its parent
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
+        except ET.ParseError as e:
+            # Transactions read before the error are complete and still settled below
+            logging.error("Settlement Failed: XML parsing error in %s: %s", xml_file_path, e)
+            summary["error"] = "Settlement Failed: XML parsing error."
+
+        self.settle_bulk_chunk(chunk, record, summary)
+        if declared_count and declared_count.strip() != str(summary["transactions"]):
+            logging.warning("Bulk message %s declares %s transactions but contains %s", summary["msg_id"], declared_count.strip(), summary["transactions"])
+
+        if summary["msg_id"] is not None and debtor is not None:
+            accepted = summary["settled"] + summary["accepted"] + summary["queued"]
+            if summary["settled"] == summary["transactions"]:
+                group_status = "ACSC"
+            elif accepted == summary["transactions"]:
+                group_status = "ACSP"
             else:
-                logging.error(f"Settlement Failed: Routing issue with {debtor_value} and {creditor_value}.")
-                return "Settlement Failed: Routing issue."
-        
+                group_status = "PART" if accepted else "RJCT"
+            reason = f"{summary['settled']} of {summary['transactions']} transactions settled"
+            if summary["accepted"]:
+                reason += f", {summary['accepted']} pending net settlement"
+            if summary["queued"]:
+                reason += f", {summary['queued']} held for liquidity"
+            pacs002_xml = render_pacs002_message(summary["msg_id"], group_status, reason)
+            self.archiver.archive_message(PACS002_SETTLEMENT_COMPLETE, save_pacs002_message, pacs002_xml, debtor, "settlement_complete")
+        logging.info("Bulk message %s: %s of %s transactions settled", summary["msg_id"], summary["settled"], summary["transactions"])
+        return summary
+
+    def validate_transaction(self, tx, msg_id_value):
+        """Extract and validate one CdtTrfTxInf of a bulk message; returns (payment, failure status or None)."""
+        debtor_value = (tx.findtext("Debtor") or "").strip()
+        creditor_value = (tx.findtext("Creditor") or "").strip()
+        amount_value = (tx.findtext("Amt") or "").strip()
+        end_to_end_id_value = (tx.findtext("PmtId/EndToEndId") or "").strip() or None
+        payment = {"msg_id": msg_id_value, "end_to_end_id": end_to_end_id_value, "debtor": debtor_value, "creditor": creditor_value}
+
+        if not (debtor_value and creditor_value and amount_value and end_to_end_id_value):
+            logging.error("Validation Failed: Missing mandatory fields in transaction %s of %s", end_to_end_id_value, msg_id_value)
+            emit_event(PACS008_REJECTED, end_to_end_id_value, msg_id=msg_id_value, reason="Missing mandatory fields")
+            return payment, "Settlement Failed: Missing mandatory fields."
+        try:
+            payment["amount"] = parse_amount(amount_value)
+        except ValueError:
+            logging.error("Settlement Failed: Invalid amount in transaction %s of %s.", end_to_end_id_value, msg_id_value)
+            emit_event(PACS008_REJECTED, end_to_end_id_value, msg_id=msg_id_value, reason="Invalid amount format")
+            return payment, "Settlement Failed: Invalid amount format."
+        if self.duplicates.check_and_add(end_to_end_id=end_to_end_id_value):
+            logging.error("Settlement Failed: Duplicate transaction %s in %s", end_to_end_id_value, msg_id_value)
+            emit_event(PACS008_REJECTED, end_to_end_id_value, msg_id=msg_id_value, reason="Duplicate message")
+            return payment, "Settlement Failed: Duplicate message"
+
+        emit_event(PACS008_RECEIVED, end_to_end_id_value, msg_id=msg_id_value, debtor_bic=debtor_value, creditor_bic=creditor_value, amount=payment["amount"])
+        return payment, None
+
+    def settle_bulk_chunk(self, chunk, record, summary):
+        """Route and settle a chunk of bulk transactions together, then notify the creditors."""
+        if not chunk:
+            return
+        routable = []
+        for payment in chunk:
+            if self.routing.is_routable(payment["creditor"]) and self.routing.is_routable(payment["debtor"]):
+                routable.append(payment)
+            else:
+                logging.error("Settlement Failed: Routing issue with %s and %s.", payment["debtor"], payment["creditor"])
+                emit_event(ROUTING_FAILED, payment["end_to_end_id"], debtor_bic=payment["debtor"], creditor_bic=payment["creditor"], amount=payment["amount"])
+                self.metrics.record("Settlement Failed: Routing issue.", payment["debtor"], payment["creditor"])
+                record(payment["end_to_end_id"], "Settlement Failed: Routing issue.")
+
+        statuses = self.run_stage("settle", self.settlement_processor.settle_batch,
+                                  [(payment["debtor"], payment["creditor"], payment["amount"]) for payment in routable],
+                                  [payment["end_to_end_id"] for payment in routable],
+                                  [(BULK, payment["end_to_end_id"]) for payment in routable])
+        for payment, status in zip(routable, statuses):
+            record(payment["end_to_end_id"], status)
+            if status == ACCEPTED:
+                # The creditor's CAMT.054 follows when the net settlement cycle posts
+                summary["accepted"] += 1
+            elif status == QUEUED:
+                # ... or when the liquidity queue releases the payment
+                summary["queued"] += 1
+            elif status == "Settlement Success":
+                summary["settled"] += 1
+                self.receiver_bank.handle_settlement_completion(payment["end_to_end_id"], payment["creditor"], payment["amount"])
+
+    # === Processing stages ===
+    def validate_message(self, message):
+        """Parse and validate a PACS.008; returns (payment, None) or (None, failure status)."""
+        payment, failure = self._validate_message(message)
+        if failure:
+            self.metrics.record(failure)
+        return payment, failure
+
+    def _validate_message(self, message):
+        xml_file_path = describe_message(message)
+        logging.info("Processing payment message from file: %s", xml_file_path)
+        # Step 1: Read the incoming XML file
+        if isinstance(message, str) and not os.path.exists(message):
+            logging.error("Error: XML file not found at %s", xml_file_path)
+            return None, "Settlement Failed: File not found."
+
+        try:
+            tree = load_message(message)
         except ET.ParseError:
-            logging.error(f"Settlement Failed: XML parsing error in {xml_file_path}.")
-            if 'msg_id_value' in locals():
-                # Send negative acknowledgment
-                pacs002_tree = generate_pacs002_message(msg_id_value, "RJCT", "Invalid message format")
-                save_pacs002_message(pacs002_tree, debtor_value)
-            return "Settlement Failed: XML parsing error."
+            logging.error("Settlement Failed: XML parsing error in %s.", xml_file_path)
+            return None, "Settlement Failed: XML parsing error."
+        root = tree.getroot()
+
+        # Step 2-3: Extract the fields in one pass and validate presence and format
+        fields, problem = PACS008_EXTRACTOR.extract(root)
+        msg_id_value = fields["msg_id"]
+        # The EndToEndId correlates all events of one payment
+        end_to_end_id_value = fields["end_to_end_id"] or msg_id_value
+        if problem and problem[0] == MISSING:
+            logging.error("Validation Failed: Missing mandatory fields in %s", xml_file_path)
+            emit_event(PACS008_REJECTED, None, reason="Missing mandatory fields")
+            return None, "Settlement Failed: Missing mandatory fields."
+        if problem:
+            logging.error("Settlement Failed: Invalid amount in %s.", xml_file_path)
+            emit_event(PACS008_REJECTED, end_to_end_id_value, msg_id=msg_id_value, reason="Invalid amount format")
+            return None, "Settlement Failed: Invalid amount format."
+        debtor_value, creditor_value, amount_value = fields["debtor"], fields["creditor"], fields["amount"]
+
+        # Reject a message whose MsgId or EndToEndId was already accepted
+        if self.duplicates.check_and_add(msg_id_value, end_to_end_id_value):
+            logging.error("Settlement Failed: Duplicate message %s (EndToEndId %s)", msg_id_value, end_to_end_id_value)
+            emit_event(PACS008_REJECTED, end_to_end_id_value, msg_id=msg_id_value, reason="Duplicate message")
+            return None, "Settlement Failed: Duplicate message"
+
+        logging.info("Message validation successful for payment of %s from %s to %s", amount_value, debtor_value, creditor_value)
+        emit_event(PACS008_RECEIVED, end_to_end_id_value, msg_id=msg_id_value, debtor_bic=debtor_value, creditor_bic=creditor_value, amount=amount_value)
+
+        payment = {
+            "tree": tree,
+            "msg_id": msg_id_value,
+            "end_to_end_id": end_to_end_id_value,
+            "debtor": debtor_value,
+            "creditor": creditor_value,
+            "amount": amount_value
+        }
+        return payment, None
+
+    def acknowledge_payment(self, payment):
+        # Only ever written to messages/, so render the text directly from the template
+        pacs002_xml = render_pacs002_message(payment["msg_id"], "ACCP")
+        self.archiver.archive_message(PACS002_RESPONSE, save_pacs002_message, pacs002_xml, payment["debtor"])
+        logging.info("Generated PACS.002 acknowledgment for %s", payment['debtor'])
+
+    def forward_payment(self, payment):
+        payment["forwarded"] = self.forward_to_receiver(payment["tree"], payment["creditor"])
+        logging.info("PACS.008 message forwarded to receiving bank %s", payment['creditor'])
+
+    def confirm_with_receiver(self, payment):
+        """Hand the forwarded PACS.008 to the receiving bank; returns a failure status if it rejects."""
+        success, receiver_response = self.receiver_bank.process_incoming_pacs008(payment["forwarded"])
+        if isinstance(receiver_response, ET.ElementTree):
+            # Memory transport: the receiver's PACS.002 itself, identified by its MsgId
+            receiver_response = receiver_response.findtext(".//GrpHdr/MsgId")
+        emit_event(RECEIVER_RESPONSE, payment["end_to_end_id"], accepted=success, response=receiver_response)
+        if not success:
+            logging.error("Receiver bank rejected payment: %s", receiver_response)
+            self.metrics.record("Settlement Failed: Receiver bank rejected payment", payment["debtor"], payment["creditor"])
+            return "Settlement Failed: Receiver bank rejected payment"
+
+        logging.info("Received acceptance PACS.002 from receiver bank")
+        return None
+
+    def route_and_settle(self, payment):
+        debtor_value, creditor_value, amount_value = payment["debtor"], payment["creditor"], payment["amount"]
+        routing_status = self.route_payment(debtor_value, creditor_value, amount_value)
+
+        # Step 5: Settle the payment and log the outcome
+        if routing_status == "Success":
+            return self.settle_payment(debtor_value, creditor_value, amount_value, payment["end_to_end_id"], (SINGLE, payment["msg_id"]))
+
+        logging.error("Settlement Failed: Routing issue with %s and %s.", debtor_value, creditor_value)
+        emit_event(ROUTING_FAILED, payment["end_to_end_id"], debtor_bic=debtor_value, creditor_bic=creditor_value, amount=amount_value)
+        self.metrics.record("Settlement Failed: Routing issue.", debtor_value, creditor_value)
+        return "Settlement Failed: Routing issue."
+
+    def notify_settlement(self, payment):
+        # Send settlement completion notifications
+        self.send_settlement_notifications(payment["msg_id"], payment["debtor"], payment["creditor"])
+
+        # Notify receiver bank of settlement completion
+        self.receiver_bank.handle_settlement_completion(payment["msg_id"], payment["creditor"], payment["amount"])
+
+    def notify_settled_later(self, debtor, creditor, amount, correlation_id, notice):
+        """Send the notifications the original path skipped, for a payment held or netted until now."""
+        kind, message_id = notice or (SINGLE, correlation_id)
+        if kind == BULK:
+            # Bulk debtors already have their group status; the creditor gets its CAMT.054
+            logging.info("Deferred settlement of transaction %s: Settlement Success", message_id)
+            self.receiver_bank.handle_settlement_completion(message_id, creditor, amount)
+        else:
+            # Same MsgId as the payment's "Settlement status for message" line, so the ETL can join them
+            logging.info("Deferred settlement of message %s: Settlement Success", message_id)
+            self.notify_settlement({"msg_id": message_id, "debtor": debtor, "creditor": creditor, "amount": amount})
 
     def route_payment(self, debtor, creditor, amount):
-        logging.info(f"Validating routing for payment of {amount} from {debtor} to {creditor}")
+        logging.info("Validating routing for payment of %s from %s to %s", amount, debtor, creditor)
         # Route using BIC codes
-        logging.info(f"Attempting to route payment to {creditor}")
-        if creditor in FIs and debtor in FIs:
-            logging.info(f"Routing payment to {creditor} for {amount}")
+        logging.info("Attempting to route payment to %s", creditor)
+        if self.routing.is_routable(creditor) and self.routing.is_routable(debtor):
+            logging.info("Routing payment to %s for %s", creditor, amount)
             return "Success"
         else:
-            logging.error(f"Routing error: Invalid BIC codes - Debtor: {debtor}, Creditor: {creditor}")
+            logging.error("Routing error: Invalid BIC codes - Debtor: %s, Creditor: %s", debtor, creditor)
             return "Failure"
 
-    def settle_payment(self, debtor, creditor, amount):
-        logging.info(f"Initiating settlement for payment of {amount} from {debtor} to {creditor}")
-        logging.info(f"Settling payment from {debtor} to {creditor} of amount {amount}")
-        settlement_status = self.settlement_processor.settle_transaction(debtor, creditor, amount)
-        logging.info(f"Settlement status: {settlement_status}")
+    def settle_payment(self, debtor, creditor, amount, correlation_id=None, notice=None):
+        logging.info("Initiating settlement for payment of %s from %s to %s", amount, debtor, creditor)
+        logging.info("Settling payment from %s to %s of amount %s", debtor, creditor, amount)
+        settlement_status = self.settlement_processor.settle_transaction(debtor, creditor, amount, correlation_id, notice=notice)
+        if notice is not None:
+            logging.info("Settlement status for message %s: %s", notice[1], settlement_status)
+        else:
+            logging.info("Settlement status: %s", settlement_status)
         return settlement_status
 
+def save_forwarded_message(forward_tree, creditor_bic, forward_id):
+    os.makedirs("messages/pacs008/forwarded", exist_ok=True)
+
+    filename = f"messages/pacs008/forwarded/to_{creditor_bic}_{forward_id}.xml"
+    forward_tree.write(filename, encoding='utf-8', xml_declaration=True)
+    logging.info("Forwarded PACS.008 saved to %s", filename)
+    return filename
+
 # Simulated service run
 if __name__ == "__main__":
     processor = RTRExchangeProcessor()
@@ -0,0 +1,155 @@
+import os
+import zlib
+import queue
+import threading
+import itertools
+import logging
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import Future
+from RTR_Exchange_Processor import RTRExchangeProcessor
+
+def shard_for_bic(bic_code, num_workers):
+    """Stable shard number for a debtor BIC (unlike hash(), the same in every process)."""
+    return zlib.crc32(bic_code.encode('utf-8')) % num_workers
+
+def peek_debtor_bic(xml_file_path):
+    """Read the Debtor BIC of a PACS.008 without building the whole tree."""
+    try:
+        for _, elem in ET.iterparse(xml_file_path):
+            if elem.tag == "Debtor":
+                return (elem.text or "").strip() or None
+    except (ET.ParseError, OSError):
+        pass
+    return None
+
+def _worker_main(worker_id, jobs, results, metrics_dir=None):
+    # One long-lived processor, and settlement connection, per worker process
+    processor = RTRExchangeProcessor()
+    # Each worker keeps its own metrics windows, so each writes its own snapshot file when asked to
+    if metrics_dir is not None:
+        processor.metrics.start_snapshot_writer(os.path.join(metrics_dir, f"rtr_metrics_worker{worker_id}.json"))
+    logging.info("Exchange worker %s started (pid %s)", worker_id, os.getpid())
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, xml_file_path = job
+        try:
+            status = processor.process_message(xml_file_path)
+        except Exception as e:
+            logging.error("Exchange worker %s error for %s: %s", worker_id, xml_file_path, e)
+            status = f"Settlement Failed: {str(e)}"
+        results.put((job_id, status))
+    processor.metrics.stop_snapshot_writer()
+    logging.info("Exchange worker %s stopped", worker_id)
+
+class ExchangeWorkerPool:
+    """Shards PACS.008 messages across worker processes by debtor BIC.
+
+    Every message of a debtor goes to the same worker, and each worker handles
+    its queue in order, so per-account settlement order is kept while different
+    debtors are processed in parallel on separate cores. A collector thread in
+    the coordinating process resolves the Future returned by submit(). If a
+    worker process dies, its outstanding Futures fail with a RuntimeError and
+    later messages for its shard are refused the same way.
+
+    With metrics_dir, each worker writes its metrics snapshot there as
+    rtr_metrics_worker<N>.json.
+    """
+
+    def __init__(self, num_workers=None, poll_interval=0.5, metrics_dir=None):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        ctx = multiprocessing.get_context("spawn")
+        self.results = ctx.Queue()
+        self.jobs = [ctx.Queue() for _ in range(self.num_workers)]
+        metrics_dir = os.path.abspath(metrics_dir) if metrics_dir is not None else None
+        self.processes = [
+            ctx.Process(target=_worker_main, args=(worker_id, self.jobs[worker_id], self.results, metrics_dir), daemon=True)
+            for worker_id in range(self.num_workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+        self.poll_interval = poll_interval
+        self.futures = {}               # job id -> (worker id, Future)
+        self.dead = set()               # worker ids whose process exited
+        self.closing = False
+        self.futures_lock = threading.Lock()
+        self.job_ids = itertools.count()
+        self.collector = threading.Thread(target=self._collect_results, name="exchange-collector", daemon=True)
+        self.collector.start()
+
+    def submit(self, xml_file_path, debtor_bic=None):
+        """Queue a PACS.008 file on its debtor's worker and return a Future for its status."""
+        debtor_bic = debtor_bic or peek_debtor_bic(xml_file_path)
+        # Messages without a readable debtor fail validation on any worker
+        worker_id = shard_for_bic(debtor_bic, self.num_workers) if debtor_bic else 0
+
+        future = Future()
+        job_id = next(self.job_ids)
+        with self.futures_lock:
+            if worker_id in self.dead:
+                future.set_exception(RuntimeError(f"Exchange worker {worker_id} is not running"))
+                return future
+            self.futures[job_id] = (worker_id, future)
+        self.jobs[worker_id].put((job_id, xml_file_path))
+        return future
+
+    def map(self, xml_file_paths):
+        """Process many files and return their statuses in input order."""
+        futures = [self.submit(path) for path in xml_file_paths]
+        return [future.result() for future in futures]
+
+    def _collect_results(self):
+        while True:
+            try:
+                result = self.results.get(timeout=self.poll_interval)
+            except queue.Empty:
+                # Only look for dead workers once every result they sent has been read
+                self._fail_dead_workers()
+                continue
+            if result is None:
+                break
+            job_id, status = result
+            with self.futures_lock:
+                pending = self.futures.pop(job_id, None)
+            # A result can land after its worker was found dead and the Future already failed
+            if pending is not None:
+                pending[1].set_result(status)
+
+    def _fail_dead_workers(self):
+        if self.closing:
+            return
+        failed = []
+        with self.futures_lock:
+            for worker_id, process in enumerate(self.processes):
+                if worker_id in self.dead or process.is_alive():
+                    continue
+                self.dead.add(worker_id)
+                logging.error("Exchange worker %s died (exit code %s)", worker_id, process.exitcode)
+                for job_id, (job_worker, future) in list(self.futures.items()):
+                    if job_worker == worker_id:
+                        del self.futures[job_id]
+                        failed.append((worker_id, future))
+        for worker_id, future in failed:
+            future.set_exception(RuntimeError(f"Exchange worker {worker_id} died before finishing the message"))
+
+    def close(self):
+        self.closing = True
+        for jobs in self.jobs:
+            jobs.put(None)
+        for process in self.processes:
+            process.join()
+        self.results.put(None)
+        self.collector.join()
+        with self.futures_lock:
+            leftover, self.futures = list(self.futures.values()), {}
+        for worker_id, future in leftover:
+            future.set_exception(RuntimeError(f"Exchange worker {worker_id} exited before finishing the message"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,278 @@
+import os
+import threading
+import logging
+from array import array
+from datetime import datetime
+from db_manager import get_connection, close_connections, to_minor_units, from_minor_units, add_participant_listener, add_reset_listener
+
+class LedgerEngine:
+    """In-memory settlement ledger backed by a write-ahead journal.
+
+    Balances live in a compact array indexed by account slot. Every posting is
+    appended to a sequential journal before it is acknowledged, and a background
+    thread checkpoints payments to SQLite and rewrites the journal down to the
+    entries after the checkpoint. A checkpoint adds each account's net change
+    to its stored balance rather than overwriting it, so settlements written by
+    another processor sharing the database are kept, and the ledger then takes
+    the stored balances of those accounts. On start-up the ledger is rebuilt
+    from the last checkpoint plus the journal entries written after it.
+
+    Accounts added in this process (add_participant, bulk_seed) are picked up
+    with their stored balances; init_db/reset_db discards the ledger state and
+    reloads it from the fresh database.
+    """
+
+    def __init__(self, db_path='payment_system.db', journal_path='ledger_journal.log',
+                 checkpoint_interval=5.0, fsync=True):
+        self.db_path = os.path.abspath(db_path)
+        self.journal_path = os.path.abspath(journal_path)
+        self.checkpoint_interval = checkpoint_interval
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.checkpoint_lock = threading.Lock()
+
+        self.slots = {}                 # BIC code -> account slot
+        self.account_ids = array('q')   # account slot -> users.id
+        self.account_slots = {}         # users.id -> account slot
+        self.balances = array('q')      # account slot -> balance in cents
+        self.pending = []               # postings not yet checkpointed
+        self.seq = 0
+
+        self._recover()
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        self.closed = False
+        add_participant_listener(self.refresh_accounts)
+        add_reset_listener(self.reset)
+
+        self._stop = threading.Event()
+        self._checkpointer = threading.Thread(target=self._checkpoint_loop, name="ledger-checkpoint", daemon=True)
+        self._checkpointer.start()
+
+    # === Recovery ===
+    def _recover(self):
+        conn = get_connection(self.db_path)
+        self._create_checkpoint_table(conn)
+        row = conn.execute("SELECT journal_seq FROM ledger_checkpoint WHERE id = 1").fetchone()
+        checkpoint_seq = row[0] if row else 0
+
+        self._load_accounts(conn)
+        self.seq = checkpoint_seq
+        replayed = self._replay_journal(checkpoint_seq)
+        logging.info("Ledger recovered %s accounts from checkpoint %s, replayed %s journal entries", len(self.account_ids), checkpoint_seq, replayed)
+
+    @staticmethod
+    def _create_checkpoint_table(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_checkpoint (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                journal_seq INTEGER NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _load_accounts(self, conn):
+        """Add slots for accounts not in the ledger yet, with their stored balances."""
+        for bic_code, user_id, balance in conn.execute("""
+            SELECT b.bic_code, u.id, u.balance
+            FROM users u
+            JOIN bic_codes b ON u.fi_code = b.fi_code
+            ORDER BY u.id
+        """):
+            if user_id not in self.account_slots:
+                self.account_slots[user_id] = len(self.account_ids)
+                self.account_ids.append(user_id)
+                self.balances.append(balance)
+            self.slots.setdefault(bic_code, self.account_slots[user_id])
+
+    def refresh_accounts(self):
+        """Pick up participants added since start-up; balances already in the ledger are kept."""
+        if self.closed:
+            return
+        with self.lock:
+            self._load_accounts(get_connection(self.db_path))
+
+    def reset(self):
+        """Drop all ledger state after init_db rebuilt the database, and reload the accounts."""
+        if self.closed:
+            return
+        with self.checkpoint_lock, self.lock:
+            self.slots = {}
+            self.account_ids = array('q')
+            self.account_slots = {}
+            self.balances = array('q')
+            self.pending = []
+            self.seq = 0
+            self.journal.truncate(0)
+            conn = get_connection(self.db_path)
+            self._create_checkpoint_table(conn)
+            self._load_accounts(conn)
+        logging.info("Ledger reset: %s accounts reloaded", len(self.account_ids))
+
+    def _replay_journal(self, checkpoint_seq):
+        if not os.path.exists(self.journal_path):
+            return 0
+
+        replayed = 0
+        good_offset = 0
+        with open(self.journal_path, 'r+', encoding='utf-8') as journal:
+            for line in iter(journal.readline, ''):
+                try:
+                    if not line.endswith('\n'):
+                        raise ValueError("incomplete journal entry")
+                    seq, sender_id, recipient_id, cents, timestamp = line.rstrip('\n').split(',')
+                    seq, sender_id, recipient_id, cents = int(seq), int(sender_id), int(recipient_id), int(cents)
+                except ValueError:
+                    # A torn write at the tail is the only way an entry can be malformed
+                    logging.error("Ledger journal truncated at offset %s: discarding incomplete entry", good_offset)
+                    journal.seek(good_offset)
+                    journal.truncate()
+                    break
+                good_offset = journal.tell()
+
+                if seq <= checkpoint_seq:
+                    continue
+                self.balances[self.account_slots[sender_id]] -= cents
+                self.balances[self.account_slots[recipient_id]] += cents
+                self.pending.append((seq, sender_id, recipient_id, cents, timestamp))
+                self.seq = seq
+                replayed += 1
+        return replayed
+
+    # === Settlement ===
+    def settle(self, debtor_bic, creditor_bic, amount):
+        return self.settle_batch([(debtor_bic, creditor_bic, amount)])[0]
+
+    def settle_batch(self, payments):
+        """Post payments in order; the batch shares one journal write and sync."""
+        statuses = []
+        timestamp = datetime.now().isoformat()
+        with self.lock:
+            entries = []
+            for debtor_bic, creditor_bic, amount in payments:
+                debtor_slot = self.slots.get(debtor_bic)
+                creditor_slot = self.slots.get(creditor_bic)
+                if debtor_slot is None or creditor_slot is None:
+                    logging.error("Settlement Failed: Invalid BIC codes - Debtor: %s, Creditor: %s", debtor_bic, creditor_bic)
+                    statuses.append("Settlement Failed: Invalid BIC codes")
+                    continue
+
+                cents = to_minor_units(amount)
+                if self.balances[debtor_slot] < cents:
+                    logging.error("Settlement Failed: Insufficient funds for %s (required: %s, available: %s)", debtor_bic, amount, from_minor_units(self.balances[debtor_slot]))
+                    statuses.append("Settlement Failed: Insufficient funds")
+                    continue
+
+                self.seq += 1
+                posting = (self.seq, self.account_ids[debtor_slot], self.account_ids[creditor_slot], cents, timestamp)
+                entries.append("%d,%d,%d,%d,%s\n" % posting)
+                self.pending.append(posting)
+                self.balances[debtor_slot] -= cents
+                self.balances[creditor_slot] += cents
+                statuses.append("Settlement Success")
+
+            if entries:
+                # The postings are only acknowledged once they are in the journal
+                self.journal.write(''.join(entries))
+                self.journal.flush()
+                if self.fsync:
+                    os.fsync(self.journal.fileno())
+        return statuses
+
+    def get_balance(self, bic_code):
+        slot = self.slots.get(bic_code)
+        return None if slot is None else from_minor_units(self.balances[slot])
+
+    # === Checkpointing ===
+    def _checkpoint_loop(self):
+        conn = get_connection(self.db_path)
+        try:
+            while not self._stop.wait(self.checkpoint_interval):
+                self._checkpoint(conn)
+            self._checkpoint(conn)
+        finally:
+            close_connections()
+
+    def checkpoint(self):
+        """Write the current ledger state to SQLite from the calling thread."""
+        self._checkpoint(get_connection(self.db_path))
+
+    def _checkpoint(self, conn):
+        with self.checkpoint_lock:
+            self._write_checkpoint(conn)
+
+    def _write_checkpoint(self, conn, chunk_size=500):
+        # Snapshot under the lock so the postings match the journal sequence exactly
+        with self.lock:
+            if not self.pending:
+                return
+            checkpoint_seq = self.seq
+            postings, self.pending = self.pending, []
+
+        try:
+            conn.execute("BEGIN IMMEDIATE TRANSACTION")
+            # Postings up to the stored sequence are in SQLite already, e.g. from another engine that replayed the same journal
+            row = conn.execute("SELECT journal_seq FROM ledger_checkpoint WHERE id = 1").fetchone()
+            stored_seq = row[0] if row else 0
+            new_postings = [posting for posting in postings if posting[0] > stored_seq]
+            changes = net_changes(new_postings)
+            conn.executemany("UPDATE users SET balance = balance + ? WHERE id = ?",
+                             [(change, account_id) for account_id, change in changes.items() if change])
+            conn.executemany("""
+                INSERT INTO payments (sender_id, recipient_id, amount, timestamp)
+                VALUES (?, ?, ?, ?)
+            """, [(sender_id, recipient_id, cents, timestamp) for _, sender_id, recipient_id, cents, timestamp in new_postings])
+            conn.execute("INSERT OR REPLACE INTO ledger_checkpoint (id, journal_seq) VALUES (1, ?)", (max(checkpoint_seq, stored_seq),))
+            # Read back inside the transaction, so other writers' settlements are included and none can slip in
+            stored = []
+            account_ids = list(changes)
+            for start in range(0, len(account_ids), chunk_size):
+                chunk = account_ids[start:start + chunk_size]
+                placeholders = ", ".join("?" * len(chunk))
+                stored.extend(conn.execute(f"SELECT id, balance FROM users WHERE id IN ({placeholders})", chunk))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error("Ledger checkpoint failed: %s", e)
+            with self.lock:
+                # Put the snapshot back so the next checkpoint retries it
+                self.pending[:0] = postings
+            return
+
+        with self.lock:
+            # Postings made while SQLite was written are not in the stored balances yet
+            later = net_changes(self.pending)
+            for account_id, balance in stored:
+                slot = self.account_slots.get(account_id)
+                if slot is not None:
+                    self.balances[slot] = balance + later.get(account_id, 0)
+            self._rotate_journal()
+        logging.info("Ledger checkpoint written at journal sequence %s (%s postings)", checkpoint_seq, len(postings))
+
+    def _rotate_journal(self):
+        # Keep only the postings made while SQLite was written, so the journal stays as short as one checkpoint interval
+        if not self.pending:
+            self.journal.truncate(0)
+            return
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as journal:
+            journal.write(''.join("%d,%d,%d,%d,%s\n" % posting for posting in self.pending))
+            journal.flush()
+            if self.fsync:
+                os.fsync(journal.fileno())
+        self.journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def close(self):
+        self.closed = True
+        self._stop.set()
+        self._checkpointer.join()
+        self.journal.close()
+
+def net_changes(postings):
+    """Net change in cents per users.id over (seq, sender_id, recipient_id, cents, timestamp) postings."""
+    changes = {}
+    for _, sender_id, recipient_id, cents, _ in postings:
+        changes[sender_id] = changes.get(sender_id, 0) - cents
+        changes[recipient_id] = changes.get(recipient_id, 0) + cents
+    return changes
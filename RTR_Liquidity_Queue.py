@@ -0,0 +1,344 @@
+import os
+import heapq
+import atexit
+import logging
+import threading
+from array import array
+from datetime import datetime
+from db_manager import DB_PATH, close_connections, to_minor_units, from_minor_units, add_reset_listener
+from RTR_Routing_Directory import get_routing_directory
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Priorities, most urgent first
+HIGH = 0
+NORMAL = 1
+
+QUEUED = "Settlement Queued: Insufficient funds"
+
+def settleable(debtors, creditors, amounts, balances):
+    """Mask of the queued payments that can settle together without overdrawing any account.
+
+    Payments are given in queue order: grouped by debtor slot, then by priority
+    and arrival. Each round credits every debtor with its incoming payments and
+    keeps the longest run of its queue that balance plus inflow covers.
+    Payments dropped in one round take their inflow away in the next, so the
+    rounds repeat until nothing more is dropped. What is left is a run from the
+    head of each debtor's queue, so no payment settles ahead of an earlier one.
+    """
+    if np is None:
+        return _settleable_python(debtors, creditors, amounts, balances)
+
+    debtors = np.asarray(debtors, dtype=np.int64)
+    creditors = np.asarray(creditors, dtype=np.int64)
+    amounts = np.asarray(amounts, dtype=np.int64)
+    balances = np.asarray(balances, dtype=np.int64)
+    # Where each debtor's run of the queue starts, and how long it is
+    starts = np.flatnonzero(np.diff(debtors, prepend=-1))
+    lengths = np.diff(starts, append=len(debtors))
+
+    active = np.ones(len(amounts), dtype=bool)
+    while True:
+        outgoing = np.where(active, amounts, 0)
+        inflow = np.bincount(creditors, weights=outgoing, minlength=len(balances)).astype(np.int64)
+        # Cumulative outflow within each debtor's own queue
+        cumulative = np.cumsum(outgoing)
+        cumulative -= np.repeat(cumulative[starts] - outgoing[starts], lengths)
+        keep = active & (cumulative <= (balances + inflow)[debtors])
+        if keep.sum() == active.sum():
+            return active
+        active = keep
+
+def _settleable_python(debtors, creditors, amounts, balances):
+    active = [True] * len(amounts)
+    while True:
+        inflow = [0] * len(balances)
+        for creditor, cents, is_active in zip(creditors, amounts, active):
+            if is_active:
+                inflow[creditor] += cents
+        dropped = False
+        previous = None
+        for i, (debtor, cents) in enumerate(zip(debtors, amounts)):
+            if debtor != previous:
+                cumulative, previous = 0, debtor
+            if active[i]:
+                cumulative += cents
+                if cumulative > balances[debtor] + inflow[debtor]:
+                    active[i] = False
+                    dropped = True
+        if not dropped:
+            return active
+
+class LiquidityQueue:
+    """Holds payments rejected for insufficient funds until they can settle.
+
+    Each debtor's held payments are ordered by priority, then arrival. When the
+    debtor receives a credit, pop_fitting() hands back the run at the head of
+    its queue that the new balance covers. Payments that are only covered by
+    each other's credits are settled by resolve_gridlock(), which the
+    settlement processor runs every solve_interval seconds.
+
+    Held payments are stored in columns so the gridlock solver works on whole
+    arrays; the per-debtor heaps skip entries that already settled. The queue
+    is per process and held payments are not persisted.
+    """
+
+    def __init__(self, db_path=DB_PATH, routing=None, solve_interval=1.0):
+        self.db_path = os.path.abspath(db_path)
+        self.routing = routing or get_routing_directory(db_path)
+        self.solve_interval = solve_interval
+        self.lock = threading.Lock()
+
+        self._clear()
+        self.held = 0
+        self.released = 0
+
+        self._stop = threading.Event()
+        self._solver = None
+
+    def _clear(self):
+        self.slots = {}                 # users.id -> account slot
+        self.account_ids = array('q')   # account slot -> users.id
+        self.queues = {}                # debtor BIC -> heap of (priority, entry)
+
+        # One row per held payment, in arrival order; entry = row index
+        self.debtor_slots = array('q')
+        self.creditor_slots = array('q')
+        self.amounts = array('q')       # cents
+        self.priorities = array('q')
+        self.alive = bytearray()
+        self.payments = []              # entry -> (debtor_bic, creditor_bic, amount, correlation_id, notice)
+        self.queued = 0
+        self.in_flight = 0              # popped by pop_fitting and not yet settled or requeued
+
+    def reset(self):
+        """Drop every held payment and account slot; called when init_db has dropped the tables."""
+        with self.lock:
+            if self.queued:
+                logging.warning("Liquidity queue reset dropped %s held payments", self.queued)
+            self._clear()
+
+    def __len__(self):
+        return self.queued
+
+    def _slot(self, account_id):
+        slot = self.slots.get(account_id)
+        if slot is None:
+            slot = self.slots[account_id] = len(self.account_ids)
+            self.account_ids.append(account_id)
+        return slot
+
+    # === Holding and releasing ===
+    def hold(self, debtor_bic, creditor_bic, amount, correlation_id=None, priority=NORMAL, notice=None):
+        """Queue a payment that failed for insufficient funds; returns the QUEUED status.
+
+        notice is kept with the payment and handed back when it is released.
+        """
+        debtor_account = self.routing.account_for_bic(debtor_bic)
+        creditor_account = self.routing.account_for_bic(creditor_bic)
+        with self.lock:
+            entry = len(self.payments)
+            self.debtor_slots.append(self._slot(debtor_account))
+            self.creditor_slots.append(self._slot(creditor_account))
+            self.amounts.append(to_minor_units(amount))
+            self.priorities.append(priority)
+            self.alive.append(1)
+            self.payments.append((debtor_bic, creditor_bic, amount, correlation_id, notice))
+            heapq.heappush(self.queues.setdefault(debtor_bic, []), (priority, entry))
+            self.queued += 1
+            self.held += 1
+        logging.info("Payment of %s from %s to %s queued for liquidity", amount, debtor_bic, creditor_bic)
+        return QUEUED
+
+    def holds(self, debtor_bic):
+        """True if the debtor has a payment waiting in the queue."""
+        with self.lock:
+            heap = self.queues.get(debtor_bic)
+            # resolve_gridlock marks the entries it settles dead but leaves them in their heaps
+            while heap and not self.alive[heap[0][1]]:
+                heapq.heappop(heap)
+            if heap is not None and not heap:
+                del self.queues[debtor_bic]
+            return bool(heap)
+
+    def pop_fitting(self, debtor_bic, balance):
+        """Remove and return the (entry, payment) run at the head of a debtor's queue that balance (cents) covers.
+
+        The caller settles them, then reports back with settled() and requeue().
+        """
+        fitting = []
+        with self.lock:
+            heap = self.queues.get(debtor_bic)
+            while heap:
+                priority, entry = heap[0]
+                if not self.alive[entry]:
+                    heapq.heappop(heap)
+                    continue
+                if self.amounts[entry] > balance:
+                    break
+                heapq.heappop(heap)
+                balance -= self.amounts[entry]
+                self.alive[entry] = 0
+                fitting.append((entry, self.payments[entry]))
+            if heap is not None and not heap:
+                del self.queues[debtor_bic]
+            self.queued -= len(fitting)
+            self.in_flight += len(fitting)
+        return fitting
+
+    def settled(self, count):
+        with self.lock:
+            self.in_flight -= count
+            self.released += count
+
+    def requeue(self, entry):
+        """Put back a popped entry that failed to settle, in its original place."""
+        with self.lock:
+            self.alive[entry] = 1
+            heapq.heappush(self.queues.setdefault(self.payments[entry][0], []), (self.priorities[entry], entry))
+            self.queued += 1
+            self.in_flight -= 1
+
+    # === Gridlock resolution ===
+    def resolve_gridlock(self, conn):
+        """Settle every queued payment that can settle together; returns their payments.
+
+        Runs in one exclusive transaction on conn, so balances cannot change
+        between reading them and posting the net change per account.
+        """
+        settled = []
+        try:
+            conn.execute("BEGIN EXCLUSIVE TRANSACTION")
+            with self.lock:
+                self._compact()
+                if not self.queued:
+                    conn.rollback()
+                    return []
+                entries, debtors, creditors, amounts = self._queue_order()
+                mask = settleable(debtors, creditors, amounts, self._read_balances(conn))
+                settled = entries[mask].tolist() if np is not None else [entry for entry, keep in zip(entries, mask) if keep]
+                for entry in settled:
+                    self.alive[entry] = 0
+                self.queued -= len(settled)
+                self.in_flight += len(settled)
+                rows = [(self.account_ids[self.debtor_slots[entry]], self.account_ids[self.creditor_slots[entry]], self.amounts[entry])
+                        for entry in settled]
+
+            changes = {}
+            for debtor_id, creditor_id, cents in rows:
+                changes[debtor_id] = changes.get(debtor_id, 0) - cents
+                changes[creditor_id] = changes.get(creditor_id, 0) + cents
+            timestamp = datetime.now().isoformat()
+            conn.executemany("UPDATE users SET balance = balance + ? WHERE id = ?",
+                             [(change, account_id) for account_id, change in changes.items() if change])
+            conn.executemany("""
+                INSERT INTO payments (sender_id, recipient_id, amount, timestamp)
+                VALUES (?, ?, ?, ?)
+            """, [row + (timestamp,) for row in rows])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error("Gridlock resolution failed: %s", e)
+            for entry in settled:
+                self.requeue(entry)
+            return []
+
+        self.settled(len(settled))
+        if settled:
+            logging.info("Gridlock resolution settled %s of %s queued payments (%s)",
+                         len(settled), len(entries), from_minor_units(sum(row[2] for row in rows)))
+        return [self.payments[entry] for entry in settled]
+
+    def _queue_order(self):
+        """Live entries with their debtor, creditor and amount columns, by debtor, priority and arrival."""
+        if np is not None:
+            entries = np.flatnonzero(np.frombuffer(bytes(self.alive), dtype=np.uint8))
+            debtors, creditors, amounts, priorities = (np.array(column, dtype=np.int64)[entries] for column in
+                                                       (self.debtor_slots, self.creditor_slots, self.amounts, self.priorities))
+            order = np.lexsort((entries, priorities, debtors))
+            return entries[order], debtors[order], creditors[order], amounts[order]
+
+        entries = sorted((entry for entry, alive in enumerate(self.alive) if alive),
+                         key=lambda entry: (self.debtor_slots[entry], self.priorities[entry], entry))
+        return (entries, [self.debtor_slots[entry] for entry in entries],
+                [self.creditor_slots[entry] for entry in entries], [self.amounts[entry] for entry in entries])
+
+    def _read_balances(self, conn, chunk_size=500):
+        balances = [0] * len(self.account_ids)
+        account_ids = list(self.slots)
+        for start in range(0, len(account_ids), chunk_size):
+            chunk = account_ids[start:start + chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            for account_id, balance in conn.execute(f"SELECT id, balance FROM users WHERE id IN ({placeholders})", chunk):
+                balances[self.slots[account_id]] = balance
+        return balances
+
+    def _compact(self):
+        # Drop settled rows once they outnumber the held ones; popped entries keep their row numbers
+        if self.in_flight or len(self.payments) < 1024 or 2 * self.queued > len(self.payments):
+            return
+        keep = [entry for entry, alive in enumerate(self.alive) if alive]
+        for name in ("debtor_slots", "creditor_slots", "amounts", "priorities"):
+            column = getattr(self, name)
+            setattr(self, name, array('q', (column[entry] for entry in keep)))
+        self.payments = [self.payments[entry] for entry in keep]
+        self.alive = bytearray([1]) * len(keep)
+        self.queues = {}
+        for entry, payment in enumerate(self.payments):
+            self.queues.setdefault(payment[0], []).append((self.priorities[entry], entry))
+        for heap in self.queues.values():
+            heapq.heapify(heap)
+
+    # === Periodic solver ===
+    def start_solver(self, resolve):
+        """Call resolve() every solve_interval seconds while payments are queued."""
+        with self.lock:
+            if self._solver is not None or not self.solve_interval:
+                return
+            self._solver = threading.Thread(target=self._solve_loop, args=(resolve,), name="liquidity-gridlock", daemon=True)
+            self._solver.start()
+
+    def _solve_loop(self, resolve):
+        try:
+            while not self._stop.wait(self.solve_interval):
+                if self.queued:
+                    resolve()
+        finally:
+            close_connections()
+
+    def close(self):
+        self._stop.set()
+        if self._solver is not None:
+            self._solver.join()
+            self._solver = None
+        if self.queued:
+            logging.warning("Liquidity queue closed with %s payments still queued", self.queued)
+
+_liquidity_queues = {}
+_liquidity_queues_lock = threading.Lock()
+
+def get_liquidity_queue(db_path=DB_PATH):
+    """The process-wide liquidity queue for db_path; the gridlock solver is stopped at exit."""
+    db_path = os.path.abspath(db_path)
+    liquidity_queue = _liquidity_queues.get(db_path)
+    if liquidity_queue is None:
+        with _liquidity_queues_lock:
+            liquidity_queue = _liquidity_queues.get(db_path)
+            if liquidity_queue is None:
+                liquidity_queue = LiquidityQueue(db_path)
+                atexit.register(liquidity_queue.close)
+                add_reset_listener(liquidity_queue.reset)
+                _liquidity_queues[db_path] = liquidity_queue
+    return liquidity_queue
+
+def close_liquidity_queues():
+    """Stop every gridlock solver now and forget the queues, e.g. before the database is removed."""
+    with _liquidity_queues_lock:
+        liquidity_queues = list(_liquidity_queues.values())
+        _liquidity_queues.clear()
+    for liquidity_queue in liquidity_queues:
+        atexit.unregister(liquidity_queue.close)
+        liquidity_queue.close()
@@ -0,0 +1,352 @@
+"""Headless load generator and latency benchmark for the full payment chain.
+
+Seeds M synthetic users across K FIs in a scratch working directory, then
+pushes N payments through PAIN.001 -> FISimulator -> RTRExchangeProcessor ->
+ReceiverBankSimulator -> settlement and reports throughput and per-stage
+p50/p95/p99 latency.
+
+Usage:
+    python RTR_Load_Generator.py --users 100 --fis 5 --payments 2000 --concurrency 4
+    python RTR_Load_Generator.py --payments 1000 --rate 200 --json --output load.json
+
+With --rate, payments are started on a fixed schedule and end-to-end latency
+is measured from the scheduled start, so queueing delay is included.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+from datetime import datetime
+from RTR_Logging import configure_logging, stop_logging
+
+# Stages in report order; the exchange stages come from RTRExchangeProcessor.stage_observer
+STAGES = ["pain001", "debtor_agent", "validate", "acknowledge", "forward", "receiver", "settle", "notify", "exchange", "end_to_end"]
+
+def synthetic_bic(fi_index):
+    return f"LD{fi_index:04d}USXXX"
+
+def seed_database(num_users, num_fis, balance, db_path='payment_system.db'):
+    """Create a fresh database with num_fis FIs and num_users users spread across them.
+
+    Returns the seeded users as dicts with id, name and bic_code.
+    """
+    from db_manager import init_db, bulk_seed, get_connection, to_minor_units
+    init_db(with_sample_data=False)
+
+    cents = to_minor_units(balance)
+    bulk_seed(((f"{i:03d}", synthetic_bic(i)) for i in range(1, num_fis + 1)),
+              ((f"Load User {n:06d}", f"{n % num_fis + 1:03d}", cents) for n in range(num_users)),
+              db_path)
+
+    return [dict(row) for row in get_connection(db_path).execute(
+        "SELECT users.id, users.name, bic_codes.bic_code FROM users JOIN bic_codes ON users.fi_code = bic_codes.fi_code ORDER BY users.id")]
+
+def generate_payments(users, count, min_amount, max_amount, seed):
+    rng = random.Random(seed)
+    payments = []
+    for _ in range(count):
+        payer, payee = rng.sample(users, 2)
+        payments.append((payer, payee, round(rng.uniform(min_amount, max_amount), 2)))
+    return payments
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+def summarize(samples):
+    """Latency summary in milliseconds for each stage that has samples."""
+    summary = {}
+    for stage in STAGES:
+        values = sorted(samples.get(stage, []))
+        if not values:
+            continue
+        summary[stage] = {
+            "count": len(values),
+            "mean": round(sum(values) / len(values) * 1000, 3),
+            "p50": round(percentile(values, 50) * 1000, 3),
+            "p95": round(percentile(values, 95) * 1000, 3),
+            "p99": round(percentile(values, 99) * 1000, 3),
+            "max": round(values[-1] * 1000, 3),
+        }
+    return summary
+
+class LoadWorker:
+    """One payment chain per thread; each owns its SQLite connection through its exchange processor."""
+
+    def __init__(self, transport, archiver, record, settlement_mode="gross", liquidity_queue=False, ledger=None):
+        # Chain modules are imported once main() has switched to the scratch directory
+        from Agent_Debtor_Simulator import FISimulator
+        from RTR_Exchange_Processor import RTRExchangeProcessor
+        from RTR_Message_Transport import MEMORY_TRANSPORT
+        self.in_memory = transport == MEMORY_TRANSPORT
+        self.record = record
+        self.fi_simulator = FISimulator(transport=transport, archiver=archiver)
+        self.processor = RTRExchangeProcessor(transport=transport, archiver=archiver, stage_observer=record,
+                                              settlement_mode=settlement_mode, liquidity_queue=liquidity_queue, ledger=ledger)
+
+    def send_payment(self, payer, payee, amount):
+        from ISO20022_Pain001_Generator import generate_pain001_message, render_pain001_message, save_pain001_message
+
+        start = time.perf_counter()
+        if self.in_memory:
+            pain001 = generate_pain001_message(payer, payee, amount)
+        else:
+            pain001 = save_pain001_message(render_pain001_message(payer, payee, amount), payer["name"])
+        self.record("pain001", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        success, pacs008 = self.fi_simulator.process_pain001(pain001)
+        self.record("debtor_agent", time.perf_counter() - start)
+        if not success:
+            return pacs008
+
+        start = time.perf_counter()
+        status = self.processor.process_message(pacs008)
+        self.record("exchange", time.perf_counter() - start)
+        return status
+
+def run_load(payments, concurrency=1, rate=None, transport="file", archive_mode="sync", archive_store="files",
+             settlement_mode="gross", liquidity_queue=False, use_ledger=False):
+    """Push payments through the chain and return (samples, statuses, elapsed, archive flush seconds).
+
+    With settlement_mode="net" the last open clearing cycle is posted with the archive flush,
+    ahead of it so its settlement notifications are archived too, and with use_ledger the
+    in-memory ledger's final checkpoint is.
+    """
+    from RTR_Message_Transport import MessageArchiver
+    from RTR_Message_Archive import MessageArchive
+
+    samples = {stage: [] for stage in STAGES}
+    statuses = {}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def record(stage, seconds):
+        local.samples.append((stage, seconds))
+
+    # "segments" appends archive copies to segment files instead of one file per message
+    archiver = MessageArchiver(archive_mode, store=MessageArchive() if archive_store == "segments" else None)
+    # One ledger engine shared by every worker, as in a single exchange process
+    ledger = None
+    if use_ledger:
+        from RTR_Ledger_Engine import LedgerEngine
+        ledger = LedgerEngine()
+    work = queue.Queue()
+    chains = []
+
+    def worker():
+        local.samples = []
+        worker_statuses = {}
+        chain = LoadWorker(transport, archiver, record, settlement_mode, liquidity_queue, ledger)
+        chains.append(chain)
+        while True:
+            item = work.get()
+            if item is None:
+                break
+            scheduled, (payer, payee, amount) = item
+            # With a rate, latency runs from the scheduled start so queueing delay counts
+            start = scheduled if scheduled is not None else time.perf_counter()
+            try:
+                status = chain.send_payment(payer, payee, amount)
+            except Exception as e:
+                status = f"Error: {type(e).__name__}: {str(e)}"
+            record("end_to_end", time.perf_counter() - start)
+            worker_statuses[status] = worker_statuses.get(status, 0) + 1
+        with lock:
+            for stage, seconds in local.samples:
+                samples[stage].append(seconds)
+            for status, count in worker_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=worker, name=f"load-worker-{i}") for i in range(concurrency)]
+    if not rate:
+        # Closed loop: each thread starts its next payment as soon as the last one finishes
+        for payment in payments:
+            work.put((None, payment))
+        for _ in threads:
+            work.put(None)
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    if rate:
+        # Open loop: release payment i at started + i / rate, whether or not workers keep up
+        for i, payment in enumerate(payments):
+            scheduled = started + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            work.put((scheduled, payment))
+        for _ in threads:
+            work.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    flush_start = time.perf_counter()
+    if ledger is not None:
+        ledger.close()
+    if settlement_mode == "net":
+        from RTR_Net_Settlement import get_net_settlement
+        get_net_settlement().close_cycle()
+    if liquidity_queue and chains:
+        # One last gridlock pass for what is still held once the load stops, notified like the rest
+        chains[0].processor.settlement_processor.resolve_gridlock()
+    archiver.flush()
+    return samples, statuses, elapsed, time.perf_counter() - flush_start
+
+def build_report(args, workdir, samples, statuses, elapsed, flush_seconds):
+    completed = sum(statuses.values())
+    # Payments accepted for net settlement have settled by now: run_load posts the last cycle
+    from RTR_Net_Settlement import ACCEPTED
+    succeeded = sum(count for status, count in statuses.items() if "Success" in status or status == ACCEPTED)
+    liquidity_report = None
+    if args.liquidity_queue:
+        # Held payments report QUEUED; the ones settled later only show in the queue's counters
+        from RTR_Liquidity_Queue import QUEUED, get_liquidity_queue
+        liquidity_queue = get_liquidity_queue()
+        liquidity_report = {"queued": statuses.get(QUEUED, 0), "held": liquidity_queue.held,
+                            "released": liquidity_queue.released, "still_queued": len(liquidity_queue)}
+        succeeded += liquidity_queue.released
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {
+            "users": args.users,
+            "fis": args.fis,
+            "payments": args.payments,
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "transport": args.transport,
+            "archive": args.archive,
+            "archive_store": args.archive_store,
+            "settlement_mode": args.settlement_mode,
+            "liquidity_queue": args.liquidity_queue,
+            "ledger": args.ledger,
+            "seed": args.seed,
+        },
+        "workdir": workdir,
+        "completed": completed,
+        "succeeded": succeeded,
+        "statuses": dict(sorted(statuses.items())),
+        "elapsed_seconds": round(elapsed, 3),
+        "archive_flush_seconds": round(flush_seconds, 3),
+        "throughput_tps": round(completed / elapsed, 2) if elapsed else None,
+        "latency_ms": summarize(samples),
+    }
+    if liquidity_report is not None:
+        report["liquidity_queue"] = liquidity_report
+    return report
+
+def print_report(report):
+    print(f"Payments: {report['completed']} completed, {report['succeeded']} settled in {report['elapsed_seconds']:.2f}s "
+          f"({report['throughput_tps']} payments/s)")
+    for status, count in report["statuses"].items():
+        print(f"  {count:>8}  {status}")
+    if "liquidity_queue" in report:
+        queue_report = report["liquidity_queue"]
+        print(f"Liquidity queue: {queue_report['queued']} queued on arrival, {queue_report['held']} held, "
+              f"{queue_report['released']} released and counted as settled, {queue_report['still_queued']} still queued")
+    print()
+    print(f"{'stage':<14} {'count':>8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for stage, stats in report["latency_ms"].items():
+        print(f"{stage:<14} {stats['count']:>8} {stats['mean']:>9.3f} {stats['p50']:>9.3f} "
+              f"{stats['p95']:>9.3f} {stats['p99']:>9.3f} {stats['max']:>9.3f}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Drive synthetic payments through the RTR payment chain.")
+    parser.add_argument("--users", type=int, default=100, help="synthetic users to seed (M)")
+    parser.add_argument("--fis", type=int, default=5, help="financial institutions to spread users across (K)")
+    parser.add_argument("--payments", type=int, default=1000, help="payments to send (N)")
+    parser.add_argument("--concurrency", type=int, default=1, help="worker threads, each with its own payment chain")
+    parser.add_argument("--rate", type=float, default=None, help="target payments per second (default: as fast as possible)")
+    parser.add_argument("--transport", choices=["file", "memory"], default="file")
+    parser.add_argument("--archive", choices=["sync", "async", "off"], default="sync")
+    parser.add_argument("--archive-store", choices=["files", "segments"], default="files",
+                        help="one file per archived message, or appended to segment files")
+    parser.add_argument("--settlement-mode", choices=["gross", "net"], default="gross",
+                        help="settle each payment as it arrives, or in deferred net clearing cycles")
+    parser.add_argument("--liquidity-queue", action="store_true",
+                        help="hold payments short of funds and retry them instead of rejecting them")
+    parser.add_argument("--ledger", action="store_true",
+                        help="settle in the in-memory ledger engine, journaled and checkpointed to SQLite")
+    parser.add_argument("--balance", type=float, default=1000000.00, help="starting balance of every user")
+    parser.add_argument("--min-amount", type=float, default=1.00)
+    parser.add_argument("--max-amount", type=float, default=100.00)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="scratch directory for the database, logs and messages (default: a new temp dir)")
+    parser.add_argument("--keep-workdir", action="store_true", help="keep the temp dir instead of removing it")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON instead of a table")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--metrics-file", help="rewrite live exchange metrics (TPS, failures, net positions) to this JSON file every second")
+    args = parser.parse_args(argv)
+    if args.users < 2 or args.fis < 1:
+        parser.error("need at least 2 users and 1 FI")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.ledger and (args.settlement_mode != "gross" or args.liquidity_queue):
+        parser.error("--ledger only works with gross settlement and no liquidity queue")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    metrics_file = os.path.abspath(args.metrics_file) if args.metrics_file else None
+    original_dir = os.getcwd()
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="rtr_load_")
+    os.makedirs(workdir, exist_ok=True)
+
+    # Everything the chain writes (database, settlement log, event stream, messages/) is
+    # relative to the working directory, so switch before the chain modules are imported
+    os.chdir(workdir)
+    try:
+        configure_logging()
+        users = seed_database(args.users, args.fis, args.balance)
+        payments = generate_payments(users, args.payments, args.min_amount, args.max_amount, args.seed)
+
+        if metrics_file:
+            from RTR_Metrics import get_metrics
+            get_metrics().start_snapshot_writer(metrics_file)
+        samples, statuses, elapsed, flush_seconds = run_load(payments, args.concurrency, args.rate, args.transport,
+                                                             args.archive, args.archive_store, args.settlement_mode,
+                                                             args.liquidity_queue, args.ledger)
+        report = build_report(args, workdir, samples, statuses, elapsed, flush_seconds)
+    finally:
+        if metrics_file:
+            from RTR_Metrics import get_metrics
+            get_metrics().stop_snapshot_writer()
+        # Flush the per-process state the chain keeps for the workdir's database before leaving it
+        from RTR_Duplicate_Index import close_duplicate_indexes
+        from RTR_Net_Settlement import close_net_settlements
+        from RTR_Liquidity_Queue import close_liquidity_queues
+        close_liquidity_queues()
+        close_net_settlements()
+        close_duplicate_indexes()
+        from db_manager import close_connections
+        close_connections()
+        os.chdir(original_dir)
+        stop_logging()
+        if not args.workdir and not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report)
+    return report
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,89 @@
+import queue
+import atexit
+import logging
+import itertools
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FILE = 'settlement_log.txt'
+LOG_FORMAT = '%(asctime)s - %(message)s'
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves message formatting to the writer thread.
+
+    The stock handler formats every record on the calling thread before
+    queueing it. Here only exception text is resolved up front; the message
+    and its arguments are merged when the listener writes the record, so log
+    arguments must not be mutated after the call.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class DebugSampler(logging.Filter):
+    """Let one in every `every` DEBUG records through; other levels always pass."""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or next(self.counter) % self.every == 0
+
+def configure_logging(log_file=LOG_FILE, level=logging.INFO, debug_sample_every=None):
+    """Send log records through a queue to a background thread that writes log_file.
+
+    Safe to call from every module; only the first call in a process takes
+    effect. DEBUG lines (per-posting balance updates and payment inserts) are
+    off by default; pass debug_sample_every=N to write one in every N of them.
+    """
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return
+
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        log_queue = queue.SimpleQueue()
+        handler = DeferredQueueHandler(log_queue)
+        if debug_sample_every:
+            level = logging.DEBUG
+            handler.addFilter(DebugSampler(debug_sample_every))
+
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(level)
+
+        _handler = handler
+        _listener = QueueListener(log_queue, file_handler)
+        _listener.start()
+        atexit.register(stop_logging)
+
+def flush_logging():
+    """Block until every queued record has been written to the log file."""
+    with _lock:
+        if _listener is not None:
+            # stop() drains the queue and joins the writer; start a fresh writer afterwards
+            _listener.stop()
+            _listener.start()
+
+def stop_logging():
+    """Write out queued records and close the log file; configure_logging() can be called again."""
+    global _listener, _handler
+    with _lock:
+        if _listener is None:
+            return
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = _handler = None
@@ -0,0 +1,156 @@
+import os
+import re
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from ISO20022_Serializer import serialize_message
+
+ARCHIVE_DIR = 'messages/archive'
+SEGMENT_SIZE = 64 * 1024 * 1024     # bytes before a segment is closed and a new one started
+
+# Message types stored in the archive
+PAIN001 = "pain.001"
+PACS008 = "pacs.008"
+PACS008_FORWARDED = "pacs.008.forwarded"
+PACS002_RESPONSE = "pacs.002.response"
+PACS002_SETTLEMENT_COMPLETE = "pacs.002.settlement_complete"
+PACS002_RECEIVER_RESPONSE = "pacs.002.receiver_response"
+CAMT054 = "camt.054"
+
+_MSG_ID = re.compile(r"<MsgId>([^<]*)</MsgId>")
+
+def message_id(xml_text):
+    """The first MsgId in a message, which is the group header's in every message built here."""
+    match = _MSG_ID.search(xml_text)
+    return match.group(1) if match else ""
+
+class MessageArchive:
+    """Append-only message store split into segment files, with an in-memory MsgId index.
+
+    Each record is a header line "<type>\\t<msg id>\\t<length>\\n" followed by
+    the UTF-8 message and a newline, so a segment can be read back with one
+    sequential scan. The index maps (type, msg id) to (segment, offset,
+    length); it is rebuilt from the segment headers when the archive is opened.
+    Every process writes its own segments, named after its pid, so worker
+    processes can share one archive directory.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.index = {}
+        self.writer = None
+        self.writer_path = None
+        self.writer_offset = 0
+        self.segment_number = 0
+        self.prefix = f"segment-{os.getpid()}"
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    # === Index ===
+    def segment_paths(self):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+    def _load_index(self):
+        records = 0
+        for path in self.segment_paths():
+            for message_type, msg_id, offset, length in self._scan_headers(path):
+                self.index[(message_type, msg_id)] = (path, offset, length)
+                records += 1
+        if records:
+            logging.info("Message archive indexed %s messages in %s", records, self.directory)
+
+    def _scan_headers(self, path):
+        with open(path, 'rb') as segment:
+            size = os.fstat(segment.fileno()).st_size
+            while True:
+                header = segment.readline()
+                if not header.endswith(b"\n"):
+                    return
+                try:
+                    message_type, msg_id, length = header.decode('utf-8').rstrip("\n").split("\t")
+                    length = int(length)
+                except ValueError:
+                    logging.error("Message archive segment %s has a malformed record at offset %s", path, segment.tell() - len(header))
+                    return
+                offset = segment.tell()
+                if offset + length + 1 > size:
+                    # Record still being written by another process, or torn by a crash
+                    return
+                yield message_type, msg_id, offset, length
+                segment.seek(length + 1, os.SEEK_CUR)
+
+    # === Writing ===
+    def append(self, message_type, msg_id, xml_text):
+        """Append a message and return its archive key, "<type>/<msg id>"."""
+        payload = xml_text.encode('utf-8')
+        header = f"{message_type}\t{msg_id}\t{len(payload)}\n".encode('utf-8')
+        with self.lock:
+            if self.writer is None or self.writer_offset >= self.segment_size:
+                self._rotate()
+            self.writer.write(header)
+            self.writer.write(payload)
+            self.writer.write(b"\n")
+            offset = self.writer_offset + len(header)
+            self.writer_offset = offset + len(payload) + 1
+            self.index[(message_type, msg_id)] = (self.writer_path, offset, len(payload))
+        return f"{message_type}/{msg_id}"
+
+    def append_message(self, message_type, message):
+        """Archive an ElementTree or already serialized XML text under its MsgId."""
+        xml_text = message if isinstance(message, str) else serialize_message(message)
+        return self.append(message_type, message_id(xml_text), xml_text)
+
+    def _rotate(self):
+        if self.writer is not None:
+            self.writer.close()
+        while True:
+            self.segment_number += 1
+            path = os.path.join(self.directory, f"{self.prefix}-{self.segment_number:06d}.seg")
+            if not os.path.exists(path):
+                break
+        self.writer = open(path, 'ab')
+        self.writer_path = path
+        self.writer_offset = 0
+
+    def flush(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.flush()
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+    # === Reading ===
+    def get(self, message_type, msg_id):
+        """Return the archived XML text for a message, or None."""
+        location = self.index.get((message_type, msg_id))
+        if location is None:
+            return None
+        path, offset, length = location
+        if path == self.writer_path:
+            self.flush()
+        with open(path, 'rb') as segment:
+            segment.seek(offset)
+            return segment.read(length).decode('utf-8')
+
+    def get_tree(self, message_type, msg_id):
+        xml_text = self.get(message_type, msg_id)
+        return None if xml_text is None else ET.ElementTree(ET.fromstring(xml_text))
+
+    def scan(self, path):
+        """Yield (type, msg id, XML text) for every complete record in one segment, in write order."""
+        if path == self.writer_path:
+            self.flush()
+        with open(path, 'rb') as segment:
+            for message_type, msg_id, offset, length in self._scan_headers(path):
+                segment.seek(offset)
+                yield message_type, msg_id, segment.read(length).decode('utf-8')
+
+    def __len__(self):
+        return len(self.index)
@@ -0,0 +1,81 @@
+import os
+import time
+import threading
+
+MAX_SEQUENCE = 999      # ids per millisecond before the generator borrows the next millisecond
+MAX_ID_LENGTH = 35      # ISO 20022 Max35Text, which MsgId and EndToEndId are
+TIME_WIDTH = 9          # milliseconds since the epoch in base 36, good until the year 5138
+PID_WIDTH = 5           # covers the largest Linux pid (2**22)
+MAX_HOST_LENGTH = 8     # RTR_NODE_ID; leaves room for prefixes up to 8 characters
+
+_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+def _base36(number, width):
+    text = ""
+    rest = number
+    while rest:
+        rest, digit = divmod(rest, 36)
+        text = _DIGITS[digit] + text
+    if len(text) > width:
+        raise ValueError(f"{number} does not fit in {width} base 36 digits")
+    return text.rjust(width, "0")
+
+def node_id():
+    """This process's node tag: RTR_NODE_ID (a short host tag, if set) followed by the pid in base 36."""
+    host = os.environ.get("RTR_NODE_ID", "")
+    if len(host) > MAX_HOST_LENGTH or (host and not host.isalnum()):
+        raise ValueError(f"RTR_NODE_ID must be at most {MAX_HOST_LENGTH} letters or digits, got {host!r}")
+    return host + _base36(os.getpid(), PID_WIDTH)
+
+class MessageIdGenerator:
+    """Unique, time-ordered message ids: "<milliseconds since the epoch>-<node>-<sequence>".
+
+    The time is in fixed-width base 36 so ids sort as text and, with a prefix
+    of up to 8 characters, fit the 35 characters ISO 20022 allows; next_id()
+    raises ValueError rather than truncate a longer one.
+
+    The sequence counts ids issued in the same millisecond, so one process can
+    issue up to 1000 ids per millisecond; past that the generator moves on to
+    the next millisecond rather than waiting. The clock is never allowed to go
+    backwards, so ids from one node always sort in the order they were issued,
+    and the node tag keeps processes from colliding with each other.
+    """
+
+    def __init__(self, node=None):
+        self.node = node or node_id()
+        self.length = TIME_WIDTH + len(self.node) + 5    # two dashes and the three-digit sequence
+        self.lock = threading.Lock()
+        self.last_ms = 0
+        self.sequence = 0
+        self.time_text = ""
+
+    def next_id(self, prefix=""):
+        if len(prefix) + self.length > MAX_ID_LENGTH:
+            raise ValueError(f"Message id with prefix {prefix!r} and node {self.node!r} would exceed {MAX_ID_LENGTH} characters")
+        now_ms = time.time_ns() // 1_000_000
+        with self.lock:
+            if now_ms > self.last_ms:
+                self.last_ms = now_ms
+                self.sequence = 0
+                self.time_text = _base36(now_ms, TIME_WIDTH)
+            else:
+                self.sequence += 1
+                if self.sequence > MAX_SEQUENCE:
+                    self.last_ms += 1
+                    self.sequence = 0
+                    self.time_text = _base36(self.last_ms, TIME_WIDTH)
+            return f"{prefix}{self.time_text}-{self.node}-{self.sequence:03d}"
+
+_generator = MessageIdGenerator()
+
+def _reset_after_fork():
+    # A forked worker must not reuse its parent's node tag
+    global _generator
+    _generator = MessageIdGenerator()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def next_id(prefix=""):
+    """Return a new message id, e.g. next_id("PACS002-") -> "PACS002-0MVCWKUDY-00A1B-000"."""
+    return _generator.next_id(prefix)
@@ -0,0 +1,82 @@
+import queue
+import logging
+import threading
+import xml.etree.ElementTree as ET
+
+# Transport modes
+FILE_TRANSPORT = "file"      # components hand each other file paths and re-parse them
+MEMORY_TRANSPORT = "memory"  # components hand each other ElementTree objects directly
+
+# Archive modes
+ARCHIVE_SYNC = "sync"    # write to messages/ before continuing, as the file transport always did
+ARCHIVE_ASYNC = "async"  # write to messages/ from a background thread
+ARCHIVE_OFF = "off"      # do not keep a copy of the messages
+
+def load_message(message):
+    """Return an ElementTree for a message given as a tree, an element or a file path."""
+    if isinstance(message, ET.ElementTree):
+        return message
+    if isinstance(message, ET.Element):
+        return ET.ElementTree(message)
+    return ET.parse(message)
+
+def describe_message(message):
+    """File path of a message, or a short label for one passed in memory (for logging)."""
+    return message if isinstance(message, str) else "in-memory message"
+
+class MessageArchiver:
+    """Runs the save_* functions that write messages to the messages/ folders.
+
+    In sync mode the save function runs immediately and its filename is
+    returned. In async mode it is queued for a background thread and archive()
+    returns None straight away; messages handed over must not be modified
+    afterwards. In off mode nothing is written.
+
+    With a store (an RTR_Message_Archive.MessageArchive), archive_message()
+    appends to the store's segment files instead of writing one file per
+    message, and returns the archive key in sync mode.
+    """
+
+    def __init__(self, mode=ARCHIVE_SYNC, max_pending=10000, store=None):
+        if mode not in (ARCHIVE_SYNC, ARCHIVE_ASYNC, ARCHIVE_OFF):
+            raise ValueError(f"Unknown archive mode: {mode}")
+        self.mode = mode
+        self.store = store
+        self.queue = queue.Queue(max_pending)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def archive(self, save_func, *args):
+        if self.mode == ARCHIVE_OFF:
+            return None
+        if self.mode == ARCHIVE_SYNC:
+            return save_func(*args)
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="message-archiver", daemon=True)
+                self.thread.start()
+        self.queue.put((save_func, args))
+        return None
+
+    def archive_message(self, message_type, save_func, message, *args):
+        """Archive a message (tree or XML text) with save_func(message, *args), or in the store if there is one."""
+        if self.store is not None:
+            return self.archive(self.store.append_message, message_type, message)
+        return self.archive(save_func, message, *args)
+
+    def _run(self):
+        while True:
+            save_func, args = self.queue.get()
+            try:
+                save_func(*args)
+            except Exception as e:
+                logging.error("Message archiving error in %s: %s", save_func.__name__, e)
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait until every queued message has been written."""
+        self.queue.join()
+        if self.store is not None:
+            self.store.flush()
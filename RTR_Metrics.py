@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import threading
+from db_manager import to_minor_units, from_minor_units
+
+METRICS_FILE = 'rtr_metrics.json'
+
+# Window name -> (length in seconds, number of buckets)
+WINDOWS = {
+    "1s": (1, 10),
+    "1m": (60, 60),
+    "1h": (3600, 60),
+}
+
+SUCCESS = "Settlement Success"
+
+def failure_reason(status):
+    """"Settlement Failed: Insufficient funds" -> "Insufficient funds"."""
+    return status.split(": ", 1)[-1].rstrip(".")
+
+class Counts:
+    """Payment counters for one bucket, or the running total of a window; amounts in cents."""
+    __slots__ = ("payments", "settled", "failed", "amount", "failures", "sent", "received")
+
+    def __init__(self):
+        self.payments = 0
+        self.settled = 0
+        self.failed = 0
+        self.amount = 0
+        self.failures = {}      # reason -> count
+        self.sent = {}          # debtor BIC -> cents settled
+        self.received = {}      # creditor BIC -> cents settled
+
+    def add(self, status, debtor_bic, creditor_bic, cents):
+        self.payments += 1
+        if status == SUCCESS:
+            self.settled += 1
+            self.amount += cents
+            self.sent[debtor_bic] = self.sent.get(debtor_bic, 0) + cents
+            self.received[creditor_bic] = self.received.get(creditor_bic, 0) + cents
+        else:
+            self.failed += 1
+            reason = failure_reason(status)
+            self.failures[reason] = self.failures.get(reason, 0) + 1
+
+    def subtract(self, other):
+        self.payments -= other.payments
+        self.settled -= other.settled
+        self.failed -= other.failed
+        self.amount -= other.amount
+        for totals, expired in ((self.failures, other.failures), (self.sent, other.sent), (self.received, other.received)):
+            for key, value in expired.items():
+                remaining = totals[key] - value
+                if remaining:
+                    totals[key] = remaining
+                else:
+                    # Keys only live while they have activity in the window
+                    del totals[key]
+
+class RollingWindow:
+    """Counts over the last `seconds`, kept as a ring of buckets plus a running total.
+
+    Recording touches one bucket and the total; a bucket that falls out of the
+    window is subtracted from the total when its slot is reused, so reads never
+    scan the buckets.
+    """
+
+    def __init__(self, seconds, buckets):
+        self.seconds = seconds
+        self.width = seconds / buckets
+        self.buckets = [Counts() for _ in range(buckets)]
+        self.bucket_ids = [None] * buckets
+        self.totals = Counts()
+        self.current = None
+
+    def advance(self, now):
+        bucket_id = int(now // self.width)
+        if bucket_id == self.current:
+            return
+        count = len(self.buckets)
+        first = bucket_id - count + 1 if self.current is None else max(self.current + 1, bucket_id - count + 1)
+        for expired_id in range(first, bucket_id + 1):
+            slot = expired_id % count
+            if self.bucket_ids[slot] is not None:
+                self.totals.subtract(self.buckets[slot])
+                self.buckets[slot] = Counts()
+            self.bucket_ids[slot] = expired_id
+        self.current = bucket_id
+
+    def add(self, now, status, debtor_bic, creditor_bic, cents):
+        self.advance(now)
+        self.buckets[self.current % len(self.buckets)].add(status, debtor_bic, creditor_bic, cents)
+        self.totals.add(status, debtor_bic, creditor_bic, cents)
+
+class ExchangeMetrics:
+    """Live throughput, failure and net-position metrics over sliding 1s, 1m and 1h windows.
+
+    The exchange records every rejected payment and the settlement processor
+    every settlement outcome. Memory is fixed by the number of buckets and
+    the number of BICs and failure reasons active in the last hour. Single
+    values (tps, failure_rate, position) are read in constant time; snapshot()
+    copies every window and write_snapshot() saves it as JSON for operators.
+    """
+
+    def __init__(self, windows=WINDOWS, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.started = clock()
+        self.windows = {name: RollingWindow(seconds, buckets) for name, (seconds, buckets) in windows.items()}
+        self.snapshot_thread = None
+        self.snapshot_stop = threading.Event()
+
+    # === Recording ===
+    def record(self, status, debtor_bic=None, creditor_bic=None, amount=0.0):
+        """Count one payment outcome; amount (in dollars) only counts towards the totals when it settled."""
+        cents = to_minor_units(amount) if status == SUCCESS else 0
+        with self.lock:
+            now = self.clock()
+            for window in self.windows.values():
+                window.add(now, status, debtor_bic, creditor_bic, cents)
+
+    def _totals(self, window):
+        rolling = self.windows[window]
+        rolling.advance(self.clock())
+        return rolling.totals
+
+    # === Reading ===
+    def tps(self, window="1s"):
+        """Payments handled per second over the window (or since start, if shorter)."""
+        with self.lock:
+            payments = self._totals(window).payments
+            elapsed = min(self.windows[window].seconds, max(self.clock() - self.started, 1e-9))
+        return payments / elapsed
+
+    def failure_rate(self, window="1m"):
+        with self.lock:
+            totals = self._totals(window)
+            return totals.failed / totals.payments if totals.payments else 0.0
+
+    def failures(self, window="1m"):
+        """Failed payments per reason."""
+        with self.lock:
+            return dict(self._totals(window).failures)
+
+    def position(self, bic_code, window="1m"):
+        """Amounts sent and received by a BIC in dollars, and its net position (received - sent)."""
+        with self.lock:
+            totals = self._totals(window)
+            sent = totals.sent.get(bic_code, 0)
+            received = totals.received.get(bic_code, 0)
+        return {"sent": from_minor_units(sent), "received": from_minor_units(received), "net": from_minor_units(received - sent)}
+
+    def snapshot(self):
+        snapshot = {"time": time.time(), "windows": {}}
+        with self.lock:
+            now = self.clock()
+            for name, rolling in self.windows.items():
+                rolling.advance(now)
+                totals = rolling.totals
+                elapsed = min(rolling.seconds, max(now - self.started, 1e-9))
+                bics = totals.sent.keys() | totals.received.keys()
+                snapshot["windows"][name] = {
+                    "payments": totals.payments,
+                    "settled": totals.settled,
+                    "failed": totals.failed,
+                    "tps": totals.payments / elapsed,
+                    "failure_rate": totals.failed / totals.payments if totals.payments else 0.0,
+                    "failures": dict(totals.failures),
+                    "settled_amount": from_minor_units(totals.amount),
+                    "positions": {
+                        bic: {
+                            "sent": from_minor_units(totals.sent.get(bic, 0)),
+                            "received": from_minor_units(totals.received.get(bic, 0)),
+                            "net": from_minor_units(totals.received.get(bic, 0) - totals.sent.get(bic, 0)),
+                        }
+                        for bic in bics
+                    },
+                }
+        return snapshot
+
+    # === Snapshot file ===
+    def write_snapshot(self, path=METRICS_FILE):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def start_snapshot_writer(self, path=METRICS_FILE, interval=1.0):
+        """Rewrite the snapshot file every interval seconds from a background thread."""
+        if self.snapshot_thread is not None:
+            return
+
+        def run():
+            while not self.snapshot_stop.wait(interval):
+                self.write_snapshot(path)
+            self.write_snapshot(path)
+
+        self.snapshot_stop.clear()
+        self.snapshot_thread = threading.Thread(target=run, name="metrics-snapshot", daemon=True)
+        self.snapshot_thread.start()
+
+    def stop_snapshot_writer(self):
+        if self.snapshot_thread is not None:
+            self.snapshot_stop.set()
+            self.snapshot_thread.join()
+            self.snapshot_thread = None
+
+_metrics = ExchangeMetrics()
+
+def get_metrics():
+    """The process-wide metrics shared by the exchange and settlement processors."""
+    return _metrics
@@ -0,0 +1,301 @@
+import os
+import atexit
+import logging
+import threading
+from array import array
+from datetime import datetime
+from db_manager import (DB_PATH, get_connection, close_connections, to_minor_units, from_minor_units,
+                        add_participant_listener, add_reset_listener)
+from RTR_Routing_Directory import get_routing_directory
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+GROSS = "gross"
+NET = "net"
+SETTLEMENT_MODES = (GROSS, NET)
+
+ACCEPTED = "Settlement Accepted: Pending net settlement"
+
+def net_positions(debtors, creditors, amounts, size):
+    """Net position per account slot (credits - debits, in cents) of a cycle's obligations.
+
+    The obligations are the non-zero entries of the FI x FI obligation matrix,
+    kept as (debtor slot, creditor slot, cents) columns because a dense matrix
+    grows with the square of the participants. Netting is then two scatter-adds:
+    column sums minus row sums.
+    """
+    if np is not None:
+        net = np.zeros(size, dtype=np.int64)
+        cents = np.frombuffer(amounts, dtype=np.int64)
+        np.add.at(net, np.frombuffer(creditors, dtype=np.int64), cents)
+        np.subtract.at(net, np.frombuffer(debtors, dtype=np.int64), cents)
+        return net.tolist()
+
+    net = [0] * size
+    for debtor, creditor, cents in zip(debtors, creditors, amounts):
+        net[debtor] -= cents
+        net[creditor] += cents
+    return net
+
+class NetSettlement:
+    """Deferred net settlement: payments accumulate as obligations and post once per cycle.
+
+    A payment is accepted (status ACCEPTED) when the debtor's balance plus its
+    net position in the open cycle covers it, so a closed cycle never leaves an
+    account overdrawn. It has only settled once its cycle is posted; then the
+    submitter's on_settled(payments) is called with the (debtor_bic,
+    creditor_bic, amount, reference) of its payments. close_cycle() nets the cycle's obligations and posts one balance update per
+    participant with a non-zero position, plus the payment rows, in a single
+    transaction. Cycles close every cycle_interval seconds, when
+    max_cycle_payments are open, and at exit.
+
+    Balances are read once per account and then kept up to date from the posted
+    positions, so net mode owns the balances of the accounts it settles. Worker
+    processes shard by debtor BIC, so only credits from other processes are
+    missed until the balances are read again, which can only make admission
+    stricter. They are read again when participants change, and init_db or
+    reset_db discards them together with the open cycle.
+    """
+
+    def __init__(self, db_path=DB_PATH, routing=None, cycle_interval=1.0, max_cycle_payments=100_000):
+        # Absolute, so the last cycle posts to the same database after a chdir
+        self.db_path = os.path.abspath(db_path)
+        self.routing = routing or get_routing_directory(db_path)
+        self.cycle_interval = cycle_interval
+        self.max_cycle_payments = max_cycle_payments
+        self.lock = threading.Lock()
+        self.post_lock = threading.Lock()
+
+        self.slots = {}                 # users.id -> account slot
+        self.account_ids = array('q')   # account slot -> users.id
+        self.balances = array('q')      # account slot -> balance in cents, including closed cycles
+        self.loaded = bytearray()       # account slot -> 1 once its balance was read
+        self.net = array('q')           # account slot -> net position in the open cycle, for admission only
+        self._new_cycle()
+        self.unposted = []              # closed cycles whose posting failed, retried with the next one
+        self.cycles = 0
+
+        self._stop = threading.Event()
+        self._cycler = None
+        if cycle_interval:
+            self._cycler = threading.Thread(target=self._cycle_loop, name="net-settlement-cycle", daemon=True)
+            self._cycler.start()
+
+    def _new_cycle(self):
+        self.debtors = array('q')
+        self.creditors = array('q')
+        self.amounts = array('q')
+        self.timestamps = []
+        self.accepted = []              # (debtor_bic, creditor_bic, amount, reference, on_settled) per payment
+
+    # === Accepting payments ===
+    def submit(self, debtor_bic, creditor_bic, amount, reference=None, on_settled=None):
+        return self.submit_batch([(debtor_bic, creditor_bic, amount)], [reference], on_settled)[0]
+
+    def submit_batch(self, payments, references=None, on_settled=None):
+        """Accept (debtor_bic, creditor_bic, amount) payments into the open cycle, in order; returns one status each.
+
+        references are handed back to on_settled with the payments once their cycle is posted.
+        """
+        accounts = self.routing.accounts_for_bics({bic for debtor_bic, creditor_bic, _ in payments for bic in (debtor_bic, creditor_bic)})
+        references = references or [None] * len(payments)
+        statuses = []
+        timestamp = datetime.now().isoformat()
+        with self.lock:
+            self._load_balances(list(accounts.values()))
+            for (debtor_bic, creditor_bic, amount), reference in zip(payments, references):
+                if debtor_bic not in accounts or creditor_bic not in accounts:
+                    logging.error("Settlement Failed: Invalid BIC codes - Debtor: %s, Creditor: %s", debtor_bic, creditor_bic)
+                    statuses.append("Settlement Failed: Invalid BIC codes")
+                    continue
+
+                debtor_slot = self.slots[accounts[debtor_bic]]
+                creditor_slot = self.slots[accounts[creditor_bic]]
+                cents = to_minor_units(amount)
+                available = self.balances[debtor_slot] + self.net[debtor_slot]
+                if available < cents:
+                    logging.error("Settlement Failed: Insufficient funds for %s (required: %s, available: %s)", debtor_bic, amount, from_minor_units(available))
+                    statuses.append("Settlement Failed: Insufficient funds")
+                    continue
+
+                self.debtors.append(debtor_slot)
+                self.creditors.append(creditor_slot)
+                self.amounts.append(cents)
+                self.timestamps.append(timestamp)
+                self.accepted.append((debtor_bic, creditor_bic, amount, reference, on_settled))
+                self.net[debtor_slot] -= cents
+                self.net[creditor_slot] += cents
+                statuses.append(ACCEPTED)
+            cycle_full = len(self.amounts) >= self.max_cycle_payments
+
+        if cycle_full:
+            self.close_cycle()
+        return statuses
+
+    def _load_balances(self, account_ids):
+        for account_id in account_ids:
+            if account_id not in self.slots:
+                self.slots[account_id] = len(self.account_ids)
+                self.account_ids.append(account_id)
+                self.balances.append(0)
+                self.loaded.append(0)
+                self.net.append(0)
+        missing = [account_id for account_id in set(account_ids) if not self.loaded[self.slots[account_id]]]
+        if missing:
+            self._read_balances(missing)
+
+    def _read_balances(self, account_ids):
+        conn = get_connection(self.db_path)
+        for start in range(0, len(account_ids), 500):
+            chunk = account_ids[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            for account_id, balance in conn.execute(f"SELECT id, balance FROM users WHERE id IN ({placeholders})", chunk):
+                slot = self.slots[account_id]
+                self.balances[slot] = balance
+                self.loaded[slot] = 1
+
+    def refresh_balances(self):
+        """Read the balances of every known account again; called when participants change."""
+        # Under post_lock no cycle is being posted, so the stored balances plus the
+        # cycles that failed to post are exactly what has been settled
+        with self.post_lock:
+            with self.lock:
+                if not self.account_ids:
+                    return
+                self.loaded = bytearray(len(self.account_ids))
+                self._read_balances(list(self.account_ids))
+                for balance_updates, _, _ in self.unposted:
+                    for position, account_id in balance_updates:
+                        self.balances[self.slots[account_id]] += position
+
+    def reset(self):
+        """Forget every balance, the open cycle and unposted cycles; called when init_db has dropped the tables."""
+        with self.post_lock:
+            with self.lock:
+                dropped = len(self.amounts) + sum(len(payment_rows) for _, payment_rows, _ in self.unposted)
+                if dropped:
+                    logging.warning("Net settlement reset dropped %s accepted payments that were not posted", dropped)
+                self.slots = {}
+                self.account_ids = array('q')
+                self.balances = array('q')
+                self.loaded = bytearray()
+                self.net = array('q')
+                self._new_cycle()
+                self.unposted = []
+
+    def position(self, bic_code):
+        """Net position of a BIC's account in the open cycle, in dollars."""
+        account_id = self.routing.account_for_bic(bic_code)
+        with self.lock:
+            slot = self.slots.get(account_id)
+            return 0.0 if slot is None else from_minor_units(self.net[slot])
+
+    # === Cycles ===
+    def close_cycle(self):
+        """Net the open cycle and post it, then tell the submitters; returns the number of payments settled."""
+        with self.post_lock:
+            with self.lock:
+                debtors, creditors, amounts, timestamps, accepted = self.debtors, self.creditors, self.amounts, self.timestamps, self.accepted
+                self._new_cycle()
+                if amounts:
+                    net = net_positions(debtors, creditors, amounts, len(self.account_ids))
+                    # The admission checks of the next cycle start from the posted balances
+                    for slot, position in enumerate(net):
+                        self.balances[slot] += position
+                    self.net = array('q', [0]) * len(self.account_ids)
+                    balance_updates = [(position, self.account_ids[slot]) for slot, position in enumerate(net) if position]
+                    payment_rows = [(self.account_ids[debtor], self.account_ids[creditor], cents, timestamp)
+                                    for debtor, creditor, cents, timestamp in zip(debtors, creditors, amounts, timestamps)]
+                    self.unposted.append((balance_updates, payment_rows, accepted))
+                cycles, self.unposted = self.unposted, []
+            if not cycles:
+                return 0
+            posted = self._post(cycles)
+        if posted:
+            self._notify(cycles)
+        return posted
+
+    def _post(self, cycles):
+        conn = get_connection(self.db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE TRANSACTION")
+            for balance_updates, payment_rows, _ in cycles:
+                conn.executemany("UPDATE users SET balance = balance + ? WHERE id = ?", balance_updates)
+                conn.executemany("""
+                    INSERT INTO payments (sender_id, recipient_id, amount, timestamp)
+                    VALUES (?, ?, ?, ?)
+                """, payment_rows)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error("Net settlement posting failed: %s", e)
+            with self.lock:
+                # Retried ahead of the next cycle; the positions already count in self.balances
+                self.unposted[:0] = cycles
+            return 0
+
+        self.cycles += len(cycles)
+        payments = sum(len(payment_rows) for _, payment_rows, _ in cycles)
+        updates = sum(len(balance_updates) for balance_updates, _, _ in cycles)
+        gross = sum(row[2] for _, payment_rows, _ in cycles for row in payment_rows)
+        logging.info("Net settlement cycle posted: %s payments (%s gross) as %s balance updates",
+                     payments, from_minor_units(gross), updates)
+        return payments
+
+    def _notify(self, cycles):
+        # One call per submitter with all of its payments in the posted cycles
+        settled = {}
+        for _, _, accepted in cycles:
+            for debtor_bic, creditor_bic, amount, reference, on_settled in accepted:
+                if on_settled is not None:
+                    settled.setdefault(on_settled, []).append((debtor_bic, creditor_bic, amount, reference))
+        for on_settled, payments in settled.items():
+            try:
+                on_settled(payments)
+            except Exception as e:
+                logging.error("Net settlement notification failed: %s", e)
+
+    def _cycle_loop(self):
+        try:
+            while not self._stop.wait(self.cycle_interval):
+                self.close_cycle()
+        finally:
+            close_connections()
+
+    def close(self):
+        """Stop the cycle timer and post the open cycle."""
+        self._stop.set()
+        if self._cycler is not None:
+            self._cycler.join()
+            self._cycler = None
+        self.close_cycle()
+
+_net_settlements = {}
+_net_settlements_lock = threading.Lock()
+
+def get_net_settlement(db_path=DB_PATH):
+    """The process-wide net settlement for db_path; the open cycle is posted at exit."""
+    db_path = os.path.abspath(db_path)
+    net_settlement = _net_settlements.get(db_path)
+    if net_settlement is None:
+        with _net_settlements_lock:
+            net_settlement = _net_settlements.get(db_path)
+            if net_settlement is None:
+                net_settlement = NetSettlement(db_path)
+                atexit.register(net_settlement.close)
+                add_participant_listener(net_settlement.refresh_balances)
+                add_reset_listener(net_settlement.reset)
+                _net_settlements[db_path] = net_settlement
+    return net_settlement
+
+def close_net_settlements():
+    """Post every open cycle now and stop the cycle timers, e.g. before the database is removed."""
+    with _net_settlements_lock:
+        net_settlements = list(_net_settlements.values())
+        _net_settlements.clear()
+    for net_settlement in net_settlements:
+        atexit.unregister(net_settlement.close)
+        net_settlement.close()
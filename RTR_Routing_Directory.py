@@ -0,0 +1,75 @@
+import logging
+import threading
+from db_manager import DB_PATH, get_connection, add_participant_listener
+
+class RoutingDirectory:
+    """Hash indexes over bic_codes and users for routing and settlement lookups.
+
+    Loaded from the database on first use and dropped whenever db_manager
+    reports that participants changed (reset_db, add_participant), so the next
+    lookup reloads it. Changes made by other processes are only seen after
+    invalidate() is called in this process.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.indexes = None     # (routable BICs, settlement account id by BIC)
+        self.generation = 0     # bumped by invalidate() so a load racing with it is not kept
+
+    def load(self):
+        conn = get_connection(self.db_path)
+        routable = {row[0] for row in conn.execute("SELECT bic_code FROM bic_codes WHERE bic_code IS NOT NULL")}
+        accounts = {}
+        for bic_code, user_id in conn.execute("""
+            SELECT b.bic_code, u.id
+            FROM users u
+            JOIN bic_codes b ON u.fi_code = b.fi_code
+            ORDER BY u.id
+        """):
+            # An FI settles through its first account
+            accounts.setdefault(bic_code, user_id)
+        logging.info("Routing directory loaded: %s BIC codes, %s settlement accounts", len(routable), len(accounts))
+        return routable, accounts
+
+    def get_indexes(self):
+        indexes = self.indexes
+        if indexes is None:
+            with self.lock:
+                indexes = self.indexes
+                if indexes is None:
+                    generation = self.generation
+                    indexes = self.load()
+                    if generation == self.generation:
+                        self.indexes = indexes
+        return indexes
+
+    def invalidate(self):
+        self.generation += 1
+        self.indexes = None
+
+    def is_routable(self, bic_code):
+        return bic_code in self.get_indexes()[0]
+
+    def account_for_bic(self, bic_code):
+        """Settlement account (user id) for a BIC, or None if it has none."""
+        return self.get_indexes()[1].get(bic_code)
+
+    def accounts_for_bics(self, bic_codes):
+        accounts = self.get_indexes()[1]
+        return {bic_code: accounts[bic_code] for bic_code in bic_codes if bic_code in accounts}
+
+_directories = {}
+_directories_lock = threading.Lock()
+
+def get_routing_directory(db_path=DB_PATH):
+    """The process-wide routing directory for db_path."""
+    directory = _directories.get(db_path)
+    if directory is None:
+        with _directories_lock:
+            directory = _directories.get(db_path)
+            if directory is None:
+                directory = RoutingDirectory(db_path)
+                add_participant_listener(directory.invalidate)
+                _directories[db_path] = directory
+    return directory
@@ -1,78 +1,325 @@
-import sqlite3
 from datetime import datetime
+import math
 import logging
+from db_manager import get_connection, to_minor_units, from_minor_units
+from RTR_Routing_Directory import get_routing_directory
+from RTR_Event_Stream import emit_event, SETTLEMENT
+from RTR_Metrics import get_metrics
+from RTR_Net_Settlement import GROSS, NET, SETTLEMENT_MODES, ACCEPTED, get_net_settlement
+from RTR_Liquidity_Queue import QUEUED, NORMAL, get_liquidity_queue
+
+INVALID_AMOUNT = "Settlement Failed: Invalid amount"
+
+def is_valid_amount(amount):
+    """A finite amount of at least one cent."""
+    try:
+        return math.isfinite(amount) and to_minor_units(amount) > 0
+    except TypeError:
+        return False
+
+# Payments that settle after the call returns, and are counted and notified when they do
+DEFERRED = (QUEUED, ACCEPTED)
 
 class RTRSettlementProcessor:
-    def __init__(self):
-        self.conn = sqlite3.connect('payment_system.db')
-        self.cursor = self.conn.cursor()
+    def __init__(self, ledger=None, routing=None, metrics=None, settlement_mode=GROSS, liquidity_queue=False, on_settled=None):
+        # BIC -> settlement account lookups; balances are still read from the database
+        self.routing = routing or get_routing_directory()
+        # Optional RTR_Ledger_Engine.LedgerEngine that settles in memory instead of in SQLite
+        self.ledger = ledger
+        # Live TPS, failure and net position windows, updated with every settlement outcome
+        self.metrics = metrics or get_metrics()
+        # GROSS posts every payment as it settles; NET accepts it into the open RTR_Net_Settlement cycle (status ACCEPTED)
+        if settlement_mode not in SETTLEMENT_MODES:
+            raise ValueError(f"Unknown settlement mode: {settlement_mode}")
+        if settlement_mode == NET and ledger is not None:
+            raise ValueError("Net settlement posts to the database and cannot use a ledger engine")
+        self.settlement_mode = settlement_mode
+        self.net_settlement = get_net_settlement() if settlement_mode == NET else None
+        # With liquidity_queue, payments short of funds are held and retried instead of failing
+        if liquidity_queue and (settlement_mode != GROSS or ledger is not None):
+            raise ValueError("The liquidity queue needs gross settlement in the database")
+        self.liquidity_queue = get_liquidity_queue() if liquidity_queue else None
+        # Optional callable(debtor_bic, creditor_bic, amount, correlation_id, notice) told when a
+        # held or netted payment settles; notice is whatever the caller passed with the payment
+        self.on_settled = on_settled
+        if self.liquidity_queue is not None:
+            self.liquidity_queue.start_solver(self.resolve_gridlock)
+
+    def settle_transaction(self, debtor_bic, creditor_bic, amount, correlation_id=None, priority=NORMAL, notice=None):
+        # A debtor's held payments go first, so a new one queues behind them
+        queue_behind = (self.liquidity_queue is not None and is_valid_amount(amount)
+                        and self.liquidity_queue.holds(debtor_bic))
+        if queue_behind:
+            status = self.liquidity_queue.hold(debtor_bic, creditor_bic, amount, correlation_id, priority, notice)
+        else:
+            status = self._settle_transaction(debtor_bic, creditor_bic, amount, (correlation_id, notice))
+            if status == "Settlement Failed: Insufficient funds" and self.liquidity_queue is not None:
+                status = self.liquidity_queue.hold(debtor_bic, creditor_bic, amount, correlation_id, priority, notice)
+        emit_event(SETTLEMENT, correlation_id, debtor_bic=debtor_bic, creditor_bic=creditor_bic, amount=amount, status=status)
+        if status not in DEFERRED:
+            # A held or netted payment is counted once it settles
+            self.metrics.record(status, debtor_bic, creditor_bic, amount)
+        if status == "Settlement Success" and self.liquidity_queue is not None:
+            self.release_queued([creditor_bic])
+        elif queue_behind:
+            # Settle whatever the debtor's balance covers now, in queue order
+            self.release_queued([debtor_bic])
+        return status
+
+    @property
+    def conn(self):
+        # The calling thread's pooled connection, so one processor can be shared across threads
+        return get_connection()
+
+    def _settle_transaction(self, debtor_bic, creditor_bic, amount, reference=None):
+        logging.info("Starting settlement process for %s from %s to %s", amount, debtor_bic, creditor_bic)
+        if not is_valid_amount(amount):
+            logging.error("Settlement Failed: Invalid amount %s from %s to %s", amount, debtor_bic, creditor_bic)
+            return INVALID_AMOUNT
+        if self.net_settlement is not None:
+            return self.net_settlement.submit(debtor_bic, creditor_bic, amount, reference, self._net_settled)
+        if self.ledger is not None:
+            status = self.ledger.settle(debtor_bic, creditor_bic, amount)
+            if status == "Settlement Success":
+                logging.info("Successfully settled payment of %s from %s to %s", amount, debtor_bic, creditor_bic)
+            return status
 
-    def settle_transaction(self, debtor_bic, creditor_bic, amount):
-        logging.info(f"Starting settlement process for {amount} from {debtor_bic} to {creditor_bic}")
         try:
+            # Balances are stored in cents
+            cents = to_minor_units(amount)
+
             # Get user IDs and check balances
             debtor = self.get_user_by_bic(debtor_bic)
             creditor = self.get_user_by_bic(creditor_bic)
             
             if not debtor or not creditor:
-                logging.error(f"Settlement Failed: Invalid BIC codes - Debtor: {debtor_bic}, Creditor: {creditor_bic}")
+                logging.error("Settlement Failed: Invalid BIC codes - Debtor: %s, Creditor: %s", debtor_bic, creditor_bic)
                 return "Settlement Failed: Invalid BIC codes"
 
-            if debtor['balance'] < amount:
-                logging.error(f"Settlement Failed: Insufficient funds for {debtor_bic} (required: {amount}, available: {debtor['balance']})")
+            if debtor['balance'] < cents:
+                logging.error("Settlement Failed: Insufficient funds for %s (required: %s, available: %s)", debtor_bic, amount, from_minor_units(debtor['balance']))
                 return "Settlement Failed: Insufficient funds"
 
             # Start transaction
-            self.cursor.execute("BEGIN EXCLUSIVE TRANSACTION")
+            conn = self.conn
+            conn.execute("BEGIN EXCLUSIVE TRANSACTION")
             
             # Verify balance again after starting transaction
-            self.cursor.execute("SELECT balance FROM users WHERE id = ?", (debtor['id'],))
-            current_balance = self.cursor.fetchone()[0]
+            current_balance = conn.execute("SELECT balance FROM users WHERE id = ?", (debtor['id'],)).fetchone()[0]
             
-            if current_balance < amount:
-                self.conn.rollback()
-                logging.error(f"Settlement Failed: Insufficient funds for {debtor_bic} after transaction start (required: {amount}, available: {current_balance})")
+            if current_balance < cents:
+                conn.rollback()
+                logging.error("Settlement Failed: Insufficient funds for %s after transaction start (required: %s, available: %s)", debtor_bic, amount, from_minor_units(current_balance))
                 return "Settlement Failed: Insufficient funds"
 
             # Update balances
-            self.update_balance(debtor['id'], -amount)
-            self.update_balance(creditor['id'], amount)
+            self.update_balance(debtor['id'], -cents)
+            self.update_balance(creditor['id'], cents)
 
             # Record payment
-            self.record_payment(debtor['id'], creditor['id'], amount)
+            self.record_payment(debtor['id'], creditor['id'], cents)
             
-            self.conn.commit()
-            logging.info(f"Successfully settled payment of {amount} from {debtor_bic} to {creditor_bic}")
+            conn.commit()
+            logging.info("Successfully settled payment of %s from %s to %s", amount, debtor_bic, creditor_bic)
             return "Settlement Success"
         except Exception as e:
             self.conn.rollback()
-            logging.error(f"Settlement error: {str(e)}")
+            logging.error("Settlement error: %s", e)
             return f"Settlement Failed: {str(e)}"
 
+    def settle_batch(self, payments, correlation_ids=None, notices=None):
+        """Settle a batch of (debtor_bic, creditor_bic, amount) payments in one transaction.
+
+        Payments are applied in order against running balances, so a payment that
+        fails validation is skipped without rolling back the rest of the batch.
+        Returns one settlement status per payment, in the same order.
+        """
+        payments = list(payments)
+        correlation_ids = correlation_ids or [None] * len(payments)
+        notices = notices or [None] * len(payments)
+        holding, held_before = None, []
+        if self.liquidity_queue is not None:
+            # Debtors with held payments; the batch adds those it leaves short of funds
+            holding = {debtor_bic for debtor_bic, _, _ in payments if self.liquidity_queue.holds(debtor_bic)}
+            held_before = list(holding)
+        statuses = self._settle_batch(payments, list(zip(correlation_ids, notices)), holding)
+        credited = []
+        for i, ((debtor_bic, creditor_bic, amount), correlation_id, notice) in enumerate(zip(payments, correlation_ids, notices)):
+            if statuses[i] == "Settlement Failed: Insufficient funds" and self.liquidity_queue is not None:
+                statuses[i] = self.liquidity_queue.hold(debtor_bic, creditor_bic, amount, correlation_id, notice=notice)
+            emit_event(SETTLEMENT, correlation_id, debtor_bic=debtor_bic, creditor_bic=creditor_bic, amount=amount, status=statuses[i])
+            if statuses[i] not in DEFERRED:
+                self.metrics.record(statuses[i], debtor_bic, creditor_bic, amount)
+            if statuses[i] == "Settlement Success":
+                credited.append(creditor_bic)
+        if self.liquidity_queue is not None and (credited or held_before):
+            self.release_queued(credited + held_before)
+        return statuses
+
+    # === Liquidity queue ===
+    def release_queued(self, credited_bics):
+        """Retry the held payments of debtors that just received funds, following the credits those release."""
+        pending = [bic for bic in dict.fromkeys(credited_bics) if self.liquidity_queue.holds(bic)]
+        while pending:
+            debtor_bic = pending.pop()
+            debtor = self.get_user_by_bic(debtor_bic)
+            fitting = self.liquidity_queue.pop_fitting(debtor_bic, debtor['balance']) if debtor else []
+            if not fitting:
+                continue
+
+            # Balances are checked again inside the batch, in case another thread got there first
+            statuses = self._settle_batch([payment[:3] for _, payment in fitting])
+            released = []
+            for (entry, payment), status in zip(fitting, statuses):
+                if status == "Settlement Success":
+                    released.append(payment)
+                else:
+                    self.liquidity_queue.requeue(entry)
+            self.liquidity_queue.settled(len(released))
+            self._settled_later(released, released=True)
+            pending.extend(creditor_bic for _, creditor_bic, _, _, _ in released
+                           if creditor_bic not in pending and self.liquidity_queue.holds(creditor_bic))
+
+    def resolve_gridlock(self):
+        """Settle the held payments that can only settle together, then whatever their credits release."""
+        released = self.liquidity_queue.resolve_gridlock(self.conn)
+        self._settled_later(released, released=True)
+        if released:
+            self.release_queued([creditor_bic for _, creditor_bic, _, _, _ in released])
+        return len(released)
+
+    def _net_settled(self, payments):
+        # Called by the net settlement once the cycle holding these payments has posted
+        self._settled_later([(debtor_bic, creditor_bic, amount, correlation_id, notice)
+                             for debtor_bic, creditor_bic, amount, (correlation_id, notice) in payments], netted=True)
+
+    def _settled_later(self, payments, **fields):
+        for debtor_bic, creditor_bic, amount, correlation_id, notice in payments:
+            emit_event(SETTLEMENT, correlation_id, debtor_bic=debtor_bic, creditor_bic=creditor_bic, amount=amount,
+                       status="Settlement Success", **fields)
+            self.metrics.record("Settlement Success", debtor_bic, creditor_bic, amount)
+            if self.on_settled is not None:
+                self.on_settled(debtor_bic, creditor_bic, amount, correlation_id, notice)
+
+    def _settle_batch(self, payments, references=None, holding=None):
+        # Rows with an unusable amount fail on their own instead of failing the whole batch
+        statuses = [None] * len(payments)
+        valid = []
+        for i, (debtor_bic, creditor_bic, amount) in enumerate(payments):
+            if is_valid_amount(amount):
+                valid.append(i)
+            else:
+                logging.error("Settlement Failed: Invalid amount %s from %s to %s", amount, debtor_bic, creditor_bic)
+                statuses[i] = INVALID_AMOUNT
+        references = references or [None] * len(payments)
+        settled = self._settle_valid_batch([payments[i] for i in valid], [references[i] for i in valid], holding)
+        for i, status in zip(valid, settled):
+            statuses[i] = status
+        return statuses
+
+    def _settle_valid_batch(self, payments, references, holding=None):
+        if not payments:
+            return []
+        logging.info("Starting batch settlement of %s payments", len(payments))
+        if self.net_settlement is not None:
+            return self.net_settlement.submit_batch(payments, references, self._net_settled)
+        if self.ledger is not None:
+            return self.ledger.settle_batch(payments)
+
+        conn = self.conn
+        try:
+            conn.execute("BEGIN EXCLUSIVE TRANSACTION")
+
+            # Resolve every BIC in the batch and read balances under the lock
+            bics = {bic for debtor_bic, creditor_bic, _ in payments for bic in (debtor_bic, creditor_bic)}
+            users = self.get_users_by_bics(bics)
+            balances = {user['id']: user['balance'] for user in users.values()}
+
+            statuses = []
+            balance_changes = {}
+            payment_rows = []
+            timestamp = datetime.now().isoformat()
+            for debtor_bic, creditor_bic, amount in payments:
+                debtor = users.get(debtor_bic)
+                creditor = users.get(creditor_bic)
+                if not debtor or not creditor:
+                    logging.error("Settlement Failed: Invalid BIC codes - Debtor: %s, Creditor: %s", debtor_bic, creditor_bic)
+                    statuses.append("Settlement Failed: Invalid BIC codes")
+                    continue
+
+                if holding is not None and debtor_bic in holding:
+                    # Queued behind the debtor's held payments by the caller
+                    statuses.append("Settlement Failed: Insufficient funds")
+                    continue
+                cents = to_minor_units(amount)
+                if balances[debtor['id']] < cents:
+                    logging.error("Settlement Failed: Insufficient funds for %s (required: %s, available: %s)", debtor_bic, amount, from_minor_units(balances[debtor['id']]))
+                    statuses.append("Settlement Failed: Insufficient funds")
+                    if holding is not None:
+                        holding.add(debtor_bic)
+                    continue
+
+                balances[debtor['id']] -= cents
+                balances[creditor['id']] += cents
+                balance_changes[debtor['id']] = balance_changes.get(debtor['id'], 0) - cents
+                balance_changes[creditor['id']] = balance_changes.get(creditor['id'], 0) + cents
+                payment_rows.append((debtor['id'], creditor['id'], cents, timestamp))
+                statuses.append("Settlement Success")
+
+            # Apply the net balance change per user and record all payments in bulk
+            conn.executemany("""
+                UPDATE users 
+                SET balance = balance + ? 
+                WHERE id = ?
+            """, [(change, user_id) for user_id, change in balance_changes.items() if change])
+            conn.executemany("""
+                INSERT INTO payments (sender_id, recipient_id, amount, timestamp)
+                VALUES (?, ?, ?, ?)
+            """, payment_rows)
+
+            conn.commit()
+            logging.info("Batch settlement complete: %s settled, %s failed", len(payment_rows), len(payments) - len(payment_rows))
+            return statuses
+        except Exception as e:
+            conn.rollback()
+            logging.error("Batch settlement error: %s", e)
+            return [f"Settlement Failed: {str(e)}"] * len(payments)
+
+    def get_users_by_bics(self, bic_codes, chunk_size=500):
+        """Look up the settlement account for many BIC codes, keyed by BIC."""
+        account_ids = self.routing.accounts_for_bics(bic_codes)
+        user_ids = list(set(account_ids.values()))
+        conn = self.conn
+        balances = {}
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            for user_id, balance in conn.execute(f"SELECT id, balance FROM users WHERE id IN ({placeholders})", chunk):
+                balances[user_id] = balance
+        return {bic_code: {'id': user_id, 'balance': balances[user_id]}
+                for bic_code, user_id in account_ids.items() if user_id in balances}
+
     def get_user_by_bic(self, bic_code):
-        self.cursor.execute("""
-            SELECT u.id, u.balance 
-            FROM users u 
-            JOIN bic_codes b ON u.fi_code = b.fi_code 
-            WHERE b.bic_code = ?
-        """, (bic_code,))
-        result = self.cursor.fetchone()
-        return {'id': result[0], 'balance': result[1]} if result else None
+        user_id = self.routing.account_for_bic(bic_code)
+        if user_id is None:
+            return None
+        result = self.conn.execute("SELECT balance FROM users WHERE id = ?", (user_id,)).fetchone()
+        return {'id': user_id, 'balance': result[0]} if result else None
 
     def update_balance(self, user_id, amount_change):
-        logging.info(f"Updating balance for user {user_id} by {amount_change}")
-        self.cursor.execute("""
+        """Add amount_change cents to a user's balance."""
+        # Per-posting detail runs inside the settlement transaction; DEBUG keeps it off by default
+        logging.debug("Updating balance for user %s by %s", user_id, from_minor_units(amount_change))
+        self.conn.execute("""
             UPDATE users 
             SET balance = balance + ? 
             WHERE id = ?
         """, (amount_change, user_id))
 
     def record_payment(self, sender_id, recipient_id, amount):
-        logging.info(f"Recording payment of {amount} from user {sender_id} to user {recipient_id}")
-        self.cursor.execute("""
+        """Insert a settled payment of amount cents."""
+        logging.debug("Recording payment of %s from user %s to user %s", from_minor_units(amount), sender_id, recipient_id)
+        self.conn.execute("""
             INSERT INTO payments (sender_id, recipient_id, amount, timestamp)
             VALUES (?, ?, ?, ?)
         """, (sender_id, recipient_id, amount, datetime.now().isoformat()))
-
-    def __del__(self):
-        self.conn.close()
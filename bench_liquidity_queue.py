@@ -0,0 +1,56 @@
+"""Time the liquidity queue's gridlock solver on large synthetic queues,
+vectorized against the plain-Python fallback, and check that the settled
+set never overdraws an account.
+
+Usage: python bench_liquidity_queue.py [queued payments] [participants]
+"""
+import sys
+import time
+import random
+import RTR_Liquidity_Queue
+from RTR_Liquidity_Queue import settleable
+
+def synthetic_queue(payments, participants, seed=42):
+    """Queued payments in queue order (debtor, then arrival) with balances that cover a fraction of the outflow."""
+    rng = random.Random(seed)
+    rows = sorted((rng.randrange(participants), i, rng.randrange(participants), rng.randint(100, 1_000_000))
+                  for i in range(payments))
+    debtors = [debtor for debtor, _, _, _ in rows]
+    creditors = [creditor for _, _, creditor, _ in rows]
+    amounts = [cents for _, _, _, cents in rows]
+    outflow = [0] * participants
+    for debtor, cents in zip(debtors, amounts):
+        outflow[debtor] += cents
+    balances = [int(total * rng.uniform(0.0, 0.3)) for total in outflow]
+    return debtors, creditors, amounts, balances
+
+def check(debtors, creditors, amounts, balances, mask):
+    positions = list(balances)
+    for debtor, creditor, cents, keep in zip(debtors, creditors, amounts, mask):
+        if keep:
+            positions[debtor] -= cents
+            positions[creditor] += cents
+    return min(positions) >= 0
+
+def timed(solver, queue):
+    start = time.perf_counter()
+    mask = solver(*queue)
+    return time.perf_counter() - start, [bool(keep) for keep in mask]
+
+def main(payments, participants):
+    numpy = RTR_Liquidity_Queue.np
+    print(f"{'queued':>8} {'participants':>12} {'numpy ms':>9} {'python ms':>10} {'speedup':>8} {'settled':>8}  same  no overdraft")
+    for size in sorted({payments // 10, payments // 2, payments}):
+        queue = synthetic_queue(size, participants)
+        fallback_seconds, fallback = timed(RTR_Liquidity_Queue._settleable_python, queue)
+        if numpy is not None:
+            vector_seconds, mask = timed(settleable, queue)
+        else:
+            vector_seconds, mask = fallback_seconds, fallback
+        print(f"{size:>8} {participants:>12} {vector_seconds * 1e3:>9.1f} {fallback_seconds * 1e3:>10.1f} "
+              f"{fallback_seconds / vector_seconds:>7.1f}x {sum(mask):>8}  {mask == fallback}  {check(*queue, mask)}")
+    if numpy is None:
+        print("numpy is not installed: both columns are the plain-Python solver")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000, int(sys.argv[2]) if len(sys.argv) > 2 else 2_000)
@@ -0,0 +1,52 @@
+"""Compare the shared XML serializer against the original minidom pretty-printing,
+and building + serializing a tree against rendering a precompiled template.
+
+Usage: python bench_xml_serializer.py [iterations]
+"""
+import sys
+import timeit
+from ISO20022_Pain001_Generator import generate_pain001_message, render_pain001_message
+from ISO20022_Pacs008_Generator import generate_iso20022_message, render_iso20022_message
+from ISO20022_Pacs002_Generator import generate_pacs002_message, render_pacs002_message
+from ISO20022_Camt054_Generator import generate_camt054_message, render_camt054_message
+from ISO20022_Serializer import serialize_message, serialize_message_minidom
+
+def sample_messages():
+    payer = {"id": 1, "name": "ABC Corporation", "bic_code": "BOFCUS3NXXX"}
+    payee = {"id": 2, "name": "Potato & Sons <Inc.>", "bic_code": "CHASUS33XXX"}
+    return {
+        "pain.001": generate_pain001_message(payer, payee, 125.50),
+        "pacs.008": generate_iso20022_message(payer, payee, 125.50),
+        "pacs.002": generate_pacs002_message("MSG-1", "RJCT", "Insufficient \"funds\""),
+        "camt.054": generate_camt054_message("CHASUS33XXX", 125.50, "MSG-1"),
+    }
+
+def template_cases():
+    payer = {"id": 1, "name": "ABC Corporation", "bic_code": "BOFCUS3NXXX"}
+    payee = {"id": 2, "name": "Potato & Sons <Inc.>", "bic_code": "CHASUS33XXX"}
+    return {
+        "pain.001": (generate_pain001_message, render_pain001_message, (payer, payee, 125.50)),
+        "pacs.008": (generate_iso20022_message, render_iso20022_message, (payer, payee, 125.50)),
+        "pacs.002": (generate_pacs002_message, render_pacs002_message, ("MSG-1", "ACSC", "Settlement completed successfully")),
+        "camt.054": (generate_camt054_message, render_camt054_message, ("CHASUS33XXX", 125.50, "MSG-1")),
+    }
+
+def main(iterations):
+    print(f"{'message':<10} {'minidom us':>11} {'pretty us':>10} {'compact us':>11} {'speedup':>8}  identical")
+    for name, tree in sample_messages().items():
+        identical = serialize_message(tree, pretty=True) == serialize_message_minidom(tree)
+        legacy = timeit.timeit(lambda: serialize_message_minidom(tree), number=iterations) / iterations * 1e6
+        pretty = timeit.timeit(lambda: serialize_message(tree, pretty=True), number=iterations) / iterations * 1e6
+        compact = timeit.timeit(lambda: serialize_message(tree, pretty=False), number=iterations) / iterations * 1e6
+        print(f"{name:<10} {legacy:>11.1f} {pretty:>10.1f} {compact:>11.1f} {legacy / pretty:>7.1f}x  {identical}")
+
+    # Generation includes the logging and event stream writes both paths share
+    print()
+    print(f"{'message':<10} {'tree us':>8} {'template us':>12} {'speedup':>8}")
+    for name, (generate, render, args) in template_cases().items():
+        tree = timeit.timeit(lambda: serialize_message(generate(*args)), number=iterations) / iterations * 1e6
+        template = timeit.timeit(lambda: render(*args), number=iterations) / iterations * 1e6
+        print(f"{name:<10} {tree:>8.1f} {template:>12.1f} {tree / template:>7.1f}x")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -1,29 +1,28 @@
-import sqlite3
+from db_manager import get_connection, close_connections, from_minor_units
 
-# Connect to the database
-conn = sqlite3.connect('payment_system.db')
-cursor = conn.cursor()
+# Pooled connection, migrated to the current schema
+conn = get_connection()
 
 
 # Query to retrieve all BICs
-cursor.execute("SELECT * FROM bic_codes")
-bic = cursor.fetchall()
+bic = conn.execute("SELECT * FROM bic_codes").fetchall()
 
-# Print out the users
+# Print out the BICs
 for code in bic:
-    print(code)
+    print(tuple(code))
 
 
 # Query to retrieve all users
-cursor.execute("SELECT * FROM users")
-users = cursor.fetchall()
+users = conn.execute("SELECT * FROM users").fetchall()
 
-# Print out the users
+# Print out the users, with balances in dollars rather than stored cents
 for user in users:
-    print(user)
+    user = dict(user)
+    user['balance'] = from_minor_units(user['balance'])
+    print(tuple(user.values()))
 
 
 
 
 # Close the connection
-conn.close()
+close_connections()
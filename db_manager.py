@@ -1,62 +1,256 @@
 import sqlite3
+import threading
 
-def init_db():
-    conn = sqlite3.connect('payment_system.db')
-    cursor = conn.cursor()
+DB_PATH = 'payment_system.db'
 
-    # Drop existing tables in correct order
-    cursor.executescript('''
+# Connection settings shared by every pooled connection
+BUSY_TIMEOUT = 30.0           # seconds to wait on a locked database before failing
+STATEMENT_CACHE_SIZE = 256    # prepared statements kept per connection
+SYNCHRONOUS = "NORMAL"        # with WAL, commits survive a process crash; fsync happens at checkpoints
+
+_pool = threading.local()
+
+# === Schema ===
+# Stored in PRAGMA user_version. Version 0 is the original layout with REAL money columns.
+SCHEMA_VERSION = 1
+
+# Money is stored as integer cents (minor units); convert at the edges with the helpers below
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS bic_codes (
+        id INTEGER PRIMARY KEY,
+        fi_code TEXT UNIQUE,
+        bic_code TEXT UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE,
+        fi_code TEXT,
+        account TEXT,
+        balance INTEGER NOT NULL DEFAULT 100000,
+        FOREIGN KEY (fi_code) REFERENCES bic_codes (fi_code)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender_id INTEGER NOT NULL,
+        recipient_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        timestamp TEXT NOT NULL,
+        FOREIGN KEY (sender_id) REFERENCES users (id),
+        FOREIGN KEY (recipient_id) REFERENCES users (id)
+    )
+    """,
+]
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_users_fi_code ON users (fi_code)",
+    "CREATE INDEX IF NOT EXISTS idx_payments_sender_time ON payments (sender_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_payments_recipient_time ON payments (recipient_id, timestamp)",
+]
+
+# Columns converted from REAL to integer cents when upgrading from version 0
+MONEY_COLUMNS = {"users": ("balance",), "payments": ("amount",)}
+
+def to_minor_units(amount):
+    """Major units (12.34) to integer cents (1234)."""
+    return int(round(amount * 100))
+
+def from_minor_units(cents):
+    """Integer cents (1234) to major units (12.34)."""
+    return cents / 100
+
+def create_schema(conn):
+    for statement in SCHEMA + INDEXES:
+        conn.execute(statement)
+
+def migrate_db(conn):
+    """Bring the database up to SCHEMA_VERSION in one transaction; a no-op when it is current."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    conn.execute("BEGIN IMMEDIATE TRANSACTION")
+    try:
+        # Re-read under the write lock in case another connection migrated first
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            _migrate_to_v1(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def _migrate_to_v1(conn):
+    # Rebuild bic_codes, users and payments with the current definitions, copying the
+    # columns both layouts share and converting money columns to cents
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    old_columns = {}
+    for table in ("bic_codes", "users", "payments"):
+        if table in existing:
+            old_columns[table] = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_v0")
+
+    create_schema(conn)
+    if "transactions" in existing:
+        # The GUI's old payment log duplicates payments, unless the database predates that table.
+        # Its foreign keys now point at users_v0, so it goes before the _v0 tables do.
+        if "payments" not in existing:
+            conn.execute("""
+                INSERT INTO payments (sender_id, recipient_id, amount, timestamp)
+                SELECT sender_id, receiver_id, CAST(ROUND(amount * 100) AS INTEGER), COALESCE(timestamp, '')
+                FROM transactions
+                WHERE sender_id IS NOT NULL AND receiver_id IS NOT NULL
+            """)
+        conn.execute("DROP TABLE transactions")
+    for table, columns in old_columns.items():
+        new_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        shared = [column for column in new_columns if column in columns]
+        values = [f"CAST(ROUND({column} * 100) AS INTEGER)" if column in MONEY_COLUMNS.get(table, ()) else column
+                  for column in shared]
+        conn.execute(f"INSERT INTO {table} ({', '.join(shared)}) SELECT {', '.join(values)} FROM {table}_v0")
+        conn.execute(f"DROP TABLE {table}_v0")
+
+def get_connection(db_path=DB_PATH):
+    """Return this thread's pooled connection to db_path, opening it on first use.
+
+    Connections run in WAL mode, so readers are not blocked by the settlement
+    writer, and keep a cache of prepared statements. Rows come back as
+    sqlite3.Row. Callers commit or roll back their own transactions but must
+    not close the connection; use close_connections() for that.
+    """
+    connections = getattr(_pool, 'connections', None)
+    if connections is None:
+        connections = _pool.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+        migrate_db(conn)
+        connections[db_path] = conn
+    return conn
+
+def close_connections():
+    """Close the calling thread's pooled connections."""
+    for conn in getattr(_pool, 'connections', {}).values():
+        conn.close()
+    _pool.connections = {}
+
+# === Participant change notifications ===
+_participant_listeners = []
+
+def add_participant_listener(callback):
+    """Call callback() whenever participants (bic_codes or users) change in this process."""
+    _participant_listeners.append(callback)
+
+def participants_changed():
+    """Tell listeners such as the routing directory that bic_codes or users were rewritten."""
+    for callback in list(_participant_listeners):
+        callback()
+
+_reset_listeners = []
+
+def add_reset_listener(callback):
+    """Call callback() after init_db has dropped every table in this process."""
+    _reset_listeners.append(callback)
+
+def database_reset():
+    for callback in list(_reset_listeners):
+        callback()
+
+def init_db(with_sample_data=True):
+    """Recreate the tables, dropping all users, FIs and payments.
+
+    The exchange's own tables (seen_messages, ledger_checkpoint) go too, and
+    reset listeners are told before participant listeners.
+    """
+    conn = get_connection()
+
+    # Drop existing tables in correct order; transactions is the GUI's pre-version-1 payment log
+    conn.executescript('''
+        DROP TABLE IF EXISTS seen_messages;
+        DROP TABLE IF EXISTS ledger_checkpoint;
         DROP TABLE IF EXISTS transactions;
+        DROP TABLE IF EXISTS payments;
         DROP TABLE IF EXISTS users;
         DROP TABLE IF EXISTS bic_codes;
     ''')
+    create_schema(conn)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
 
-    # Create tables with correct schema
-    cursor.executescript('''
-        CREATE TABLE bic_codes (
-            id INTEGER PRIMARY KEY,
-            fi_code TEXT UNIQUE,
-            bic_code TEXT UNIQUE
-        );
-
-        CREATE TABLE users (
-            id INTEGER PRIMARY KEY,
-            name TEXT UNIQUE,
-            fi_code TEXT,
-            balance REAL DEFAULT 1000.00,
-            FOREIGN KEY (fi_code) REFERENCES bic_codes (fi_code)
-        );
-
-        CREATE TABLE transactions (
-            id INTEGER PRIMARY KEY,
-            sender_id INTEGER,
-            receiver_id INTEGER,
-            amount REAL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (sender_id) REFERENCES users (id),
-            FOREIGN KEY (receiver_id) REFERENCES users (id)
-        );
-    ''')
+    if with_sample_data:
+        # Default BIC codes
+        bic_data = [
+            ('001', 'BOFCUS3NXXX'),
+            ('002', 'CHASUS33XXX'),
+            ('003', 'CITIUS33XXX')
+        ]
 
-    # Default BIC codes
-    bic_data = [
-        ('001', 'BOFCUS3NXXX'),
-        ('002', 'CHASUS33XXX'),
-        ('003', 'CITIUS33XXX')
-    ]
-
-    # Default users (no account column)
-    user_data = [
-        ('ABC Corporation', '001', 1000.00),
-        ('Potato Inc.', '002', 1000.00),
-        ('Wallet LLC', '003', 1000.00)
-    ]
-
-    cursor.executemany('INSERT INTO bic_codes (fi_code, bic_code) VALUES (?, ?)', bic_data)
-    cursor.executemany('INSERT INTO users (name, fi_code, balance) VALUES (?, ?, ?)', user_data)
+        # Default users, balances in cents
+        user_data = [
+            ('ABC Corporation', '001', to_minor_units(1000.00)),
+            ('Potato Inc.', '002', to_minor_units(1000.00)),
+            ('Wallet LLC', '003', to_minor_units(1000.00))
+        ]
+
+        conn.executemany('INSERT INTO bic_codes (fi_code, bic_code) VALUES (?, ?)', bic_data)
+        conn.executemany('INSERT INTO users (name, fi_code, balance) VALUES (?, ?, ?)', user_data)
     
     conn.commit()
-    conn.close()
+    database_reset()
+    participants_changed()
+
+def bulk_seed(bic_rows, user_rows, db_path=DB_PATH):
+    """Insert FIs and accounts in a single transaction and return the number of users added.
+
+    bic_rows yields (fi_code, bic_code) and user_rows yields (name, fi_code,
+    balance in cents) or (name, fi_code, account, balance in cents). Both may
+    be generators, so millions of accounts never need to be held in memory.
+    The users.fi_code index is rebuilt once at the end instead of per row.
+    """
+    conn = get_connection(db_path)
+    conn.execute("BEGIN IMMEDIATE TRANSACTION")
+    try:
+        conn.executemany('INSERT INTO bic_codes (fi_code, bic_code) VALUES (?, ?)', bic_rows)
+        conn.execute("DROP INDEX IF EXISTS idx_users_fi_code")
+        before = conn.total_changes
+        user_rows = iter(user_rows)
+        first = next(user_rows, None)
+        if first is not None:
+            if len(first) == 4:
+                insert = 'INSERT INTO users (name, fi_code, account, balance) VALUES (?, ?, ?, ?)'
+            else:
+                insert = 'INSERT INTO users (name, fi_code, balance) VALUES (?, ?, ?)'
+            conn.execute(insert, first)
+            conn.executemany(insert, user_rows)
+        added = conn.total_changes - before
+        create_schema(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    participants_changed()
+    return added
+
+def add_participant(name, fi_code, bic_code, balance=1000.00):
+    """Register a user at an FI, adding the FI's BIC code if it is new. Returns the user id."""
+    conn = get_connection()
+    try:
+        conn.execute('INSERT OR IGNORE INTO bic_codes (fi_code, bic_code) VALUES (?, ?)', (fi_code, bic_code))
+        user_id = conn.execute('INSERT INTO users (name, fi_code, balance) VALUES (?, ?, ?)',
+                               (name, fi_code, to_minor_units(balance))).lastrowid
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    participants_changed()
+    return user_id
 
 def reset_db():
     """Reset the database to its initial state"""
@@ -1,7 +1,7 @@
 import tkinter.messagebox as messagebox
 import customtkinter as ctk
-import sqlite3
 import logging
+from RTR_Logging import configure_logging
 from ISO20022_Pacs008_Generator import (
     get_all_users,
     get_user_by_name,
@@ -9,13 +9,13 @@ from ISO20022_Pacs008_Generator import (
     save_message,
     process_through_rtr
 )
-from ISO20022_Pain001_Generator import generate_pain001_message, save_pain001_message
+from ISO20022_Pain001_Generator import render_pain001_message, save_pain001_message
 from db_manager import reset_db
 from Agent_Debtor_Simulator import FISimulator
 from Analytics_ETL import run_etl
 
 # Configure logging
-logging.basicConfig(filename='settlement_log.txt', level=logging.INFO, format='%(asctime)s - %(message)s')
+configure_logging()
 
 # === Setup customtkinter ===
 ctk.set_appearance_mode("System") 
@@ -271,9 +271,7 @@ class PaymentApp(ctk.CTk):
             return
 
         try:
-            logging.info(f"Initiating payment from {payer_name} to {payee_name} for amount {amount}")
-            conn = sqlite3.connect('payment_system.db')
-            cursor = conn.cursor()
+            logging.info("Initiating payment from %s to %s for amount %s", payer_name, payee_name, amount)
 
             # Reset checkboxes
             for checkbox in self.checkboxes:
@@ -281,8 +279,8 @@ class PaymentApp(ctk.CTk):
 
             # Generate PAIN.001 message
             self.update_process_status(0)  # Debtor Simulator Created PAIN.001
-            pain001_tree = generate_pain001_message(payer, payee, amount)
-            pain001_filename = save_pain001_message(pain001_tree, payer_name)
+            pain001_xml = render_pain001_message(payer, payee, amount)
+            pain001_filename = save_pain001_message(pain001_xml, payer_name)
             self.update_process_status(1)  # Debtor Simulator Sent PAIN.001
             
             # Process through FI Simulator
@@ -291,7 +289,7 @@ class PaymentApp(ctk.CTk):
             self.update_process_status(2)  # Debtor Agent Created PACS.008
             
             if not success:
-                logging.error(f"FI Processing Error: {result}")
+                logging.error("FI Processing Error: %s", result)
                 messagebox.showerror("FI Processing Error", result)
                 return
                 
@@ -316,17 +314,7 @@ class PaymentApp(ctk.CTk):
                 self.update_process_status(14)  # Creditor Agent created CAMT.054
                 self.update_process_status(15)  # Creditor Agent sent CAMT.054
 
-                # Log the transaction
-                cursor.execute("""
-                    INSERT INTO transactions (sender_id, receiver_id, amount)
-                    SELECT s.id, r.id, ?
-                    FROM users s, users r
-                    WHERE s.name = ? AND r.name = ?
-                """, (amount, payer_name, payee_name))
-                
-                conn.commit()
-                conn.close()
-                
+                # Settlement has already recorded the payment in the payments table
                 # Run ETL process
                 run_etl()
                 
@@ -335,18 +323,11 @@ class PaymentApp(ctk.CTk):
                 self.create_payment_screen()
                 messagebox.showinfo("Success", f"Payment processed successfully\nAmount: ${amount:.2f}\nTo: {payee_name}")
             else:
-                conn.rollback()
-                conn.close()
                 messagebox.showerror("RTR Processing Failed", f"Payment failed: {rtr_result}")
 
         except Exception as e:
-            logging.error(f"Transaction failed: {str(e)}")
+            logging.error("Transaction failed: %s", e)
             messagebox.showerror("Error", f"Transaction failed: {str(e)}")
-            try:
-                conn.rollback()
-                conn.close()
-            except:
-                pass
 
 if __name__ == "__main__":
     app = PaymentApp()
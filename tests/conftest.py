@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules configure logging on import; send it somewhere other than the checkout
+import RTR_Logging
+RTR_Logging.configure_logging(os.path.join(tempfile.mkdtemp(prefix="rtr_tests_"), "settlement_log.txt"))
+
+import db_manager
+import RTR_Event_Stream
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A scratch directory with a fresh sample database, the way the chain expects to run."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(RTR_Event_Stream, "_event_stream", RTR_Event_Stream.EventStream(str(tmp_path / RTR_Event_Stream.EVENT_STREAM_FILE)))
+    db_manager.init_db()
+    yield tmp_path
+
+    from RTR_Duplicate_Index import close_duplicate_indexes
+    from RTR_Net_Settlement import close_net_settlements
+    from RTR_Liquidity_Queue import close_liquidity_queues
+    close_liquidity_queues()
+    close_net_settlements()
+    close_duplicate_indexes()
+    RTR_Event_Stream._event_stream.close()
+    db_manager.close_connections()
+
+@pytest.fixture
+def bics(workdir):
+    """The sample participants' BICs, each with 1000.00."""
+    conn = db_manager.get_connection()
+    return [row[0] for row in conn.execute("SELECT bic_code FROM bic_codes ORDER BY fi_code")]
+
+def balance(bic_code):
+    conn = db_manager.get_connection()
+    row = conn.execute("""
+        SELECT u.balance FROM users u JOIN bic_codes b ON u.fi_code = b.fi_code WHERE b.bic_code = ?
+    """, (bic_code,)).fetchone()
+    return db_manager.from_minor_units(row[0])
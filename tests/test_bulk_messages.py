@@ -0,0 +1,22 @@
+from conftest import balance
+from ISO20022_Pacs008_Generator import generate_bulk_pacs008_message, save_bulk_message
+from RTR_Exchange_Processor import RTRExchangeProcessor
+
+def bulk_file(debtor, creditor, amounts):
+    transactions = [{"end_to_end_id": f"E2E-{number}", "amount": 1.0, "debtor_bic": debtor, "creditor_bic": creditor,
+                     "debtor": "Debtor", "creditor": "Creditor"} for number in range(len(amounts))]
+    tree = generate_bulk_pacs008_message(transactions)
+    for element, amount in zip(tree.getroot().iter("Amt"), amounts):
+        element.text = amount
+    return save_bulk_message(tree, debtor, creditor)
+
+def test_bulk_file_rejects_bad_amounts_per_transaction(bics):
+    debtor, creditor, _ = bics
+    statuses = {}
+    summary = RTRExchangeProcessor().process_bulk_message(bulk_file(debtor, creditor, ["10.00", "NaN", "-3.00", "inf", "2.50"]),
+                                                          result_callback=statuses.__setitem__)
+    assert summary["settled"] == 2 and summary["transactions"] == 5
+    assert statuses == {"E2E-0": "Settlement Success", "E2E-1": "Settlement Failed: Invalid amount format.",
+                        "E2E-2": "Settlement Failed: Invalid amount format.", "E2E-3": "Settlement Failed: Invalid amount format.",
+                        "E2E-4": "Settlement Success"}
+    assert balance(debtor) == 987.5
@@ -0,0 +1,54 @@
+import sqlite3
+import db_manager
+from db_manager import get_connection, close_connections, SCHEMA_VERSION
+
+# The original (version 0) layout: REAL money and the GUI's transactions table
+V0_SCHEMA = """
+    CREATE TABLE bic_codes (id INTEGER PRIMARY KEY, fi_code TEXT UNIQUE, bic_code TEXT UNIQUE);
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY, name TEXT UNIQUE, fi_code TEXT, balance REAL DEFAULT 1000.00,
+        FOREIGN KEY (fi_code) REFERENCES bic_codes (fi_code)
+    );
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY, sender_id INTEGER, receiver_id INTEGER, amount REAL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (sender_id) REFERENCES users (id),
+        FOREIGN KEY (receiver_id) REFERENCES users (id)
+    );
+    INSERT INTO bic_codes (fi_code, bic_code) VALUES ('001', 'BOFCUS3NXXX'), ('002', 'CHASUS33XXX');
+    INSERT INTO users (name, fi_code, balance) VALUES ('ABC Corporation', '001', 987.66), ('Potato Inc.', '002', 1012.34);
+    INSERT INTO transactions (sender_id, receiver_id, amount, timestamp) VALUES (1, 2, 12.34, '2025-05-02 00:42:07');
+"""
+
+def test_migrates_a_version_0_database(tmp_path):
+    path = str(tmp_path / "v0.db")
+    legacy = sqlite3.connect(path)
+    legacy.executescript(V0_SCHEMA)
+    legacy.close()
+
+    try:
+        conn = get_connection(path)
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert [tuple(row) for row in conn.execute("SELECT name, balance FROM users ORDER BY id")] == [
+            ("ABC Corporation", 98766), ("Potato Inc.", 101234)]
+        # The legacy payment log moves into payments, in cents
+        assert [tuple(row) for row in conn.execute("SELECT sender_id, recipient_id, amount FROM payments")] == [(1, 2, 1234)]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert "transactions" not in tables
+        assert not [table for table in tables if table.endswith("_v0")]
+        assert not conn.execute("PRAGMA foreign_key_check").fetchall()
+    finally:
+        close_connections()
+
+def test_init_db_drops_the_exchange_tables(workdir):
+    conn = get_connection()
+    conn.execute("CREATE TABLE seen_messages (kind TEXT, message_id TEXT)")
+    conn.execute("CREATE TABLE ledger_checkpoint (id INTEGER PRIMARY KEY, journal_seq INTEGER)")
+    conn.commit()
+    resets = []
+    db_manager.add_reset_listener(lambda: resets.append(True))
+
+    db_manager.init_db()
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert not tables & {"seen_messages", "ledger_checkpoint", "transactions"}
+    assert resets
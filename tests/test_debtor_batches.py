@@ -0,0 +1,42 @@
+import xml.etree.ElementTree as ET
+from conftest import balance
+from Agent_Debtor_Simulator import FISimulator
+from ISO20022_Pacs008_Generator import get_all_users
+import ISO20022_Pain001_Generator
+from ISO20022_Pain001_Generator import (generate_pain001_batch, generate_pain001_message, render_pain001_message,
+                                        save_pain001_message)
+from ISO20022_Serializer import serialize_message
+from RTR_Exchange_Processor import RTRExchangeProcessor
+
+def test_batch_is_grouped_by_agent_pair_and_skips_bad_amounts(bics):
+    payer, first_payee, second_payee = sorted(get_all_users(), key=lambda user: user["fi_code"])
+    pain001 = generate_pain001_batch(payer, [(first_payee, 1.0), (second_payee, 2.0), (first_payee, 3.0),
+                                             (first_payee, 4.0), (second_payee, 5.0)])
+    # The fourth transfer's amount is unusable
+    list(pain001.getroot().iter("Amt"))[3].text = "NaN"
+    success, messages = FISimulator(batch_size=2).process_pain001_batch(save_pain001_message(pain001, payer["name"]))
+    assert success
+
+    bulk = [ET.parse(path).getroot() for path in messages]
+    assert [[tx.findtext("Creditor") for tx in root.iter("CdtTrfTxInf")] for root in bulk] == [
+        [first_payee["bic_code"]] * 2, [second_payee["bic_code"]] * 2]
+    assert [[tx.findtext("Amt") for tx in root.iter("CdtTrfTxInf")] for root in bulk] == [["1.00", "3.00"], ["2.00", "5.00"]]
+
+    processor = RTRExchangeProcessor()
+    assert [processor.process_bulk_message(path)["settled"] for path in messages] == [2, 2]
+    assert balance(payer["bic_code"]) == 989.0
+
+def test_rendered_pain001_matches_the_tree(workdir, monkeypatch):
+    monkeypatch.setattr(ISO20022_Pain001_Generator, "next_id", lambda: "MSG-1")
+    monkeypatch.setattr(ISO20022_Pain001_Generator, "creation_timestamp", lambda: "2025-05-02T00:42:07")
+    payer = {"id": 1, "name": "ABC Corporation", "bic_code": "BOFCUS3NXXX"}
+    payee = {"id": 2, "name": "Potato & Sons <Inc.>", "bic_code": "CHASUS33XXX"}
+    for pretty in (True, False):
+        assert render_pain001_message(payer, payee, 125.5, pretty) == serialize_message(
+            generate_pain001_message(payer, payee, 125.5), pretty)
+
+def test_debtor_agent_reads_a_rendered_pain001(bics):
+    payer, payee = get_all_users()[:2]
+    success, pacs008 = FISimulator().process_pain001(save_pain001_message(render_pain001_message(payer, payee, 12.5), payer["name"]))
+    assert success
+    assert RTRExchangeProcessor().process_message(pacs008) == "Settlement Success"
@@ -0,0 +1,61 @@
+import db_manager
+from conftest import balance
+from RTR_Duplicate_Index import DuplicateIndex, get_duplicate_index
+
+def test_detects_repeated_ids(workdir):
+    index = DuplicateIndex()
+    assert not index.check_and_add("M1", "E1")
+    assert index.check_and_add("M1", "E2")
+    assert index.check_and_add("M2", "E1")
+    # The two id kinds are separate namespaces
+    assert not index.check_and_add("E1")
+
+def test_ids_survive_a_restart(workdir):
+    index = DuplicateIndex()
+    index.check_and_add("M1", "E1")
+
+    restarted = DuplicateIndex()
+    assert restarted.check_and_add(end_to_end_id="E1")
+    assert not restarted.check_and_add("M2", "E2")
+
+def test_evicted_ids_are_found_in_the_table(workdir):
+    index = DuplicateIndex(cache_size=2)
+    for number in range(5):
+        index.check_and_add(f"M{number}")
+    assert index.check_and_add("M0")
+    assert list(index.recent) == [("M", "M3"), ("M", "M4")]
+
+def test_ids_recorded_by_another_process_after_opening(workdir):
+    index = DuplicateIndex()
+    # Another process sharing the database accepts a message after this one opened
+    other = DuplicateIndex()
+    assert not other.check_and_add("M1", "E1")
+    assert index.check_and_add("M1", "E2")
+    # A rejected message claims none of its ids
+    assert not index.check_and_add("M2", "E2")
+
+def test_init_db_forgets_every_id(workdir):
+    index = get_duplicate_index()
+    index.check_and_add("M1")
+    db_manager.init_db()
+    assert not index.check_and_add("M1")
+
+def test_exchange_rejects_a_resubmitted_message(bics):
+    from ISO20022_Pacs008_Generator import get_all_users, generate_iso20022_message, save_message
+    from RTR_Exchange_Processor import RTRExchangeProcessor
+    payer, payee = get_all_users()[:2]
+    path = save_message(generate_iso20022_message(payer, payee, 5.0), payer["name"], payee["name"])
+    processor = RTRExchangeProcessor()
+    assert processor.process_message(path) == "Settlement Success"
+    assert processor.process_message(path) == "Settlement Failed: Duplicate message"
+
+def test_coordinator_rejects_a_message_settled_by_a_worker(bics):
+    from RTR_Exchange_Processor import RTRExchangeProcessor
+    from RTR_Exchange_Workers import ExchangeWorkerPool
+    from test_exchange_workers import pacs008_files
+    files = pacs008_files([(bics[0], bics[1], 5.0)])
+    processor = RTRExchangeProcessor()
+    with ExchangeWorkerPool(num_workers=1, poll_interval=0.05) as pool:
+        assert pool.map(files) == ["Settlement Success"]
+    assert processor.process_message(files[0]) == "Settlement Failed: Duplicate message"
+    assert balance(bics[0]) == 995.0
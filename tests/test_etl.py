@@ -0,0 +1,168 @@
+import csv
+import logging
+import pytest
+import Analytics_ETL
+from Analytics_ETL import (run_etl, CSV, PARQUET, new_parse_state, parse_log_lines, new_event_parse_state,
+                           parse_event_lines)
+from ISO20022_Pacs008_Generator import get_all_users, generate_iso20022_message
+from RTR_Event_Stream import EVENT_STREAM_FILE, flush_events
+from RTR_Exchange_Processor import RTRExchangeProcessor
+from RTR_Liquidity_Queue import QUEUED
+from RTR_Logging import LOG_FORMAT
+from RTR_Message_Transport import MEMORY_TRANSPORT
+from RTR_Net_Settlement import ACCEPTED, get_net_settlement
+from RTR_Settlement_Processor import RTRSettlementProcessor
+
+@pytest.fixture
+def exchange_log(bics, caplog):
+    """Captures what the exchange logs, as settlement_log.txt lines."""
+    caplog.set_level(logging.INFO)
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    def take_lines():
+        lines = [formatter.format(record) + "\n" for record in caplog.records]
+        caplog.clear()
+        return lines
+    return take_lines
+
+@pytest.fixture
+def etl_dir(exchange_log, monkeypatch):
+    # run_etl flushes this process's logging; keep it off the test's log file
+    monkeypatch.setattr(Analytics_ETL, "flush_logging", lambda: None)
+
+def send(processor, debtor, creditor, amount):
+    """Run one PACS.008 through the exchange; returns its MsgId and settlement status."""
+    users = {user["bic_code"]: user for user in get_all_users()}
+    pacs008 = generate_iso20022_message(users[debtor], users[creditor], amount)
+    return pacs008.findtext(".//GrpHdr/MsgId"), processor.process_message(pacs008)
+
+def summary(rows):
+    return [(row["transaction_id"], row["sender"], row["receiver"], row["amount"], row["status"]) for row in rows]
+
+def append_log(lines):
+    with open(Analytics_ETL.LOG_FILE, 'a') as log:
+        log.writelines(lines)
+
+def read_csv():
+    with open(Analytics_ETL.OUTPUT_FILE, newline='') as output:
+        return list(csv.DictReader(output))
+
+def test_exchange_log_rows_carry_the_original_msg_id(bics, exchange_log):
+    first, second, third = bics
+    processor = RTRExchangeProcessor(transport=MEMORY_TRANSPORT)
+    # The GUI names its users before handing the payment to the exchange
+    logging.info("Initiating payment from %s to %s for amount %s", "ABC Corporation", "Potato Inc.", 10.0)
+    paid, _ = send(processor, first, second, 10.0)
+    short, status = send(processor, second, third, 2000.0)
+    assert status == "Settlement Failed: Insufficient funds"
+
+    rows = parse_log_lines(exchange_log(), new_parse_state())
+    assert summary(rows) == [(paid, "ABC Corporation", "Potato Inc.", 10.0, "Settlement Success"),
+                             (short, second, third, 2000.0, "Settlement Failed: Insufficient funds")]
+
+def test_net_payments_are_written_when_their_cycle_posts(bics, exchange_log):
+    first, second, third = bics
+    processor = RTRExchangeProcessor(transport=MEMORY_TRANSPORT, settlement_mode="net")
+    state = new_parse_state()
+    payments = [send(processor, first, second, 600.0), send(processor, second, third, 50.0)]
+    assert [status for _, status in payments] == [ACCEPTED, ACCEPTED]
+    assert parse_log_lines(exchange_log(), state) == []
+
+    get_net_settlement().close_cycle()
+    later, _ = send(processor, third, first, 7.0)
+    # The payment after the cycle waits for the next one, under its own MsgId
+    assert summary(parse_log_lines(exchange_log(), state)) == [
+        (payments[0][0], first, second, 600.0, "Settlement Success"), (payments[1][0], second, third, 50.0, "Settlement Success")]
+    get_net_settlement().close_cycle()
+    assert summary(parse_log_lines(exchange_log(), state)) == [(later, third, first, 7.0, "Settlement Success")]
+
+def test_released_payments_are_written_once_under_their_own_msg_id(bics, exchange_log):
+    first, second, third = bics
+    processor = RTRExchangeProcessor(transport=MEMORY_TRANSPORT, liquidity_queue=True)
+    held, status = send(processor, first, second, 1500.0)
+    assert status == QUEUED
+    # The credit releases the held payment, and its notifications, before the credit's own status line
+    credit, _ = send(processor, third, first, 600.0)
+
+    assert summary(parse_log_lines(exchange_log(), new_parse_state())) == [
+        (held, first, second, 1500.0, "Settlement Success"), (credit, third, first, 600.0, "Settlement Success")]
+
+def test_payment_released_before_its_status_line(bics, exchange_log):
+    import db_manager
+    first, second, _ = bics
+    processor = RTRExchangeProcessor(transport=MEMORY_TRANSPORT, liquidity_queue=True)
+    held, _ = send(processor, first, second, 1500.0)
+    conn = db_manager.get_connection()
+    conn.execute("UPDATE users SET balance = 200000 WHERE fi_code = (SELECT fi_code FROM bic_codes WHERE bic_code = ?)", (first,))
+    conn.commit()
+    # Queued behind the held payment, then released with it in the same call
+    behind, status = send(processor, first, second, 1.0)
+    assert status == QUEUED
+
+    assert summary(parse_log_lines(exchange_log(), new_parse_state())) == [
+        (held, first, second, 1500.0, "Settlement Success"), (behind, first, second, 1.0, "Settlement Success")]
+
+def test_incremental_run_appends_only_new_rows(bics, exchange_log, etl_dir, capsys):
+    first, second, _ = bics
+    processor = RTRExchangeProcessor(transport=MEMORY_TRANSPORT)
+    ids = [send(processor, first, second, 10.0)[0], send(processor, first, second, 2000.0)[0]]
+    append_log(exchange_log())
+    run_etl(output_format=CSV)
+    ids.append(send(processor, second, first, 30.0)[0])
+    append_log(exchange_log())
+    capsys.readouterr()
+    run_etl(output_format=CSV)
+
+    assert "1 rows appended" in capsys.readouterr().out
+    rows = read_csv()
+    assert [(row["transaction_id"], row["amount"], row["status_clean"]) for row in rows] == [
+        (ids[0], "10.0", "Success"), (ids[1], "2000.0", "Failure"), (ids[2], "30.0", "Success")]
+    assert (rows[0]["sender_bic"], rows[0]["receiver_bic"]) == (first, second)
+
+def test_partial_last_line_waits_for_the_next_run(bics, exchange_log, etl_dir):
+    msg_id, _ = send(RTRExchangeProcessor(transport=MEMORY_TRANSPORT), bics[0], bics[1], 10.0)
+    lines = exchange_log()
+    status_line = next(i for i, line in enumerate(lines) if " - Settlement status" in line)
+    append_log(lines[:status_line] + [lines[status_line][:30]])
+    run_etl(output_format=CSV)
+    assert read_csv() == []
+    append_log([lines[status_line][30:]] + lines[status_line + 1:])
+    run_etl(output_format=CSV)
+    assert [row["transaction_id"] for row in read_csv()] == [msg_id]
+
+def test_csv_matches_the_pandas_frame(bics, exchange_log):
+    pytest.importorskip("pandas")
+    processor = RTRExchangeProcessor(transport=MEMORY_TRANSPORT)
+    send(processor, bics[0], bics[1], 20.5)
+    send(processor, bics[1], bics[2], 5000.0)
+    transactions = parse_log_lines(exchange_log(), new_parse_state())
+    frame = Analytics_ETL.transform_transactions(transactions)
+    assert [[str(value) for value in row] for row in Analytics_ETL.csv_rows(transactions)] == [
+        [str(value) for value in row] for row in frame.itertuples(index=False)]
+
+def test_incremental_parquet_dataset(bics, exchange_log, etl_dir):
+    pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    processor = RTRExchangeProcessor(transport=MEMORY_TRANSPORT)
+    ids = [send(processor, bics[0], bics[1], 10.0)[0]]
+    append_log(exchange_log())
+    run_etl(output_format=PARQUET)
+    ids.append(send(processor, bics[0], bics[1], 20.0)[0])
+    append_log(exchange_log())
+    run_etl(output_format=PARQUET)
+
+    assert len(Analytics_ETL.read_manifest()) == 2
+    assert list(Analytics_ETL.read_transactions(columns=["transaction_id"])["transaction_id"]) == ids
+    assert [row["transaction_id"] for row in read_csv()] == ids
+
+def test_released_payment_gets_one_event_row(bics):
+    debtor, creditor, other = bics
+    processor = RTRSettlementProcessor(liquidity_queue=True)
+    assert processor.settle_transaction(debtor, creditor, 1500.0, "held") == QUEUED
+    processor.settle_transaction(other, debtor, 600.0, "credit")
+
+    flush_events()
+    with open(EVENT_STREAM_FILE, encoding='utf-8') as events:
+        rows = parse_event_lines(events, new_event_parse_state())
+    assert sorted((row["amount"], row["status"]) for row in rows) == [
+        (600.0, "Settlement Success"), (1500.0, "Settlement Success")]
@@ -0,0 +1,40 @@
+import pytest
+from conftest import balance
+from ISO20022_Pacs008_Generator import get_all_users, generate_iso20022_message, save_message
+from RTR_Exchange_Workers import ExchangeWorkerPool, shard_for_bic, peek_debtor_bic
+
+def pacs008_files(payments):
+    users = {user["bic_code"]: user for user in get_all_users()}
+    return [save_message(generate_iso20022_message(users[debtor], users[creditor], amount), users[debtor]["name"], users[creditor]["name"])
+            for debtor, creditor, amount in payments]
+
+def test_shard_is_stable_and_in_range():
+    assert shard_for_bic("BOFCUS3NXXX", 4) == shard_for_bic("BOFCUS3NXXX", 4)
+    assert all(0 <= shard_for_bic(f"BANK{n}XXXXX", 3) < 3 for n in range(50))
+
+def test_workers_settle_each_debtor_in_order(bics):
+    first, second, third = bics
+    # Only the first of a debtor's two payments fits, so a reordered shard would settle the other one
+    files = pacs008_files([(first, third, 600.0), (second, third, 700.0), (first, third, 500.0), (second, third, 400.0)])
+    assert peek_debtor_bic(files[0]) == first
+
+    with ExchangeWorkerPool(num_workers=2, poll_interval=0.05) as pool:
+        statuses = pool.map(files)
+    assert statuses == ["Settlement Success", "Settlement Success",
+                        "Settlement Failed: Insufficient funds", "Settlement Failed: Insufficient funds"]
+    assert [balance(bic) for bic in bics] == [400.0, 300.0, 2300.0]
+
+def test_dead_worker_fails_its_futures(bics):
+    files = pacs008_files([(bics[0], bics[1], 1.0)])
+    pool = ExchangeWorkerPool(num_workers=1, poll_interval=0.05)
+    try:
+        pool.processes[0].kill()
+        pool.processes[0].join()
+        with pytest.raises(RuntimeError):
+            pool.submit(files[0]).result(timeout=60)
+        # Later messages for the shard are refused straight away
+        with pytest.raises(RuntimeError):
+            pool.submit(files[0]).result(timeout=1)
+    finally:
+        pool.close()
+    assert balance(bics[0]) == 1000.0
@@ -0,0 +1,10 @@
+import pytest
+from ISO20022_Extractors import parse_amount
+
+@pytest.mark.parametrize("text", ["NaN", "nan", "inf", "-Infinity", "0", "-12.50", "twelve"])
+def test_parse_amount_rejects_unusable_amounts(text):
+    with pytest.raises(ValueError):
+        parse_amount(text)
+
+def test_parse_amount_reads_decimal_text():
+    assert parse_amount("1250.75") == 1250.75
@@ -0,0 +1,62 @@
+from RTR_Ledger_Engine import LedgerEngine
+from conftest import balance
+
+def open_ledger():
+    # No background checkpoints, so the test decides when SQLite is written
+    return LedgerEngine(checkpoint_interval=3600, fsync=False)
+
+def test_replays_the_journal_after_a_torn_write(bics):
+    debtor, creditor, _ = bics
+    ledger = open_ledger()
+    assert ledger.settle_batch([(debtor, creditor, 10.0), (debtor, creditor, 5.0)]) == ["Settlement Success"] * 2
+    # The process dies halfway through writing the next entry
+    with open(ledger.journal_path, 'a', encoding='utf-8') as journal:
+        journal.write("3,1,2,70")
+
+    recovered = open_ledger()
+    assert recovered.seq == 2
+    assert recovered.get_balance(debtor) == 985.0
+    assert recovered.get_balance(creditor) == 1015.0
+    with open(recovered.journal_path, encoding='utf-8') as journal:
+        assert len(journal.read().splitlines()) == 2
+    ledger.close()
+    recovered.close()
+    assert balance(debtor) == 985.0
+
+def test_checkpoint_rewrites_the_journal_past_the_checkpoint(bics):
+    debtor, creditor, _ = bics
+    ledger = open_ledger()
+    ledger.settle_batch([(debtor, creditor, 10.0), (debtor, creditor, 5.0)])
+    ledger.checkpoint()
+    with open(ledger.journal_path, encoding='utf-8') as journal:
+        assert journal.read() == ""
+    assert balance(debtor) == 985.0
+
+    ledger.settle(debtor, creditor, 1.0)
+    recovered = open_ledger()
+    assert recovered.seq == 3
+    assert recovered.get_balance(debtor) == 984.0
+    ledger.close()
+    recovered.close()
+
+def test_picks_up_new_participants(bics):
+    import db_manager
+    ledger = open_ledger()
+    db_manager.add_participant("New Bank", "009", "NEWBCATTXXX", balance=50.0)
+    assert ledger.get_balance("NEWBCATTXXX") == 50.0
+    assert ledger.settle("NEWBCATTXXX", bics[0], 20.0) == "Settlement Success"
+    ledger.close()
+
+def test_checkpoint_keeps_settlements_from_other_writers(bics):
+    from RTR_Settlement_Processor import RTRSettlementProcessor
+    first, second, third = bics
+    ledger = open_ledger()
+    ledger.settle(first, second, 10.0)
+    # The GUI's gross processor writes straight to SQLite meanwhile
+    assert RTRSettlementProcessor().settle_transaction(third, first, 100.0) == "Settlement Success"
+
+    ledger.checkpoint()
+    assert [balance(bic) for bic in bics] == [1090.0, 1010.0, 900.0]
+    # The ledger picks up the other writer's credit for the accounts it checkpointed
+    assert ledger.get_balance(first) == 1090.0
+    ledger.close()
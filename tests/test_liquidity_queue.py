@@ -0,0 +1,85 @@
+import random
+import pytest
+import RTR_Liquidity_Queue
+from RTR_Liquidity_Queue import LiquidityQueue, settleable, HIGH, NORMAL
+from RTR_Settlement_Processor import RTRSettlementProcessor
+from conftest import balance
+
+SOLVERS = [RTR_Liquidity_Queue._settleable_python]
+if RTR_Liquidity_Queue.np is not None:
+    SOLVERS.append(settleable)
+
+@pytest.mark.parametrize("solver", SOLVERS)
+def test_gridlocked_ring_settles_together(solver):
+    # 0 -> 1 -> 2 -> 0, each owing more than it holds
+    debtors, creditors, amounts, balances = [0, 1, 2], [1, 2, 0], [500, 500, 500], [100, 0, 0]
+    assert [bool(keep) for keep in solver(debtors, creditors, amounts, balances)] == [True, True, True]
+
+@pytest.mark.parametrize("solver", SOLVERS)
+def test_solver_keeps_queue_order_per_debtor(solver):
+    # Debtor 0's second payment would fit alone, but not behind the first
+    debtors, creditors, amounts, balances = [0, 0], [1, 1], [300, 50], [100, 0]
+    assert [bool(keep) for keep in solver(debtors, creditors, amounts, balances)] == [False, False]
+
+def test_vectorized_solver_matches_fallback():
+    if RTR_Liquidity_Queue.np is None:
+        pytest.skip("numpy is not installed")
+    rng = random.Random(7)
+    rows = sorted((rng.randrange(20), i, rng.randrange(20), rng.randint(1, 1000)) for i in range(2000))
+    queue = ([row[0] for row in rows], [row[2] for row in rows], [row[3] for row in rows],
+             [rng.randint(0, 3000) for _ in range(20)])
+    mask = [bool(keep) for keep in settleable(*queue)]
+    assert mask == RTR_Liquidity_Queue._settleable_python(*queue)
+    positions = list(queue[3])
+    for debtor, creditor, cents, keep in zip(*queue[:3], mask):
+        if keep:
+            positions[debtor] -= cents
+            positions[creditor] += cents
+    assert min(positions) >= 0
+
+def test_pop_fitting_follows_priority_then_arrival(bics):
+    debtor, creditor, _ = bics
+    queue = LiquidityQueue(solve_interval=0)
+    queue.hold(debtor, creditor, 5.0, "first")
+    queue.hold(debtor, creditor, 7.0, "urgent", priority=HIGH)
+    queue.hold(debtor, creditor, 1.0, "second", priority=NORMAL)
+
+    # 12.50 covers the urgent payment and the first one, not the 1.00 behind them
+    fitting = queue.pop_fitting(debtor, 1250)
+    assert [payment[3] for _, payment in fitting] == ["urgent", "first"]
+    queue.settled(len(fitting))
+    assert len(queue) == 1
+
+def test_resolve_gridlock_posts_the_ring(bics):
+    first, second, third = bics
+    processor = RTRSettlementProcessor(liquidity_queue=True)
+    for debtor, creditor in ((first, second), (second, third), (third, first)):
+        assert processor.settle_transaction(debtor, creditor, 1500.0) == RTR_Liquidity_Queue.QUEUED
+
+    assert processor.resolve_gridlock() == 3
+    assert [balance(bic) for bic in bics] == [1000.0, 1000.0, 1000.0]
+    assert len(processor.liquidity_queue) == 0
+
+def test_debtor_settled_by_gridlock_no_longer_holds(bics):
+    import db_manager
+    first, second, third = bics
+    queue = LiquidityQueue(solve_interval=0)
+    for debtor, creditor in ((first, second), (second, third), (third, first)):
+        queue.hold(debtor, creditor, 1500.0)
+    assert len(queue.resolve_gridlock(db_manager.get_connection())) == 3
+
+    # The settled entries are still in their heaps, but nothing is waiting
+    assert not any(queue.holds(bic) for bic in bics)
+
+def test_init_db_drops_held_payments(bics):
+    import db_manager
+    first, second, third = bics
+    processor = RTRSettlementProcessor(liquidity_queue=True)
+    assert processor.settle_transaction(first, second, 1500.0) == RTR_Liquidity_Queue.QUEUED
+
+    db_manager.init_db()
+    assert len(processor.liquidity_queue) == 0
+    assert not processor.liquidity_queue.holds(first)
+    # A credit to the old debtor releases nothing
+    assert processor.settle_transaction(third, first, 600.0) == "Settlement Success"
+    assert [balance(bic) for bic in bics] == [1600.0, 1000.0, 400.0]
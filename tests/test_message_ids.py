@@ -0,0 +1,27 @@
+import pytest
+from RTR_Message_Ids import MessageIdGenerator, node_id, MAX_ID_LENGTH
+
+def test_ids_are_unique_sorted_and_short_enough():
+    generator = MessageIdGenerator()
+    ids = [generator.next_id("MSG") for _ in range(5000)]
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids)
+    assert max(len(message_id) for message_id in ids) <= MAX_ID_LENGTH
+
+def test_longest_node_and_prefix_fit():
+    generator = MessageIdGenerator(node="ABCDEFGH" + "00000")
+    assert len(generator.next_id("PREFIX12")) == MAX_ID_LENGTH
+
+def test_too_long_prefix_is_rejected():
+    with pytest.raises(ValueError):
+        MessageIdGenerator(node="ABCDEFGH" + "00000").next_id("PREFIX123")
+
+@pytest.mark.parametrize("host", ["TOOLONGNODE", "node-1"])
+def test_node_id_rejects_bad_hosts(monkeypatch, host):
+    monkeypatch.setenv("RTR_NODE_ID", host)
+    with pytest.raises(ValueError):
+        node_id()
+
+def test_node_id_starts_with_the_host(monkeypatch):
+    monkeypatch.setenv("RTR_NODE_ID", "EU1")
+    assert node_id().startswith("EU1")
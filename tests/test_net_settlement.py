@@ -0,0 +1,52 @@
+from array import array
+import db_manager
+from conftest import balance
+from RTR_Net_Settlement import NetSettlement, ACCEPTED, net_positions, get_net_settlement
+from RTR_Settlement_Processor import RTRSettlementProcessor
+
+def test_net_positions_are_credits_minus_debits():
+    debtors, creditors, amounts = array('q', [0, 1, 2]), array('q', [1, 2, 0]), array('q', [500, 300, 100])
+    assert list(net_positions(debtors, creditors, amounts, 3)) == [-400, 200, 200]
+
+def test_accepted_payments_settle_when_the_cycle_posts(bics):
+    debtor, creditor, _ = bics
+    net_settlement = NetSettlement(cycle_interval=0)
+    settled = []
+    assert net_settlement.submit(debtor, creditor, 600.0, "first", settled.extend) == ACCEPTED
+    # Admission counts the open cycle's position
+    assert net_settlement.submit(debtor, creditor, 600.0, "second", settled.extend) == "Settlement Failed: Insufficient funds"
+    assert balance(debtor) == 1000.0 and not settled
+
+    assert net_settlement.close_cycle() == 1
+    assert settled == [(debtor, creditor, 600.0, "first")]
+    assert balance(debtor) == 400.0
+    assert balance(creditor) == 1600.0
+
+def test_processor_reports_success_only_after_posting(bics):
+    debtor, creditor, _ = bics
+    notified = []
+    processor = RTRSettlementProcessor(settlement_mode="net", on_settled=lambda *payment: notified.append(payment))
+    assert processor.settle_transaction(debtor, creditor, 10.0, "e2e", notice=("single", "M1")) == ACCEPTED
+    assert not notified
+
+    get_net_settlement().close_cycle()
+    assert notified == [(debtor, creditor, 10.0, "e2e", ("single", "M1"))]
+
+def test_balances_are_read_again_when_participants_change(bics):
+    debtor, creditor, _ = bics
+    net_settlement = get_net_settlement()
+    assert net_settlement.submit(debtor, creditor, 1.0) == ACCEPTED
+
+    conn = db_manager.get_connection()
+    conn.execute("UPDATE users SET balance = 0")
+    conn.commit()
+    db_manager.participants_changed()
+    assert net_settlement.submit(debtor, creditor, 1.0) == "Settlement Failed: Insufficient funds"
+
+def test_init_db_discards_the_open_cycle(bics):
+    debtor, creditor, _ = bics
+    net_settlement = get_net_settlement()
+    assert net_settlement.submit(debtor, creditor, 900.0) == ACCEPTED
+    db_manager.init_db()
+    assert net_settlement.close_cycle() == 0
+    assert net_settlement.submit(debtor, creditor, 900.0) == ACCEPTED
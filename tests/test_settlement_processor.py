@@ -0,0 +1,55 @@
+import math
+import pytest
+from conftest import balance
+from RTR_Settlement_Processor import RTRSettlementProcessor, INVALID_AMOUNT, is_valid_amount
+from RTR_Liquidity_Queue import QUEUED
+
+def test_batch_applies_payments_in_order_against_running_balances(bics):
+    debtor, creditor, other = bics
+    processor = RTRSettlementProcessor()
+    statuses = processor.settle_batch([(debtor, creditor, 600.0), (debtor, other, 600.0), (creditor, debtor, 100.0),
+                                       (debtor, other, 500.0), (debtor, "UNKNOWNXXXX", 1.0)])
+    assert statuses == ["Settlement Success", "Settlement Failed: Insufficient funds", "Settlement Success",
+                        "Settlement Success", "Settlement Failed: Invalid BIC codes"]
+    assert [balance(bic) for bic in bics] == [0.0, 1500.0, 1500.0]
+
+def test_batch_records_one_payment_row_per_success(bics):
+    import db_manager
+    debtor, creditor, _ = bics
+    RTRSettlementProcessor().settle_batch([(debtor, creditor, 1.0), (debtor, creditor, 2.0)])
+    assert db_manager.get_connection().execute("SELECT COUNT(*), SUM(amount) FROM payments").fetchone()[:] == (2, 300)
+
+@pytest.mark.parametrize("amount", [math.nan, math.inf, -5.0, 0.0, 0.001])
+def test_is_valid_amount_rejects_unusable_amounts(amount):
+    assert not is_valid_amount(amount)
+
+def test_batch_fails_only_the_rows_with_bad_amounts(bics):
+    debtor, creditor, _ = bics
+    processor = RTRSettlementProcessor()
+    statuses = processor.settle_batch([(debtor, creditor, 10.0), (debtor, creditor, math.nan),
+                                       (debtor, creditor, -1.0), (debtor, creditor, 2.5)])
+    assert statuses == ["Settlement Success", INVALID_AMOUNT, INVALID_AMOUNT, "Settlement Success"]
+    assert balance(debtor) == 987.5
+    assert balance(creditor) == 1012.5
+
+def test_single_payment_with_nan_amount_is_rejected(bics):
+    debtor, creditor, _ = bics
+    assert RTRSettlementProcessor().settle_transaction(debtor, creditor, math.nan) == INVALID_AMOUNT
+    assert balance(debtor) == 1000.0
+
+def test_new_payment_queues_behind_held_ones(bics):
+    debtor, creditor, other = bics
+    settled = []
+    processor = RTRSettlementProcessor(liquidity_queue=True, on_settled=lambda *payment: settled.append(payment))
+
+    assert processor.settle_transaction(debtor, creditor, 1500.0, "big", notice=("single", "M-big")) == QUEUED
+    # Affordable on its own, but the debtor's held payment goes first
+    assert processor.settle_transaction(debtor, creditor, 1.0, "small", notice=("single", "M-small")) == QUEUED
+    assert processor.settle_batch([(debtor, other, 2.0)], ["bulk-1"], [("bulk", "bulk-1")]) == [QUEUED]
+    assert balance(debtor) == 1000.0
+
+    # The credit releases the queue in arrival order, each with the notice it was held with
+    assert processor.settle_transaction(other, debtor, 600.0) == "Settlement Success"
+    assert [(correlation_id, notice) for _, _, _, correlation_id, notice in settled] == [
+        ("big", ("single", "M-big")), ("small", ("single", "M-small")), ("bulk-1", ("bulk", "bulk-1"))]
+    assert balance(debtor) == 1000.0 + 600.0 - 1500.0 - 1.0 - 2.0